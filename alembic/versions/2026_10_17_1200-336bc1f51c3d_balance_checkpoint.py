@@ -0,0 +1,53 @@
+"""balance checkpoint
+
+Revision ID: 336bc1f51c3d
+Revises:
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '336bc1f51c3d'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'balance_checkpoint',
+        sa.Column('balance_id', sa.Uuid(as_uuid=False), nullable=False, comment='Баланс'),
+        sa.Column('checkpoint_date', sa.Date(), nullable=False, comment='Дата'),
+        sa.Column('company_balance', sa.Numeric(precision=12, scale=2, asdecimal=False), nullable=False,
+                  comment='Баланс организации на конец дня'),
+        sa.Column('id', sa.Uuid(as_uuid=False), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+        sa.ForeignKeyConstraint(['balance_id'], ['cargonomica.balance.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('balance_id', 'checkpoint_date', name='unique_balance_checkpoint_date'),
+        schema='cargonomica',
+        comment=(
+            'Балансы на конец дня. Запись создается за каждый день, в который по балансу были транзакции, '
+            'и содержит баланс после последней транзакции этого дня (по времени прогрузки в БД). '
+            'Поддерживается задачей пересчета балансов.'
+        )
+    )
+
+    # Заполняем балансы на конец дня по имеющейся истории транзакций
+    op.execute(
+        """
+        INSERT INTO cargonomica.balance_checkpoint (balance_id, checkpoint_date, company_balance)
+        SELECT DISTINCT ON (balance_id, date_time_load::date) balance_id, date_time_load::date, company_balance
+        FROM cargonomica.transaction
+        WHERE balance_id IS NOT NULL
+        ORDER BY balance_id, date_time_load::date, date_time_load DESC, id DESC
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('balance_checkpoint', schema='cargonomica')
@@ -0,0 +1,57 @@
+"""transaction load_seq
+
+Revision ID: 8c41d7e2a9f0
+Revises: 336bc1f51c3d
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41d7e2a9f0'
+down_revision: Union[str, None] = '336bc1f51c3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'transaction',
+        sa.Column('load_seq', sa.BigInteger(), nullable=True,
+                  comment='Порядковый номер прогрузки в БД (упорядочивает транзакции с одинаковым временем прогрузки)'),
+        schema='cargonomica'
+    )
+
+    # Нумеруем имеющиеся транзакции в порядке прогрузки
+    op.execute(
+        """
+        UPDATE cargonomica.transaction AS t
+        SET load_seq = numbered.rn
+        FROM (
+            SELECT id, row_number() OVER (ORDER BY date_time_load, id) AS rn
+            FROM cargonomica.transaction
+        ) AS numbered
+        WHERE t.id = numbered.id
+        """
+    )
+
+    op.alter_column('transaction', 'load_seq', nullable=False, schema='cargonomica')
+    op.execute("ALTER TABLE cargonomica.transaction ALTER COLUMN load_seq ADD GENERATED BY DEFAULT AS IDENTITY")
+    op.execute(
+        """
+        SELECT setval(
+            pg_get_serial_sequence('cargonomica.transaction', 'load_seq'),
+            coalesce(max(load_seq), 0) + 1,
+            false
+        )
+        FROM cargonomica.transaction
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('transaction', 'load_seq', schema='cargonomica')
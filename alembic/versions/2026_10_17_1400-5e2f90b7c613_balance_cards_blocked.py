@@ -0,0 +1,34 @@
+"""balance cards_blocked
+
+Revision ID: 5e2f90b7c613
+Revises: 8c41d7e2a9f0
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2f90b7c613'
+down_revision: Union[str, None] = '8c41d7e2a9f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'balance',
+        sa.Column('cards_blocked', sa.Boolean(), nullable=True,
+                  comment=(
+                      'Требуемое состояние карт, вычисленное при последнем пересчете балансов '
+                      '(true - карты должны быть заблокированы, false - разблокированы)'
+                  )),
+        schema='cargonomica'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('balance', 'cards_blocked', schema='cargonomica')
@@ -0,0 +1,65 @@
+"""transaction indexes
+
+Revision ID: a7d3c5e81b24
+Revises: 5e2f90b7c613
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3c5e81b24'
+down_revision: Union[str, None] = '5e2f90b7c613'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_transaction_balance_load',
+        'transaction',
+        ['balance_id', 'date_time_load', 'load_seq'],
+        unique=False,
+        schema='cargonomica',
+        postgresql_include=['total_sum', 'company_balance']
+    )
+    op.create_index(
+        'ix_transaction_system_date',
+        'transaction',
+        ['system_id', 'date_time'],
+        unique=False,
+        schema='cargonomica'
+    )
+    op.create_index(
+        'ix_transaction_card_date',
+        'transaction',
+        ['card_id', 'date_time'],
+        unique=False,
+        schema='cargonomica'
+    )
+    op.create_index(
+        'ix_transaction_type_load',
+        'transaction',
+        ['transaction_type', 'date_time_load'],
+        unique=False,
+        schema='cargonomica',
+        postgresql_include=['balance_id']
+    )
+    op.create_index(
+        'ix_transaction_date_time',
+        'transaction',
+        ['date_time'],
+        unique=False,
+        schema='cargonomica'
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transaction_date_time', table_name='transaction', schema='cargonomica')
+    op.drop_index('ix_transaction_type_load', table_name='transaction', schema='cargonomica')
+    op.drop_index('ix_transaction_card_date', table_name='transaction', schema='cargonomica')
+    op.drop_index('ix_transaction_system_date', table_name='transaction', schema='cargonomica')
+    op.drop_index('ix_transaction_balance_load', table_name='transaction', schema='cargonomica')
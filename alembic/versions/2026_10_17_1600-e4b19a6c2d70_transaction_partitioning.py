@@ -0,0 +1,193 @@
+"""transaction partitioning
+
+Revision ID: e4b19a6c2d70
+Revises: a7d3c5e81b24
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b19a6c2d70'
+down_revision: Union[str, None] = 'a7d3c5e81b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Количество месяцев вперед, на которые создаются секции при миграции
+MONTHS_AHEAD = 3
+
+TRANSACTION_INDEXES = (
+    ('ix_transaction_balance_load', ['balance_id', 'date_time_load', 'load_seq'], ['total_sum', 'company_balance']),
+    ('ix_transaction_system_date', ['system_id', 'date_time'], None),
+    ('ix_transaction_card_date', ['card_id', 'date_time'], None),
+    ('ix_transaction_type_load', ['transaction_type', 'date_time_load'], ['balance_id']),
+    ('ix_transaction_date_time', ['date_time'], None),
+)
+
+TRANSACTION_FOREIGN_KEYS = (
+    ('transaction_card_id_fkey', 'card_id', 'card'),
+    ('transaction_balance_id_fkey', 'balance_id', 'balance'),
+    ('transaction_system_id_fkey', 'system_id', 'system'),
+    ('transaction_outer_goods_id_fkey', 'outer_goods_id', 'outer_goods'),
+    ('transaction_tariff_id_fkey', 'tariff_id', 'tariff'),
+)
+
+
+def _drop_indexes() -> None:
+    for index_name, _, _ in TRANSACTION_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS cargonomica.{index_name}")
+
+
+def _create_constraints_and_indexes() -> None:
+    for constraint_name, column, referent_table in TRANSACTION_FOREIGN_KEYS:
+        op.create_foreign_key(
+            constraint_name,
+            'transaction',
+            referent_table,
+            [column],
+            ['id'],
+            source_schema='cargonomica',
+            referent_schema='cargonomica'
+        )
+
+    for index_name, columns, include in TRANSACTION_INDEXES:
+        op.create_index(
+            index_name,
+            'transaction',
+            columns,
+            unique=False,
+            schema='cargonomica',
+            postgresql_include=include or []
+        )
+
+    op.execute("COMMENT ON TABLE cargonomica.transaction IS 'Транзакции'")
+
+
+def _reset_load_seq() -> None:
+    op.execute(
+        """
+        SELECT setval(
+            pg_get_serial_sequence('cargonomica.transaction', 'load_seq'),
+            coalesce(max(load_seq), 0) + 1,
+            false
+        )
+        FROM cargonomica.transaction
+        """
+    )
+
+
+def upgrade() -> None:
+    op.drop_constraint('money_receipt_transaction_id_fkey', 'money_receipt', type_='foreignkey', schema='cargonomica')
+
+    # Переименовываем исходную таблицу
+    op.rename_table('transaction', 'transaction_old', schema='cargonomica')
+    op.execute("ALTER TABLE cargonomica.transaction_old RENAME CONSTRAINT transaction_pkey TO transaction_old_pkey")
+    _drop_indexes()
+
+    # Создаем секционированную таблицу. Время транзакции является ключом секционирования,
+    # поэтому входит в первичный ключ.
+    op.execute(
+        """
+        CREATE TABLE cargonomica.transaction (
+            LIKE cargonomica.transaction_old INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING COMMENTS
+        ) PARTITION BY RANGE (date_time)
+        """
+    )
+    op.create_primary_key('transaction_pkey', 'transaction', ['id', 'date_time'], schema='cargonomica')
+    _create_constraints_and_indexes()
+
+    # Помесячные секции, начиная с месяца самой ранней транзакции, и секция по умолчанию
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            month_start DATE;
+            last_month DATE := date_trunc('month', NOW() + INTERVAL '{MONTHS_AHEAD} months')::date;
+        BEGIN
+            SELECT coalesce(date_trunc('month', min(date_time)), date_trunc('month', NOW()))::date
+            INTO month_start
+            FROM cargonomica.transaction_old;
+
+            WHILE month_start <= last_month LOOP
+                EXECUTE 'CREATE TABLE IF NOT EXISTS cargonomica.'
+                    || quote_ident('transaction_' || to_char(month_start, '"y"YYYY"m"MM'))
+                    || ' PARTITION OF cargonomica.transaction FOR VALUES FROM ('
+                    || quote_literal(month_start) || ') TO ('
+                    || quote_literal((month_start + INTERVAL '1 month')::date) || ')';
+                month_start := (month_start + INTERVAL '1 month')::date;
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute("CREATE TABLE cargonomica.transaction_default PARTITION OF cargonomica.transaction DEFAULT")
+
+    # Переносим данные
+    op.execute("INSERT INTO cargonomica.transaction SELECT * FROM cargonomica.transaction_old")
+    _reset_load_seq()
+
+    # Ссылка автозачисления на транзакцию дополняется временем транзакции
+    op.add_column(
+        'money_receipt',
+        sa.Column('transaction_date_time', sa.DateTime(), nullable=True,
+                  comment='Время совершения локальной транзакции (ключ секционирования таблицы транзакций)'),
+        schema='cargonomica'
+    )
+    op.execute(
+        """
+        UPDATE cargonomica.money_receipt AS mr
+        SET transaction_date_time = t.date_time
+        FROM cargonomica.transaction_old AS t
+        WHERE t.id = mr.transaction_id
+        """
+    )
+    op.create_foreign_key(
+        'money_receipt_transaction_fkey',
+        'money_receipt',
+        'transaction',
+        ['transaction_id', 'transaction_date_time'],
+        ['id', 'date_time'],
+        source_schema='cargonomica',
+        referent_schema='cargonomica'
+    )
+
+    op.drop_table('transaction_old', schema='cargonomica')
+
+
+def downgrade() -> None:
+    op.drop_constraint('money_receipt_transaction_fkey', 'money_receipt', type_='foreignkey', schema='cargonomica')
+    op.drop_column('money_receipt', 'transaction_date_time', schema='cargonomica')
+
+    op.rename_table('transaction', 'transaction_old', schema='cargonomica')
+    op.execute("ALTER TABLE cargonomica.transaction_old RENAME CONSTRAINT transaction_pkey TO transaction_old_pkey")
+    _drop_indexes()
+
+    op.execute(
+        """
+        CREATE TABLE cargonomica.transaction (
+            LIKE cargonomica.transaction_old INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING COMMENTS
+        )
+        """
+    )
+    op.create_primary_key('transaction_pkey', 'transaction', ['id'], schema='cargonomica')
+    _create_constraints_and_indexes()
+
+    op.execute("INSERT INTO cargonomica.transaction SELECT * FROM cargonomica.transaction_old")
+    _reset_load_seq()
+
+    op.create_foreign_key(
+        'money_receipt_transaction_id_fkey',
+        'money_receipt',
+        'transaction',
+        ['transaction_id'],
+        ['id'],
+        source_schema='cargonomica',
+        referent_schema='cargonomica'
+    )
+
+    # Секции удаляются вместе с секционированной таблицей
+    op.drop_table('transaction_old', schema='cargonomica')
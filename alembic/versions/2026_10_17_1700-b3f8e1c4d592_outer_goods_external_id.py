@@ -0,0 +1,31 @@
+"""outer_goods external_id
+
+Revision ID: b3f8e1c4d592
+Revises: e4b19a6c2d70
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f8e1c4d592'
+down_revision: Union[str, None] = 'e4b19a6c2d70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'outer_goods',
+        sa.Column('external_id', sa.String(length=255), server_default='', nullable=False,
+                  comment='Внешний идентификатор (идентификатор в системе поставщика услуг)'),
+        schema='cargonomica'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('outer_goods', 'external_id', schema='cargonomica')
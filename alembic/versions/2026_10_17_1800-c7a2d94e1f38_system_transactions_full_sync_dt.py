@@ -0,0 +1,31 @@
+"""system transactions_full_sync_dt
+
+Revision ID: c7a2d94e1f38
+Revises: b3f8e1c4d592
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a2d94e1f38'
+down_revision: Union[str, None] = 'b3f8e1c4d592'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'system',
+        sa.Column('transactions_full_sync_dt', sa.DateTime(), nullable=True,
+                  comment='Дата последней полной сверки транзакций за период transaction_days'),
+        schema='cargonomica'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('system', 'transactions_full_sync_dt', schema='cargonomica')
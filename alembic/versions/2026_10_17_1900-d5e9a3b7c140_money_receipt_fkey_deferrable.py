@@ -0,0 +1,33 @@
+"""money_receipt transaction fkey deferrable
+
+Revision ID: d5e9a3b7c140
+Revises: c7a2d94e1f38
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e9a3b7c140'
+down_revision: Union[str, None] = 'c7a2d94e1f38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Проверка ссылок откладывается до конца транзакции только по явному запросу (SET CONSTRAINTS ... DEFERRED):
+    # требуется при переносе транзакций из секции по умолчанию в новую помесячную секцию
+    op.execute(
+        "ALTER TABLE cargonomica.money_receipt "
+        "ALTER CONSTRAINT money_receipt_transaction_fkey DEFERRABLE INITIALLY IMMEDIATE"
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "ALTER TABLE cargonomica.money_receipt "
+        "ALTER CONSTRAINT money_receipt_transaction_fkey NOT DEFERRABLE"
+    )
@@ -1,52 +1,153 @@
+import asyncio
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Any, Tuple
 
-from sqlalchemy import select as sa_select
+import sqlalchemy as sa
+from sqlalchemy import select as sa_select, update as sa_update, func, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
+from src.celery_tasks.balance.config import (CALC_BALANCES_SET_BASED, CALC_BALANCES_CONCURRENCY,
+                                             CALC_CARD_STATES_TRANSITIONS)
+from src.celery_tasks.gpn.config import SYSTEM_SHORT_NAME as GPN_SYSTEM_SHORT_NAME
+from src.celery_tasks.khnp.config import SYSTEM_SHORT_NAME as KHNP_SYSTEM_SHORT_NAME
 from src.celery_tasks.irrelevant_balances import IrrelevantBalances
-from src.database.model.models import Transaction as TransactionOrm, Balance as BalanceOrm
+from src.database.db import DatabaseSessionManager
+from src.database.model.card import CardOrm, BlockingCardReason
+from src.database.model.models import (Transaction as TransactionOrm, Balance as BalanceOrm,
+                                       BalanceCheckpoint as BalanceCheckpointOrm, Company as CompanyOrm,
+                                       CardSystem as CardSystemOrm, System as SystemOrm)
+from src.repositories.balance_checkpoint import BalanceCheckpointRepository
 from src.repositories.base import BaseRepository
 from src.utils.enums import ContractScheme
+from src.utils.exceptions import DBException
 from src.utils.log import ColoredLogger
 
+import traceback
+
 
 class CalcBalances(BaseRepository):
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, logger: ColoredLogger | None = None):
         super().__init__(session=session, user=None)
-        self.logger = ColoredLogger(logfile_name='schedule.log', logger_name='CALC_BALANCES')
+        self.logger = logger if logger else ColoredLogger(logfile_name='schedule.log', logger_name='CALC_BALANCES')
 
-    async def calculate(self, irrelevant_balances: IrrelevantBalances, logger: ColoredLogger) -> Dict[str, List[str]]:
-        balances_dataset = []
-        for balance_id, from_date_time in irrelevant_balances['data'].items():
-            # Вычисляем и устанавливаем балансы в истории транзакций
-            company_balance = await self.calculate_transaction_balances(balance_id, from_date_time)
-            balances_dataset.append({"id": balance_id, "balance": company_balance})
+    async def calculate(self, irrelevant_balances: IrrelevantBalances, logger: ColoredLogger,
+                        sessionmanager: DatabaseSessionManager | None = None) -> Dict[str, List[str]]:
+        if sessionmanager and CALC_BALANCES_CONCURRENCY > 1 and len(irrelevant_balances['data']) > 1:
+            # Вычисляем и устанавливаем балансы в истории транзакций параллельно в нескольких сессиях
+            logger.info(f'Пересчитываю балансы параллельно: не более {CALC_BALANCES_CONCURRENCY} одновременно')
+            closing_balances = await self.recalculate_concurrently(
+                irrelevant_balances_data=irrelevant_balances['data'],
+                sessionmanager=sessionmanager,
+                concurrency=CALC_BALANCES_CONCURRENCY
+            )
 
-        # Обновляем текущие балансы
-        logger.info('Обновляю текущие значения балансов')
-        await self.bulk_update(BalanceOrm, balances_dataset)
+        else:
+            # Вычисляем и устанавливаем балансы в истории транзакций
+            closing_balances = await self.recalculate(irrelevant_balances['data'])
 
         # Вычисляем каким организациям нужно заблокировать карты, а каким разблокировать
-        balance_ids_to_change_card_states = await self.calc_card_states()
+        if CALC_CARD_STATES_TRANSITIONS:
+            balance_ids_to_change_card_states = await self.calc_card_state_transitions()
+
+            # Лимиты обновляем по балансам, значение которых изменилось, и по балансам со сменой состояния карт
+            balance_ids_to_set_limits = set(closing_balances.keys())
+            balance_ids_to_set_limits.update(irrelevant_balances.get('updated', []))
+            balance_ids_to_set_limits.update(balance_ids_to_change_card_states["to_block"])
+            balance_ids_to_set_limits.update(balance_ids_to_change_card_states["to_activate"])
+
+        else:
+            balance_ids_to_change_card_states = await self.calc_card_states()
+            balance_ids_to_set_limits = set(balance_ids_to_change_card_states["to_block"])
+            balance_ids_to_set_limits.update(balance_ids_to_change_card_states["to_activate"])
 
+        balance_ids_to_change_card_states["to_set_limits"] = list(balance_ids_to_set_limits)
         return balance_ids_to_change_card_states
 
-    async def get_initial_transaction(self, balance_id: str, from_date_time: datetime) -> TransactionOrm:
-        stmt = (
-            sa_select(TransactionOrm)
-            .where(TransactionOrm.balance_id == balance_id)
-            .where(TransactionOrm.date_time_load < from_date_time)
-            .order_by(TransactionOrm.date_time_load.desc())
-            .limit(1)
+    async def recalculate(self, irrelevant_balances_data: Dict[str, datetime]) -> Dict[str, float]:
+        """
+        Пересчитывает балансы в истории транзакций, текущие балансы и балансы на конец дня.
+        Все изменения фиксируются одной транзакцией БД.
+        """
+        if not irrelevant_balances_data:
+            return {}
+
+        # Пересчет выполняем с начала суток: начальный баланс берется из баланса на конец предыдущего дня
+        irrelevant_balances_data = {
+            balance_id: from_date_time.replace(hour=0, minute=0, second=0, microsecond=0)
+            for balance_id, from_date_time in irrelevant_balances_data.items()
+        }
+
+        # Блокируем строки балансов до фиксации изменений (SELECT ... FOR UPDATE) в порядке идентификаторов,
+        # как при записи транзакций синхронизацией
+        lock_stmt = (
+            sa_select(BalanceOrm.id)
+            .where(BalanceOrm.id.in_(sorted(irrelevant_balances_data.keys())))
+            .order_by(BalanceOrm.id)
+            .with_for_update()
         )
-        # self.statement(stmt)
-        transaction = await self.select_first(stmt)
-        return transaction
+        await self.select_all(lock_stmt, scalars=False, commit=False)
+
+        if CALC_BALANCES_SET_BASED:
+            # Пересчет одним запросом на стороне БД
+            closing_balances = await self.recalculate_transaction_balances(irrelevant_balances_data)
+
+        else:
+            # Построчный пересчет
+            closing_balances = {}
+            for balance_id, from_date_time in irrelevant_balances_data.items():
+                closing_balances[balance_id] = await self.calculate_transaction_balances(balance_id, from_date_time)
+
+        # Обновляем текущие балансы
+        balances_dataset = [
+            {"id": balance_id, "balance": company_balance}
+            for balance_id, company_balance in closing_balances.items()
+        ]
+        await self.bulk_update(BalanceOrm, balances_dataset, commit=False)
+
+        # Перестраиваем балансы на конец дня
+        checkpoint_repository = BalanceCheckpointRepository(self.session)
+        await checkpoint_repository.rebuild(irrelevant_balances_data, commit=False)
+
+        # Фиксируем все изменения одной транзакцией БД и снимаем блокировку балансов
+        try:
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
 
-    async def get_transactions_to_recalculate(self, balance_id: str, from_date_time: datetime) -> List[TransactionOrm]:
+        return closing_balances
+
+    async def recalculate_concurrently(self, irrelevant_balances_data: Dict[str, datetime],
+                                       sessionmanager: DatabaseSessionManager, concurrency: int) -> Dict[str, float]:
+        """
+        Каждый баланс пересчитывается в отдельной сессии из пула соединений.
+        Одновременно обрабатывается не более concurrency балансов.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def recalculate_balance(balance_id: str, from_date_time: datetime) -> Dict[str, float]:
+            async with semaphore:
+                async with sessionmanager.session() as session:
+                    calc_balances = CalcBalances(session, self.logger)
+                    return await calc_balances.recalculate({balance_id: from_date_time})
+
+        results = await asyncio.gather(*[
+            recalculate_balance(balance_id, from_date_time)
+            for balance_id, from_date_time in irrelevant_balances_data.items()
+        ])
+
+        closing_balances = {}
+        for result in results:
+            closing_balances.update(result)
+
+        return closing_balances
+
+    async def get_transactions_to_recalculate(self, balance_id: str, from_date_time: datetime, commit: bool = True) \
+            -> List[TransactionOrm]:
         stmt = (
             sa_select(TransactionOrm)
             .options(
@@ -55,37 +156,314 @@ class CalcBalances(BaseRepository):
             )
             .where(TransactionOrm.balance_id == balance_id)
             .where(TransactionOrm.date_time_load >= from_date_time)
-            .order_by(TransactionOrm.date_time_load)
+            .order_by(TransactionOrm.date_time_load, TransactionOrm.load_seq)
         )
-        transactions = await self.select_all(stmt)
+        transactions = await self.select_all(stmt, commit=commit)
         return transactions
 
     async def calculate_transaction_balances(self, balance_id: str, from_date_time: datetime) -> float:
-        # Получаем транзакцию компании, которая предшествует указанному времени
-        initial_transaction = await self.get_initial_transaction(balance_id, from_date_time)
+        # Получаем баланс на конец дня, предшествующего указанному времени
+        checkpoint_repository = BalanceCheckpointRepository(self.session)
+        initial_balance = await checkpoint_repository.get_balance_before(
+            balance_id=balance_id,
+            date_=from_date_time.date(),
+            commit=False
+        )
 
         # Получаем все транзакции компании по указанному балансу, начиная с указанного времени
-        transactions_to_recalculate = await self.get_transactions_to_recalculate(balance_id, from_date_time)
+        transactions_to_recalculate = await self.get_transactions_to_recalculate(balance_id, from_date_time,
+                                                                                 commit=False)
 
         # Пересчитываем балансы
-        previous_transaction = initial_transaction
+        company_balance = initial_balance if initial_balance is not None else 0
         for transaction in transactions_to_recalculate:
-            transaction.company_balance = previous_transaction.company_balance + transaction.total_sum \
-                if previous_transaction else transaction.total_sum
-
-            previous_transaction = transaction
+            company_balance += transaction.total_sum
+            transaction.company_balance = company_balance
 
-        # Сохраняем в БД
+        # Сохраняем в БД. Время транзакции входит в первичный ключ секционированной таблицы.
         dataset = []
         for transaction in transactions_to_recalculate:
             dataset.append({
                 'id': transaction.id,
-                'company_balance_after': transaction.company_balance,
+                'date_time': transaction.date_time,
+                'company_balance': transaction.company_balance,
+            })
+
+        await self.bulk_update(TransactionOrm, dataset, commit=False)
+
+        return company_balance
+
+    async def recalculate_transaction_balances(self, irrelevant_balances_data: Dict[str, datetime]) \
+            -> Dict[str, float]:
+        """
+        Пересчет балансов в истории транзакций на стороне БД одним запросом UPDATE ... FROM.
+        Баланс после каждой транзакции вычисляется оконной функцией SUM(total_sum) OVER (PARTITION BY balance_id)
+        от баланса на конец дня, предшествующего моменту, с которого баланс стал неактуальным.
+        Возвращает итоговые значения балансов: {balance_id: balance}.
+        """
+        if not irrelevant_balances_data:
+            return {}
+
+        # Балансы, требующие пересчета, и время, начиная с которого требуется пересчет
+        irrelevant = sa.values(
+            sa.column('balance_id', sa.Uuid(as_uuid=False)),
+            sa.column('from_date_time', sa.DateTime),
+            name='irrelevant'
+        ).data([
+            (balance_id, from_date_time) for balance_id, from_date_time in irrelevant_balances_data.items()
+        ])
+
+        # Баланс на конец дня, предшествующего началу пересчета (по одному значению на каждый баланс)
+        initial_balance = (
+            sa_select(BalanceCheckpointOrm.company_balance)
+            .where(BalanceCheckpointOrm.balance_id == irrelevant.c.balance_id)
+            .where(BalanceCheckpointOrm.checkpoint_date < sa.cast(irrelevant.c.from_date_time, sa.Date))
+            .order_by(BalanceCheckpointOrm.checkpoint_date.desc())
+            .limit(1)
+            .correlate(irrelevant)
+            .scalar_subquery()
+        )
+        seeds = (
+            sa_select(
+                irrelevant.c.balance_id,
+                irrelevant.c.from_date_time,
+                func.coalesce(initial_balance, 0).label('initial_balance')
+            )
+            .cte('seeds')
+        )
+
+        # Нарастающий итог по транзакциям каждого баланса, начиная с указанного времени
+        running = (
+            sa_select(
+                TransactionOrm.id,
+                TransactionOrm.date_time,
+                (
+                    seeds.c.initial_balance + func.sum(TransactionOrm.total_sum).over(
+                        partition_by=TransactionOrm.balance_id,
+                        order_by=(TransactionOrm.date_time_load, TransactionOrm.load_seq),
+                        rows=(None, 0)
+                    )
+                ).label('company_balance')
+            )
+            .join(seeds, and_(
+                seeds.c.balance_id == TransactionOrm.balance_id,
+                TransactionOrm.date_time_load >= seeds.c.from_date_time
+            ))
+            .cte('running')
+        )
+
+        stmt = (
+            sa_update(TransactionOrm)
+            .where(TransactionOrm.id == running.c.id)
+            # Условие по ключу секционирования позволяет обновлять только затронутые секции
+            .where(TransactionOrm.date_time == running.c.date_time)
+            .where(TransactionOrm.company_balance.is_distinct_from(running.c.company_balance))
+            .values(company_balance=running.c.company_balance)
+            .execution_options(synchronize_session=False)
+        )
+
+        try:
+            await self.session.execute(stmt)
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
+
+        # Итоговый баланс - баланс после последней транзакции. Если транзакций нет, то баланс нулевой.
+        balance_ids = list(irrelevant_balances_data.keys())
+        stmt = (
+            sa_select(TransactionOrm.balance_id, TransactionOrm.company_balance)
+            .where(TransactionOrm.balance_id.in_(balance_ids))
+            .distinct(TransactionOrm.balance_id)
+            .order_by(
+                TransactionOrm.balance_id,
+                TransactionOrm.date_time_load.desc(),
+                TransactionOrm.load_seq.desc()
+            )
+        )
+        dataset = await self.select_all(stmt, scalars=False, commit=False)
+        closing_balances = {balance_id: 0.0 for balance_id in balance_ids}
+        closing_balances.update({str(data[0]): data[1] for data in dataset})
+        return closing_balances
+
+    async def save_transactions(self, transactions: List[Dict[str, Any]],
+                                irrelevant_balances: IrrelevantBalances,
+                                transaction_keys_to_delete: List[Tuple[str, datetime]] | None = None,
+                                use_copy: bool = False) -> None:
+        """
+        Записывает новые транзакции в БД, вычисляя баланс после каждой транзакции в момент записи.
+        Новые транзакции являются последними по времени прогрузки, поэтому баланс вычисляется нарастающим итогом
+        от текущего значения баланса. Если баланс уже помечен на пересчет или текущее значение баланса
+        не совпадает с балансом после последней транзакции, то баланс помечается на пересчет.
+        Удаление транзакций из transaction_keys_to_delete (пары id, date_time), запись новых транзакций, текущих
+        балансов и балансов на конец дня выполняются в одной транзакции БД. Строки изменяемых балансов блокируются
+        до ее завершения: синхронизации с разными поставщиками выполняются параллельно и могут затрагивать один баланс.
+        При use_copy=True транзакции записываются через COPY (большие объемы при синхронизации с поставщиками).
+        """
+        transactions_by_balance = defaultdict(list)
+        for transaction in transactions:
+            transaction['company_balance'] = 0
+            if transaction['balance_id']:
+                transactions_by_balance[str(transaction['balance_id'])].append(transaction)
+
+        # Получаем текущие значения балансов и балансы после последней транзакции
+        balance_ids = sorted(balance_id for balance_id in transactions_by_balance.keys()
+                             if balance_id not in irrelevant_balances['data'])
+        current_balances = {}
+        if balance_ids:
+            # Блокируем строки балансов (в порядке ID, чтобы параллельные синхронизации не попали во взаимную
+            # блокировку). Значения читаются отдельным запросом после получения блокировки, поэтому учитывают
+            # изменения, зафиксированные параллельной синхронизацией.
+            lock_stmt = (
+                sa_select(BalanceOrm.id)
+                .where(BalanceOrm.id.in_(balance_ids))
+                .order_by(BalanceOrm.id)
+                .with_for_update()
+            )
+            await self.select_all(lock_stmt, scalars=False, commit=False)
+
+            last_checkpoint_balance = (
+                sa_select(BalanceCheckpointOrm.company_balance)
+                .where(BalanceCheckpointOrm.balance_id == BalanceOrm.id)
+                .order_by(BalanceCheckpointOrm.checkpoint_date.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+            stmt = (
+                sa_select(BalanceOrm.id, BalanceOrm.balance, func.coalesce(last_checkpoint_balance, 0))
+                .where(BalanceOrm.id.in_(balance_ids))
+            )
+            dataset = await self.select_all(stmt, scalars=False, commit=False)
+            current_balances = {
+                str(balance_id): balance for balance_id, balance, last_transaction_balance in dataset
+                if round(balance - last_transaction_balance, 2) == 0
+            }
+
+        # Вычисляем балансы после транзакций
+        balances_dataset = []
+        checkpoints_dataset = []
+        for balance_id, balance_transactions in transactions_by_balance.items():
+            if balance_id not in current_balances:
+                for transaction in balance_transactions:
+                    irrelevant_balances.add(
+                        balance_id=balance_id,
+                        irrelevancy_date_time=transaction['date_time_load']
+                    )
+                continue
+
+            company_balance = current_balances[balance_id]
+            for transaction in sorted(balance_transactions, key=lambda t: t['date_time_load']):
+                company_balance = round(company_balance + round(transaction['total_sum'], 2), 2)
+                transaction['company_balance'] = company_balance
+
+            balances_dataset.append({"id": balance_id, "balance": company_balance})
+            checkpoints_dataset.append({
+                "balance_id": balance_id,
+                "checkpoint_date": max(t['date_time_load'] for t in balance_transactions).date(),
+                "company_balance": company_balance
             })
-            await self.bulk_update(TransactionOrm, dataset)
+            irrelevant_balances.add_updated(balance_id)
+
+        # Удаляем транзакции, отсутствующие у поставщика
+        await self.bulk_delete(TransactionOrm, transaction_keys_to_delete or [], commit=False,
+                               partition_field="date_time")
+
+        # Сохраняем транзакции, текущие балансы и балансы на конец дня
+        if use_copy:
+            await self.bulk_insert_copy(TransactionOrm, transactions, commit=False)
+        else:
+            await self.bulk_insert_or_update(TransactionOrm, transactions, commit=False)
+
+        await self.bulk_update(BalanceOrm, balances_dataset, commit=False)
+        checkpoint_repository = BalanceCheckpointRepository(self.session)
+        await checkpoint_repository.bulk_upsert(checkpoints_dataset, commit=False)
+
+        # Фиксируем все изменения одной транзакцией БД и снимаем блокировку балансов
+        try:
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
+
+        self.logger.info(
+            f'Балансы вычислены при записи транзакций: {len(balances_dataset)} шт, '
+            f'помечены на пересчет: {len(transactions_by_balance) - len(balances_dataset)} шт'
+        )
+
+    async def calc_card_state_transitions(self) -> Dict[str, List[str]]:
+        """
+        Вычисляет в БД требуемое состояние карт по каждому перекупному балансу. Возвращает балансы, у которых
+        требуемое состояние отличается от подтвержденного (balance.cards_blocked), и балансы, у которых есть карты
+        в состоянии, не соответствующем требуемому (например, карта привязана к организации с заблокированными
+        картами). Подтвержденное состояние записывается методом confirm_card_states после того, как состояние
+        карт установлено в системах поставщиков, поэтому неудавшаяся смена состояния повторяется при следующем
+        вычислении.
+        """
+        # Порог баланса, ниже которого требуется блокировка карт
+        boundary = CompanyOrm.min_balance - sa.case(
+            (CompanyOrm.overdraft_on, func.abs(CompanyOrm.overdraft_sum)),
+            else_=0
+        )
+        cards_blocked = BalanceOrm.balance < boundary
+
+        # Карты организации, состояние которых не соответствует требуемому. Учитываются только карты систем,
+        # в которых состояние карт устанавливается автоматически (ХНП, ГПН): карты других систем остаются
+        # в прежнем состоянии и отбирали бы баланс при каждом вычислении.
+        card_state_mismatch = sa.exists(
+            sa_select(CardOrm.id)
+            .join(CardSystemOrm, CardSystemOrm.card_id == CardOrm.id)
+            .join(SystemOrm, SystemOrm.id == CardSystemOrm.system_id)
+            .where(SystemOrm.short_name.in_([KHNP_SYSTEM_SHORT_NAME, GPN_SYSTEM_SHORT_NAME]))
+            .where(CardOrm.company_id == BalanceOrm.company_id)
+            .where(sa.or_(
+                and_(cards_blocked, CardOrm.is_active),
+                and_(~cards_blocked, ~CardOrm.is_active, CardOrm.reason_for_blocking == BlockingCardReason.NNK)
+            ))
+        )
+
+        stmt = (
+            sa_select(BalanceOrm.id, cards_blocked)
+            .where(BalanceOrm.company_id == CompanyOrm.id)
+            .where(BalanceOrm.scheme == ContractScheme.OVERBOUGHT)
+            .where(sa.or_(BalanceOrm.cards_blocked.is_distinct_from(cards_blocked), card_state_mismatch))
+        )
+        dataset = await self.select_all(stmt, scalars=False)
+
+        balance_ids_to_change_card_states = dict(
+            to_block = [str(balance_id) for balance_id, blocked in dataset if blocked],
+            to_activate = [str(balance_id) for balance_id, blocked in dataset if not blocked]
+        )
+        self.logger.info(
+            f'Смена состояния карт: заблокировать по {len(balance_ids_to_change_card_states["to_block"])} балансам, '
+            f'разблокировать по {len(balance_ids_to_change_card_states["to_activate"])} балансам'
+        )
+        return balance_ids_to_change_card_states
+
+    async def confirm_card_states(self, balance_ids_to_change_card_states: Dict[str, List[str]]) -> None:
+        # Состояние карт установлено в системах поставщиков: сохраняем его как подтвержденное
+        for balance_ids, blocked in ((balance_ids_to_change_card_states["to_block"], True),
+                                     (balance_ids_to_change_card_states["to_activate"], False)):
+            if balance_ids:
+                stmt = (
+                    sa_update(BalanceOrm)
+                    .where(BalanceOrm.id.in_(balance_ids))
+                    .values(cards_blocked=blocked)
+                    .execution_options(synchronize_session=False)
+                )
+                try:
+                    await self.session.execute(stmt)
+
+                except Exception:
+                    self.logger.error(traceback.format_exc())
+                    raise DBException()
+
+        try:
+            await self.session.commit()
 
-        last_balance = previous_transaction.company_balance if previous_transaction else 0
-        return last_balance
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
 
     async def calc_card_states(self) -> Dict[str, List[str]]:
         # Получаем все перекупные балансы
@@ -0,0 +1,18 @@
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Пересчет балансов в истории транзакций выполняется одним запросом на стороне БД (оконная функция).
+# Значение false включает прежний построчный пересчет в Python.
+CALC_BALANCES_SET_BASED = os.environ.get('CALC_BALANCES_SET_BASED', 'true') == 'true'
+
+# Количество балансов, пересчитываемых одновременно (каждый в своей сессии из пула соединений).
+# Значение 1 отключает параллельный пересчет. Не должно превышать размер пула соединений с БД.
+CALC_BALANCES_CONCURRENCY = int(os.environ.get('CALC_BALANCES_CONCURRENCY', '4'))
+
+# Требуемое состояние карт вычисляется в БД. На блокировку / разблокировку передаются только балансы, у которых
+# требуемое состояние отличается от подтвержденного (сохраняется после успешной смены состояния карт у поставщиков),
+# и балансы с картами в несоответствующем состоянии.
+# Значение false включает прежний режим: на блокировку / разблокировку передаются все перекупные балансы.
+CALC_CARD_STATES_TRANSITIONS = os.environ.get('CALC_CARD_STATES_TRANSITIONS', 'true') == 'true'
@@ -8,6 +8,7 @@ from src.celery_tasks.irrelevant_balances import IrrelevantBalances
 from src.database.db import DatabaseSessionManager
 from src.config import PROD_URI
 from src.celery_tasks.balance.calc_balance import CalcBalances
+from src.celery_tasks.balance.config import CALC_CARD_STATES_TRANSITIONS
 
 
 async def calc_balances_fn(irrelevant_balances: IrrelevantBalances) -> Dict[str, List[str]]:
@@ -17,7 +18,7 @@ async def calc_balances_fn(irrelevant_balances: IrrelevantBalances) -> Dict[str,
 
     async with sessionmanager.session() as session:
         cb = CalcBalances(session)
-        balance_ids_to_change_card_states = await cb.calculate(irrelevant_balances, celery_logger)
+        balance_ids_to_change_card_states = await cb.calculate(irrelevant_balances, celery_logger, sessionmanager)
 
     # Закрываем соединение с БД
     await sessionmanager.close()
@@ -26,9 +27,11 @@ async def calc_balances_fn(irrelevant_balances: IrrelevantBalances) -> Dict[str,
 
 @celery.task(name="CALC_BALANCES")
 def calc_balances(irrelevant_balances: IrrelevantBalances) -> Dict[str, List[str]] | None:
-    if not irrelevant_balances['data']:
+    # В режиме CALC_CARD_STATES_TRANSITIONS состояние карт вычисляется и без изменения балансов:
+    # повторяются неподтвержденные смены состояния, обрабатываются вновь привязанные карты
+    if not irrelevant_balances['data'] and not irrelevant_balances.get('updated') and not CALC_CARD_STATES_TRANSITIONS:
         celery_logger.info("Пересчет балансов не требуется")
-        return {"to_block": [], "to_activate": []}
+        return {"to_block": [], "to_activate": [], "to_set_limits": []}
 
     else:
         celery_logger.info("Пересчитываю балансы")
@@ -42,3 +45,23 @@ def calc_balances(irrelevant_balances: IrrelevantBalances) -> Dict[str, List[str
             error = 'Пересчет балансов завершился ошибкой. См лог.'
             celery_logger.info(error)
             raise CeleryError(message=error)
+
+
+async def confirm_card_states_fn(balance_ids_to_change_card_states: Dict[str, List[str]]) -> None:
+    sessionmanager = DatabaseSessionManager()
+    sessionmanager.init(PROD_URI)
+
+    async with sessionmanager.session() as session:
+        cb = CalcBalances(session)
+        await cb.confirm_card_states(balance_ids_to_change_card_states)
+
+    # Закрываем соединение с БД
+    await sessionmanager.close()
+
+
+@celery.task(name="CONFIRM_CARD_STATES")
+def confirm_card_states(balance_ids_to_change_card_states: Dict[str, List[str]]) -> None:
+    # Запускается после успешной смены состояния карт во всех системах поставщиков
+    if balance_ids_to_change_card_states["to_block"] or balance_ids_to_change_card_states["to_activate"]:
+        celery_logger.info("Сохраняю подтвержденное состояние карт")
+        asyncio.run(confirm_card_states_fn(balance_ids_to_change_card_states))
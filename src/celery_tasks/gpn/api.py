@@ -1,19 +1,61 @@
+import asyncio
 import hashlib
+import importlib.util
 import json
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from typing import Dict, Any, List, Tuple
 
-import requests
+import httpx
 from fake_useragent import UserAgent
+from redis import asyncio as redis
 
 from src.celery_tasks.exceptions import CeleryError
-from src.celery_tasks.gpn.config import GPN_USERNAME, GPN_URL, GPN_TOKEN, GPN_PASSWORD
+from src.celery_tasks.gpn.config import GPN_USERNAME, GPN_URL, GPN_TOKEN, GPN_PASSWORD, GPN_DICTIONARY_CACHE_TTL, \
+    GPN_TRANSACTIONS_PAGE_LIMIT, GPN_API_TIMEOUT, GPN_API_MAX_CONNECTIONS, GPN_API_RETRIES, \
+    GPN_REDIS_URL, GPN_SESSION_TTL, GPN_API_RATE_LIMIT, GPN_API_RATE_BURST, GPN_SET_LIMIT_BATCH_SIZE, \
+    GPN_CARDS_SNAPSHOT_TTL, GPN_CARDS_SNAPSHOT_KEEP
 from src.config import PRODUCTION, TZ
 from src.utils.log import ColoredLogger
+from src.utils.page_fetcher import PageFetcher
+from src.utils.rate_limiter import TokenBucket
+
+# Кэш справочников ГПН на время жизни процесса: наименование справочника -> (время получения, записи)
+_dictionary_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+# HTTP/2 используется, если установлен пакет h2 (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class GPNCardsDiff:
+    """
+    Изменения в списке карт ГПН по сравнению с предыдущим снимком.
+    added   - карты, которых не было в предыдущем снимке;
+    removed - карты, отсутствующие в текущем снимке;
+    changed - карты, у которых изменились атрибуты (группа, статус и т.д.).
+    """
+
+    def __init__(self, previous_cards: Dict[str, Dict[str, Any]], cards: Dict[str, Dict[str, Any]]):
+        self.added = [card for card_id, card in cards.items() if card_id not in previous_cards]
+        self.removed = [card for card_id, card in previous_cards.items() if card_id not in cards]
+        self.changed = [
+            card for card_id, card in cards.items()
+            if card_id in previous_cards and card != previous_cards[card_id]
+        ]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self) -> str:
+        return f"GPNCardsDiff(added={len(self.added)}, removed={len(self.removed)}, changed={len(self.changed)})"
 
 
 class GPNApi:
+    """
+    Асинхронный клиент API ГПН. Запросы выполняются через пул постоянных соединений (keep-alive),
+    поэтому не блокируют цикл событий и не устанавливают новое TLS-соединение на каждый вызов.
+    Авторизация выполняется при первом обращении к API. По окончании работы клиент необходимо закрыть (close).
+    """
 
     def __init__(self, logger: ColoredLogger):
         self.logger = logger
@@ -32,20 +74,111 @@ class GPNApi:
             'api_key': api_key
         }
 
+        self.client = httpx.AsyncClient(
+            base_url=self.api_url,
+            headers=self.headers,
+            timeout=httpx.Timeout(GPN_API_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=GPN_API_MAX_CONNECTIONS,
+                max_keepalive_connections=GPN_API_MAX_CONNECTIONS
+            ),
+            http2=HTTP2_AVAILABLE
+        )
+
+        # Сессия API ГПН, общая для всех процессов: хранится в Redis с ограниченным сроком жизни
+        self.redis = redis.Redis.from_url(GPN_REDIS_URL, decode_responses=True)
+        self.session_cache_key = f"cargonomica_gpn_session:{GPN_USERNAME}"
+        self.auth_lock = asyncio.Lock()
+
+        # Ограничение частоты запросов на чтение и запись лимитов
+        self.rate_limiter = TokenBucket(rate=GPN_API_RATE_LIMIT, capacity=GPN_API_RATE_BURST)
         self.api_session_id = None
         self.contract_id = None
-        self.auth_user()
 
         self.product_types = None
 
+    async def close(self) -> None:
+        await self.client.aclose()
+        await self.redis.aclose()
+
+    async def __aenter__(self) -> "GPNApi":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
     def endpoint(self, api_version: str, fn: str, params: Dict[str, Any] | None = None) -> str:
         url = self.api_url + api_version + "/" + fn
         if params:
             url += "?" + "&".join([f"{key}={value}" for key, value in params.items()])
         return url
 
-    def auth_user(self) -> None:
-        """Авторизация пользователя"""
+    async def request(self, method: str, api_version: str, fn: str, params: Dict[str, Any] | None = None,
+                      data: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        if not self.api_session_id:
+            async with self.auth_lock:
+                if not self.api_session_id:
+                    await self.auth_user()
+
+        session_id = self.api_session_id
+        response = await self.send(method, api_version, fn, params, data)
+        res = self.parse_response(response, fn)
+        if self.is_session_expired(response, res):
+            # Сессия истекла или была закрыта: авторизуемся заново и повторяем запрос
+            await self.renew_session(session_id)
+            response = await self.send(method, api_version, fn, params, data)
+            res = self.parse_response(response, fn)
+
+        return res
+
+    async def send(self, method: str, api_version: str, fn: str, params: Dict[str, Any] | None = None,
+                   data: Dict[str, Any] | None = None) -> httpx.Response:
+        try:
+            return await self.client.request(
+                method=method,
+                url=api_version + "/" + fn,
+                params=params,
+                data=data,
+                headers={"session_id": self.api_session_id}
+            )
+
+        except httpx.HTTPError as e:
+            raise CeleryError(message=f"Ошибка при обращении к API ГПН ({fn}): {e!r}")
+
+    @staticmethod
+    def parse_response(response: httpx.Response, fn: str) -> Dict[str, Any]:
+        # Ошибки сервера и ответы не в формате JSON (например, HTML-страница балансировщика) приводятся
+        # к CeleryError: такие запросы повторяются (PageFetcher, повтор задачи Celery)
+        if response.status_code >= 500:
+            raise CeleryError(trace=False, message=f"Ошибка сервера API ГПН ({fn}): HTTP {response.status_code}")
+
+        try:
+            return response.json()
+
+        except ValueError:
+            if response.status_code == 401:
+                return {}
+
+            raise CeleryError(trace=False, message=f"Некорректный ответ API ГПН ({fn}): HTTP {response.status_code}, "
+                                                   f"{response.text[:200]!r}")
+
+    @staticmethod
+    def is_session_expired(response: httpx.Response, res: Dict[str, Any]) -> bool:
+        return response.status_code == 401 or res.get("status", {}).get("code") == 401
+
+    async def get(self, api_version: str, fn: str, params: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        return await self.request("GET", api_version, fn, params=params)
+
+    async def post(self, api_version: str, fn: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.request("POST", api_version, fn, data=data)
+
+    async def auth_user(self, use_cache: bool = True) -> None:
+        """
+        Авторизация пользователя. Сессия хранится в Redis и используется всеми экземплярами клиента
+        во всех процессах, поэтому повторная авторизация выполняется только по истечении сессии.
+        """
+        if use_cache and await self.load_cached_session():
+            return
 
         username = GPN_USERNAME
         password = GPN_PASSWORD
@@ -55,51 +188,92 @@ class GPNApi:
             "login": username,
             "password": password_hash
         }
-        response = requests.post(
-            url=self.endpoint(self.api_v1, "authUser"),
-            headers=self.headers,
-            data=data
-        )
+        try:
+            response = await self.client.post(url=self.api_v1 + "/authUser", data=data)
 
-        res = response.json()
+        except httpx.HTTPError as e:
+            raise CeleryError(message=f"Ошибка при обращении к API ГПН (authUser): {e!r}")
+
+        res = self.parse_response(response, "authUser")
         if res["status"]["code"] != 200:
             raise CeleryError(message=f"Ошибка авторизации. Ответ API: {res['status']['errors']}. "
                                       f"Наш запрос: {data}")
 
         self.api_session_id = res['data']['session_id']
         self.contract_id = res['data']['contracts'][0]['id']
-
-    def contract_info(self) -> Dict[str, Any]:
+        await self.save_cached_session()
+
+    async def renew_session(self, expired_session_id: str) -> None:
+        # Параллельные запросы могут одновременно обнаружить истечение сессии - авторизуется только первый
+        async with self.auth_lock:
+            if self.api_session_id != expired_session_id:
+                return
+
+            self.logger.info("Сессия API ГПН истекла, выполняю повторную авторизацию")
+            await self.delete_cached_session()
+            await self.auth_user(use_cache=False)
+
+    async def load_cached_session(self) -> bool:
+        try:
+            session = await self.redis.hgetall(self.session_cache_key)
+
+        except redis.RedisError as e:
+            self.logger.warning(f"Не удалось получить сессию API ГПН из Redis: {e!r}")
+            return False
+
+        if not session.get("session_id") or not session.get("contract_id"):
+            return False
+
+        self.api_session_id = session["session_id"]
+        self.contract_id = session["contract_id"]
+        return True
+
+    async def save_cached_session(self) -> None:
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self.session_cache_key, mapping={
+                    "session_id": self.api_session_id,
+                    "contract_id": self.contract_id,
+                })
+                pipe.expire(self.session_cache_key, GPN_SESSION_TTL)
+                await pipe.execute()
+
+        except redis.RedisError as e:
+            self.logger.warning(f"Не удалось сохранить сессию API ГПН в Redis: {e!r}")
+
+    async def delete_cached_session(self) -> None:
+        try:
+            await self.redis.delete(self.session_cache_key)
+
+        except redis.RedisError as e:
+            self.logger.warning(f"Не удалось удалить сессию API ГПН из Redis: {e!r}")
+
+    async def init_contract(self) -> None:
+        # Идентификатор договора становится известен после авторизации
+        if not self.contract_id:
+            await self.auth_user()
+
+    async def contract_info(self) -> Dict[str, Any]:
         """Получение информации об организации."""
+        await self.init_contract()
+        return await self.get(self.api_v1, "getPartContractData", params={"contract_id": self.contract_id})
 
-        response = requests.get(
-            url=self.endpoint(self.api_v1, "getPartContractData", params={"contract_id": self.contract_id}),
-            headers=self.headers | {"session_id": self.api_session_id}
-        )
-
-        return response.json()
-
-    def get_card_groups(self) -> List[Dict[str, Any]]:
-        response = requests.get(
-            url=self.endpoint(self.api_v1, "cardGroups", params={"contract_id": self.contract_id}),
-            headers=self.headers | {"session_id": self.api_session_id}
-        )
-        groups = response.json()['data']['result']
+    async def get_card_groups(self) -> List[Dict[str, Any]]:
+        await self.init_contract()
+        res = await self.get(self.api_v1, "cardGroups", params={"contract_id": self.contract_id})
+        groups = res['data']['result']
         return groups
 
-    def create_card_group(self, group_name: str) -> str:
+    async def create_card_group(self, group_name: str) -> str:
+        await self.init_contract()
+
         # Создаем группу в API
         new_group_name = group_name
         data = {
             "contract_id": self.contract_id,
             "name": new_group_name
         }
-        response = requests.post(
-            url=self.endpoint(self.api_v1, "setCardGroup"),
-            headers=self.headers | {"session_id": self.api_session_id},
-            data=data
-        )
-        res = response.json()
+        res = await self.post(self.api_v1, "setCardGroup", data=data)
         if res["status"]["code"] != 200:
             raise CeleryError(message=f"Ошибка при создании группы карт ГПН. Ответ API: {res['status']['errors']}. "
                                       f"Наш запрос: {data}")
@@ -108,42 +282,51 @@ class GPNApi:
         self.logger.info(f"{new_group_name} | в ГПН создана группа карт")
         return gpn_group_id
 
-    def delete_gpn_group(self, group_id: str, group_name: str) -> None:
+    async def delete_gpn_group(self, group_id: str, group_name: str) -> None:
+        await self.init_contract()
+
         # Удаляем группу в API
-        response = requests.post(
-            url=self.endpoint(self.api_v1, "removeCardGroup"),
-            headers=self.headers | {"session_id": self.api_session_id},
-            data={
-                "contract_id": self.contract_id,
-                "group_id": group_id
-            }
-        )
-        res = response.json()
+        res = await self.post(self.api_v1, "removeCardGroup", data={
+            "contract_id": self.contract_id,
+            "group_id": group_id
+        })
+        await self.invalidate_cards_snapshot()
         if not res['data']:
             raise CeleryError(message=f"Не удалось удалить группу карт в ГПН | ID: {group_id} | NAME: {group_name}")
         else:
             self.logger.info(f"В ГПН удалена группа карт | ID: {group_id} | NAME: {group_name}")
 
-    def bind_cards_to_group(self, card_external_ids: List[str], group_id: str) -> None:
-        # Получаем список карт ГПН.
-        # Если картам уже назначена эта группа, то ничего с ней не делаем.
-        # Если картам назначена другая группа, то открепляем карту от группы.
-        remote_cards = self.get_gpn_cards()
+    async def unbind_cards_from_other_groups(self, card_external_ids: List[str], group_id: str,
+                                             remote_cards: List[Dict[str, Any]] | None = None) -> List[str]:
+        """
+        Открепление карт, которым назначена группа, отличная от group_id.
+        Изменения применяются в ГПН не сразу. Возвращает список карт, по которым отправлен запрос на открепление.
+        """
+        if not remote_cards:
+            remote_cards = await self.get_gpn_cards()
+
         remote_cards_to_unbind_group = [
             card for card in remote_cards
             if card['id'] in card_external_ids and card['group_id'] and card['group_id'] != group_id
         ]
-
-        if remote_cards:
-            external_ids = [card['id'] for card in remote_cards_to_unbind_group]
-            self.unbind_cards_from_group(external_ids, remote_cards_to_unbind_group)
-            self.logger.info('Пауза 40 сек')
-            time.sleep(40)
+        external_ids = [card['id'] for card in remote_cards_to_unbind_group]
+        await self.unbind_cards_from_group(external_ids, remote_cards_to_unbind_group)
+        return external_ids
+
+    async def bind_cards_to_group(self, card_external_ids: List[str], group_id: str,
+                                  remote_cards: List[Dict[str, Any]] | None = None) -> None:
+        # Если картам уже назначена эта группа, то ничего с ними не делаем.
+        # Карты должны быть предварительно откреплены от других групп (unbind_cards_from_other_groups).
+        await self.init_contract()
+        if not remote_cards:
+            remote_cards = await self.get_gpn_cards()
 
         card_external_ids_to_bind_group = [
             card['id'] for card in remote_cards
             if card['id'] in card_external_ids and card['group_id'] != group_id
         ]
+        if not card_external_ids_to_bind_group:
+            return None
 
         cards_list = [{"id": card_ext_id, "type": "Attach"} for card_ext_id in card_external_ids_to_bind_group]
         data = {
@@ -151,12 +334,8 @@ class GPNApi:
             "group_id": group_id,
             "cards_list": json.dumps(cards_list)
         }
-        response = requests.post(
-            url=self.endpoint(self.api_v1, "setCardsToGroup"),
-            headers=self.headers | {"session_id": self.api_session_id},
-            data=data
-        )
-        res = response.json()
+        res = await self.post(self.api_v1, "setCardsToGroup", data=data)
+        await self.invalidate_cards_snapshot()
         if res['status']['code'] == 200:
             self.logger.info(f"Прикреплены карты {card_external_ids_to_bind_group} к группе {group_id}")
         else:
@@ -165,14 +344,16 @@ class GPNApi:
                         f"Ответ API ГПН: {res['status']['errors']}. Наш запрос: {data}"
             )
 
-    def unbind_cards_from_group(self, card_external_ids: List[str], remote_cards: List[Dict[str, Any]] | None = None) \
-            -> None:
+    async def unbind_cards_from_group(self, card_external_ids: List[str],
+                                      remote_cards: List[Dict[str, Any]] | None = None) -> None:
         if not card_external_ids:
             return None
 
+        await self.init_contract()
+
         # Получаем список карт ГПН
         if not remote_cards:
-            remote_cards = self.get_gpn_cards()
+            remote_cards = await self.get_gpn_cards()
 
         remote_cards = {card['id']: card for card in remote_cards if card['id'] in card_external_ids}
 
@@ -195,12 +376,8 @@ class GPNApi:
                 "group_id": group_id,
                 "cards_list": json.dumps(cards_list)
             }
-            response = requests.post(
-                url=self.endpoint(self.api_v1, "setCardsToGroup"),
-                headers=self.headers | {"session_id": self.api_session_id},
-                data=data
-            )
-            res = response.json()
+            res = await self.post(self.api_v1, "setCardsToGroup", data=data)
+            await self.invalidate_cards_snapshot()
             if res['status']['code'] == 200:
                 self.logger.info(f"Откреплены карты {[card['id'] for card in cards]} от группы {group_id}")
             else:
@@ -209,165 +386,242 @@ class GPNApi:
                             f"Ответ API ГПН: {res['status']['errors']}. Наш запрос: {data}"
                 )
 
-    def get_gpn_cards(self) -> List[Dict[str, Any]]:
-        response = requests.get(
-            url=self.endpoint(self.api_v2, "cards", params={"contract_id": self.contract_id}),
-            headers=self.headers | {"session_id": self.api_session_id}
-        )
-        resp_data = response.json()
-        gpn_cards = resp_data["data"]["result"]
+    async def get_gpn_cards(self, use_cache: bool = True) -> List[Dict[str, Any]]:
+        return list((await self.get_gpn_cards_map(use_cache)).values())
+
+    async def get_gpn_cards_map(self, use_cache: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        Карты ГПН по идентификатору. Снимок списка карт договора хранится в Redis и используется повторно
+        в течение GPN_CARDS_SNAPSHOT_TTL секунд. Наши изменения карт (группы, блокировки) делают снимок устаревшим.
+        """
+        if use_cache:
+            snapshot = await self.load_cards_snapshot()
+            if snapshot and snapshot["is_actual"]:
+                return snapshot["cards"]
+
+        cards, _ = await self.refresh_gpn_cards()
+        return cards
+
+    async def refresh_gpn_cards(self) -> Tuple[Dict[str, Dict[str, Any]], GPNCardsDiff]:
+        """
+        Получение списка карт от API ГПН. Возвращает карты по идентификатору и изменения относительно
+        предыдущего снимка (при отсутствии снимка все карты считаются новыми).
+        """
+        await self.init_contract()
+        resp_data = await self.get(self.api_v2, "cards", params={"contract_id": self.contract_id})
+        cards = {card['id']: card for card in resp_data["data"]["result"]}
+
+        snapshot = await self.load_cards_snapshot()
+        cards_diff = GPNCardsDiff(snapshot["cards"] if snapshot else {}, cards)
+        await self.save_cards_snapshot(cards)
+        return cards, cards_diff
+
+    @property
+    def cards_snapshot_key(self) -> str:
+        return f"cargonomica_gpn_cards:{self.contract_id}"
+
+    async def load_cards_snapshot(self) -> Dict[str, Any] | None:
+        await self.init_contract()
+        try:
+            snapshot = await self.redis.hgetall(self.cards_snapshot_key)
+
+        except redis.RedisError as e:
+            self.logger.warning(f"Не удалось получить снимок списка карт ГПН из Redis: {e!r}")
+            return None
+
+        if not snapshot.get("cards"):
+            return None
+
+        loaded_at = float(snapshot["loaded_at"]) if snapshot.get("loaded_at") else None
+        return {
+            "cards": json.loads(snapshot["cards"]),
+            "is_actual": loaded_at is not None and time.time() - loaded_at < GPN_CARDS_SNAPSHOT_TTL,
+        }
+
+    async def save_cards_snapshot(self, cards: Dict[str, Dict[str, Any]]) -> None:
+        # Снимок хранится дольше срока актуальности: он нужен для вычисления изменений при следующей загрузке
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self.cards_snapshot_key, mapping={
+                    "cards": json.dumps(cards),
+                    "loaded_at": str(time.time()),
+                })
+                pipe.expire(self.cards_snapshot_key, GPN_CARDS_SNAPSHOT_KEEP)
+                await pipe.execute()
+
+        except redis.RedisError as e:
+            self.logger.warning(f"Не удалось сохранить снимок списка карт ГПН в Redis: {e!r}")
+
+    async def invalidate_cards_snapshot(self) -> None:
+        # Вызывается после изменения карт в ГПН: следующий запрос списка карт обратится к API
+        try:
+            await self.redis.hdel(self.cards_snapshot_key, "loaded_at")
 
-        return gpn_cards
+        except redis.RedisError as e:
+            self.logger.warning(f"Не удалось сбросить снимок списка карт ГПН в Redis: {e!r}")
 
-    def block_cards(self, external_card_ids: List[str]) -> None:
-        self.set_cards_state(external_card_ids, block=True)
+    async def block_cards(self, external_card_ids: List[str]) -> None:
+        await self.set_cards_state(external_card_ids, block=True)
 
-    def activate_cards(self, external_card_ids: List[str]) -> None:
-        self.set_cards_state(external_card_ids, block=False)
+    async def activate_cards(self, external_card_ids: List[str]) -> None:
+        await self.set_cards_state(external_card_ids, block=False)
 
-    def set_cards_state(self, external_card_ids: List[str], block: bool) -> None:
+    async def set_cards_state(self, external_card_ids: List[str], block: bool) -> None:
         if not PRODUCTION:
             action = "Псевдоблокировка" if block else "Псевдоразблокировка"
             for external_card_id in external_card_ids:
                 self.logger.info(f"{action} карты в ННК | {external_card_id}")
         else:
+            await self.init_contract()
             data = {
                 "contract_id": self.contract_id,
                 "card_id": json.dumps(external_card_ids),
                 "block": "true" if block else "false"
             }
-            response = requests.post(
-                url=self.endpoint(self.api_v1, "blockCard"),
-                headers=self.headers | {"session_id": self.api_session_id},
-                data=data
-            )
-            res = response.json()
+            res = await self.post(self.api_v1, "blockCard", data=data)
+            await self.invalidate_cards_snapshot()
             if 'errors' in res['status']:
                 action = "заблокировать" if block else "разблокировать"
                 raise CeleryError(message=f"Не удалось {action} карты в системе ГПН. Ответ API: "
                                           f"{res['status']['errors']}. Наш запрос: {data}")
 
-    def get_transactions(self, transaction_days: int) -> List[Dict[str, Any]]:
+    async def get_transactions(self, transaction_days: int, date_from: date | None = None) -> List[Dict[str, Any]]:
         # Цитата из документации на API:
         # Разница между значениями параметров «date_from» и «date_to» должна быть не больше месяца
         # (рассчитывается от количества дней в месяце, указанном в параметре «date_from»)
         _transaction_days = transaction_days if 0 < transaction_days <= 28 else 28
-        date_from = self.today - timedelta(days=_transaction_days)
+        min_date_from = self.today - timedelta(days=_transaction_days)
+        date_from = max(date_from, min_date_from) if date_from else min_date_from
 
         # Цитата из документации на API:
         # Количество транзакций на странице. 500, если не указано.
-        page_offset = 0
-        transactions = []
-        i = 0
-        while True:
+        async def fetch_page(page_offset: int) -> Dict[str, Any]:
             params = {
                 "date_from": date_from.isoformat(),
                 "date_to": self.today.isoformat(),
-                "page_limit": 100,
+                "page_limit": GPN_TRANSACTIONS_PAGE_LIMIT,
                 "page_offset": page_offset
             }
-            url = self.endpoint(self.api_v2, "transactions", params)
-            response = requests.get(
-                url=url,
-                headers=self.headers | {"session_id": self.api_session_id}
-            )
-            print(url)
-
-            res = response.json()
+            res = await self.get(self.api_v2, "transactions", params=params)
 
             if res["status"]["code"] != 200:
                 raise CeleryError(message=f"Ошибка при получении транзакций. Ответ сервера API: "
                                           f"{res['status']['errors']}. Наш запрос: {params}")
 
-            if not res["data"]["total_count"]:
-                break
+            return res["data"]
 
-            transactions.extend(res["data"]["result"])
-            print('----------------------')
-            print(f'OFFSET: {page_offset}')
-            print(res["data"]["result"])
-            page_offset += 100
-            i += 1
-            if i == 3:
-                break
+        # Первая страница запрашивается отдельно: из нее становится известно общее количество транзакций.
+        # Остальные страницы запрашиваются параллельно, их порядок в результате сохраняется.
+        page_fetcher = PageFetcher(
+            max_in_flight=GPN_API_MAX_CONNECTIONS,
+            retries=GPN_API_RETRIES,
+            retry_on=(CeleryError,),
+            logger=self.logger
+        )
+        first_page = await page_fetcher.fetch_with_retries(fetch_page, 0)
+        page_offsets = range(GPN_TRANSACTIONS_PAGE_LIMIT, first_page["total_count"], GPN_TRANSACTIONS_PAGE_LIMIT)
+        pages = [first_page] + await page_fetcher.fetch_all(fetch_page, page_offsets)
+        transactions = [transaction for page in pages for transaction in page["result"]]
+
+        self.logger.info(f"Получено транзакций от API ГПН за период с {date_from.isoformat()}: {len(transactions)} шт")
 
         for transaction in transactions:
             transaction['timestamp'] = datetime.fromisoformat(transaction['timestamp'][:19])
 
         return transactions
 
-    def set_card_group_limits(self, limits_dataset: List[Tuple[str, int]]) -> None:
-        new_limits = []
-
-        # Получаем все возможные категории продуктов
-        product_types = self.get_product_types()
+    async def set_card_group_limits(self, limits_dataset: List[Tuple[str, int | float]]) -> None:
+        """
+        Установка лимитов на группы карт. limits_dataset - список пар (ЛС организации, сумма лимита).
+        Установленные на группы лимиты запрашиваются один раз, в ГПН отправляются только изменившиеся лимиты,
+        пакетами по GPN_SET_LIMIT_BATCH_SIZE. Частота запросов ограничивается GPN_API_RATE_LIMIT.
+        """
+        # Требуемая сумма лимита по ЛС организации
+        limit_values = {}
+        for personal_account, limit_value in limits_dataset:
+            limit_values[personal_account] = max(int(limit_value), 1)
 
-        # Получаем от ГПН список всех групп
-        groups = self.get_card_groups()
+        if not limit_values:
+            return None
 
-        for limit_data in limits_dataset:
-            personal_account = limit_data[0]
-            limit_value = limit_data[1]
+        # Получаем все возможные категории продуктов
+        product_types = await self.get_product_types()
+
+        # Получаем от ГПН список всех групп. Группы, которых еще нет, создаем.
+        groups = await self.get_card_groups()
+        group_ids = {group['name']: group['id'] for group in groups}
+        current_limits = {}
+        for personal_account in limit_values:
+            if personal_account not in group_ids:
+                group_ids[personal_account] = await self.create_card_group(personal_account)
+                current_limits[personal_account] = []
+
+        # Запрашиваем лимиты, установленные на существующие группы
+        async def fetch_group_limits(group_id: str) -> List[Dict[str, Any]]:
+            await self.rate_limiter.acquire()
+            return await self.get_card_group_limits(group_id)
+
+        page_fetcher = PageFetcher(
+            max_in_flight=GPN_API_MAX_CONNECTIONS,
+            retries=GPN_API_RETRIES,
+            retry_on=(CeleryError,),
+            logger=self.logger
+        )
+        personal_accounts = [
+            personal_account for personal_account in limit_values if personal_account not in current_limits
+        ]
+        group_limits = await page_fetcher.fetch_all(
+            fetch_group_limits,
+            [group_ids[personal_account] for personal_account in personal_accounts]
+        )
+        current_limits.update(zip(personal_accounts, group_limits))
 
-            if limit_value < 1:
-                limit_value = 1
+        new_limits = self.make_card_group_limits_diff(limit_values, group_ids, current_limits, product_types)
+        self.logger.info(f"Лимитов на группы карт ГПН для установки: {len(new_limits)} шт")
 
-            # По ЛС организации определяем ID группы
-            group_id = None
-            for group in groups:
-                if group['name'] == personal_account:
-                    group_id = group['id']
-                    break
+        # Устанавливаем новые лимиты
+        for i in range(0, len(new_limits), GPN_SET_LIMIT_BATCH_SIZE):
+            await self.rate_limiter.acquire()
+            data = {"limit": json.dumps(new_limits[i:i + GPN_SET_LIMIT_BATCH_SIZE])}
+            res = await self.post(self.api_v1, "setLimit", data=data)
 
-            if not group_id:
-                group_id = self.create_card_group(personal_account)
+            if res["status"]["code"] != 200:
+                raise CeleryError(message=f"Ошибка при установке лимитов. Ответ сервера API: "
+                                          f"{res['status']['errors']}. Наш запрос: {data}")
 
-            # Запрашиваем список установленных на группу товарных лимитов
-            limits = self.get_card_group_limits(group_id)
+    def make_card_group_limits_diff(self, limit_values: Dict[str, int], group_ids: Dict[str, str],
+                                    current_limits: Dict[str, List[Dict[str, Any]]],
+                                    product_types: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Лимит должен быть установлен на каждую категорию продуктов. Лимиты, которые уже установлены
+        # с требуемой суммой, не изменяются.
+        new_limits = []
+        for personal_account, limit_value in limit_values.items():
+            limits_by_product_type = {}
+            for limit in current_limits[personal_account]:
+                limits_by_product_type.setdefault(limit['productType'], limit)
 
-            # Проверяем по всем ли категориям продуктов установлен лимит для заданной группы карт
             for product_type in product_types:
-                limit_id = None
-                for limit in limits:
-                    if limit['productType'] == product_type['id']:
-                        # Изменяем лимит на эту категорию товаров для этой группы
-                        limit_id = limit['id']
-                        break
+                limit = limits_by_product_type.get(product_type['id'])
+                if limit and int(limit['sum']['value']) == limit_value:
+                    continue
 
                 new_limits.append(
                     self.make_card_group_limit_data(
-                        limit_id=limit_id,
-                        group_id=group_id,
+                        limit_id=limit['id'] if limit else None,
+                        group_id=group_ids[personal_account],
                         product_type_id=product_type['id'],
                         limit_value=limit_value)
                 )
 
-        # Устанавливаем новые лимиты
-        for new_limit in new_limits:
-            time.sleep(0.5)
-            data = {"limit": json.dumps([new_limit])}
-            print(data)
-            response = requests.post(
-                url=self.endpoint(self.api_v1, "setLimit"),
-                headers=self.headers | {"session_id": self.api_session_id},
-                data=data
-            )
-            res = response.json()
-
-            if res["status"]["code"] != 200:
-                raise CeleryError(message=f"Ошибка при установке лимитов. Ответ сервера API: "
-                                          f"{res['status']['errors']}. Наш запрос: {data}")
+        return new_limits
 
-    def get_card_group_limits(self, group_id: str) -> List[Dict[str, Any]]:
+    async def get_card_group_limits(self, group_id: str) -> List[Dict[str, Any]]:
+        await self.init_contract()
         params = {
             "contract_id": self.contract_id,
             "group_id": group_id,
         }
-        response = requests.get(
-            url=self.endpoint(self.api_v1, "limit", params),
-            headers=self.headers | {"session_id": self.api_session_id}
-        )
-        res = response.json()
+        res = await self.get(self.api_v1, "limit", params=params)
 
         if res["status"]["code"] != 200:
             raise CeleryError(message=f"Ошибка при получении установленных на группу лимитов. Ответ сервера API: "
@@ -396,23 +650,28 @@ class GPNApi:
 
         return data
 
-    def get_product_types(self) -> List[Dict[str, Any]]:
+    async def get_product_types(self) -> List[Dict[str, Any]]:
         if not self.product_types:
-            self.product_types = self.get_dictionary(dictionary_name="ProductType")
+            self.product_types = await self.get_cached_dictionary(dictionary_name="ProductType")
 
         return self.product_types
 
-    def get_goods(self) -> List[Dict[str, Any]]:
-        goods = self.get_dictionary(dictionary_name="Goods")
-        print(goods)
+    async def get_goods(self) -> List[Dict[str, Any]]:
+        goods = await self.get_cached_dictionary(dictionary_name="Goods")
         return goods
 
-    def get_dictionary(self, dictionary_name: str) -> List[Dict[str, Any]]:
-        response = requests.get(
-            url=self.endpoint(self.api_v1, "getDictionary", params={"name": dictionary_name}),
-            headers=self.headers | {"session_id": self.api_session_id}
-        )
-        res = response.json()
+    async def get_cached_dictionary(self, dictionary_name: str) -> List[Dict[str, Any]]:
+        # Справочники меняются редко, поэтому повторно запрашиваются у API только по истечении GPN_DICTIONARY_CACHE_TTL
+        cached = _dictionary_cache.get(dictionary_name)
+        if cached and time.monotonic() - cached[0] < GPN_DICTIONARY_CACHE_TTL:
+            return cached[1]
+
+        dictionary = await self.get_dictionary(dictionary_name)
+        _dictionary_cache[dictionary_name] = (time.monotonic(), dictionary)
+        return dictionary
+
+    async def get_dictionary(self, dictionary_name: str) -> List[Dict[str, Any]]:
+        res = await self.get(self.api_v1, "getDictionary", params={"name": dictionary_name})
 
         if res["status"]["code"] != 200:
             raise CeleryError(message=f"Ошибка при получении справочника {dictionary_name}. Ответ сервера API: "
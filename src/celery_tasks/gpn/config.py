@@ -11,6 +11,50 @@ GPN_USERNAME = os.environ.get('GPN_USERNAME')
 GPN_PASSWORD = os.environ.get('GPN_PASSWORD')
 GPN_TOKEN = os.environ.get('GPN_TOKEN')
 
+# Таймаут запроса к API ГПН, секунд
+GPN_API_TIMEOUT = float(os.environ.get('GPN_API_TIMEOUT', '60'))
+
+# Максимальное количество одновременных соединений с API ГПН
+GPN_API_MAX_CONNECTIONS = int(os.environ.get('GPN_API_MAX_CONNECTIONS', '10'))
+
+# Количество повторных попыток получить страницу данных от API ГПН при ошибке
+GPN_API_RETRIES = int(os.environ.get('GPN_API_RETRIES', '3'))
+
+# Допустимая частота запросов к API ГПН при установке лимитов: запросов в секунду в среднем и подряд без ожидания
+GPN_API_RATE_LIMIT = float(os.environ.get('GPN_API_RATE_LIMIT', '2'))
+GPN_API_RATE_BURST = int(os.environ.get('GPN_API_RATE_BURST', '5'))
+
+# Максимальное количество лимитов в одном запросе setLimit
+GPN_SET_LIMIT_BATCH_SIZE = int(os.environ.get('GPN_SET_LIMIT_BATCH_SIZE', '50'))
+
+# Хранилище Redis, в котором кэшируется сессия API ГПН
+GPN_REDIS_URL = os.environ.get('GPN_REDIS_URL', 'redis://localhost:6379')
+
+# Срок хранения сессии API ГПН в кэше, секунд. Если сессия истечет раньше, авторизация будет выполнена повторно.
+GPN_SESSION_TTL = int(os.environ.get('GPN_SESSION_TTL', '3600'))
+
+# Изменения групп карт (создание группы, открепление карт) применяются в ГПН с задержкой. Следующий шаг привязки
+# карт к группе выполняется отложенно: первая проверка через GPN_GROUP_CHANGE_POLL_INTERVAL секунд, далее интервал
+# удваивается, но не превышает GPN_GROUP_CHANGE_MAX_POLL_INTERVAL. Количество проверок - GPN_GROUP_CHANGE_MAX_RETRIES.
+GPN_GROUP_CHANGE_POLL_INTERVAL = int(os.environ.get('GPN_GROUP_CHANGE_POLL_INTERVAL', '10'))
+GPN_GROUP_CHANGE_MAX_POLL_INTERVAL = int(os.environ.get('GPN_GROUP_CHANGE_MAX_POLL_INTERVAL', '300'))
+GPN_GROUP_CHANGE_MAX_RETRIES = int(os.environ.get('GPN_GROUP_CHANGE_MAX_RETRIES', '10'))
+
+# Срок актуальности снимка списка карт ГПН в Redis, секунд. Снимок хранится GPN_CARDS_SNAPSHOT_KEEP секунд
+# для вычисления изменений в списке карт при следующей загрузке.
+GPN_CARDS_SNAPSHOT_TTL = int(os.environ.get('GPN_CARDS_SNAPSHOT_TTL', '60'))
+GPN_CARDS_SNAPSHOT_KEEP = int(os.environ.get('GPN_CARDS_SNAPSHOT_KEEP', '604800'))
+
+# Количество транзакций на странице при запросе к API ГПН (API допускает не более 500)
+GPN_TRANSACTIONS_PAGE_LIMIT = min(int(os.environ.get('GPN_TRANSACTIONS_PAGE_LIMIT', '500')), 500)
+
+# Периодичность полной сверки транзакций за период transaction_days, часов.
+# В промежутках прогружаются только новые транзакции, начиная с времени последней синхронизации.
+GPN_TRANSACTIONS_FULL_SYNC_INTERVAL = int(os.environ.get('GPN_TRANSACTIONS_FULL_SYNC_INTERVAL', '24'))
+
+# Время хранения справочников ГПН (товары, категории товаров) в кэше, секунд
+GPN_DICTIONARY_CACHE_TTL = int(os.environ.get('GPN_DICTIONARY_CACHE_TTL', '3600'))
+
 # GPN_URL_TEST = "https://api-demo.opti-24.ru/vip/v1/"
 # GPN_USERNAME_TEST = "demo"
 # GPN_PASSWORD_TEST = "auto-generated-pas58-save-it"
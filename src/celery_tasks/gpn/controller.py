@@ -1,16 +1,16 @@
-import time
-from datetime import datetime
-from typing import Dict, Any, List
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple
 
 from sqlalchemy import select as sa_select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
+from src.celery_tasks.balance.calc_balance import CalcBalances
 from src.celery_tasks.gpn.api import GPNApi
-from src.celery_tasks.gpn.config import SYSTEM_SHORT_NAME
+from src.celery_tasks.gpn.config import SYSTEM_SHORT_NAME, GPN_TRANSACTIONS_FULL_SYNC_INTERVAL
 from src.celery_tasks.irrelevant_balances import IrrelevantBalances
-from src.celery_tasks.transaction_helper import get_local_cards, get_local_card, get_tariff_on_date_by_balance, \
-    get_current_tariff_by_balance
+from src.celery_tasks.transaction_helper import get_local_cards, CardIndex, TariffResolver
 from src.config import TZ
 from src.database.model.card import CardOrm, BlockingCardReason
 from src.database.model.card_type import CardTypeOrm
@@ -24,6 +24,7 @@ from src.repositories.system import SystemRepository
 from src.repositories.transaction import TransactionRepository
 from src.utils.enums import ContractScheme, TransactionType
 from src.utils.log import ColoredLogger
+from src.utils.reconciliation import Reconciliation, money_key
 
 
 class GPNController(BaseRepository):
@@ -37,11 +38,12 @@ class GPNController(BaseRepository):
         self.card_groups = []
         self.card_types = {}
 
-        self._local_cards: List[CardOrm] = []
+        self._card_index = CardIndex([])
         self._balance_card_relations: Dict[str, str] = {}
         self._tariffs_history: List[BalanceTariffHistoryOrm] = []
         self._bst_list: List[BalanceSystemTariffOrm] = []
-        self._outer_goods_list: List[OuterGoodsOrm] = []
+        self._tariff_resolver: TariffResolver | None = None
+        self._outer_goods: Dict[str, OuterGoodsOrm] = {}
 
     async def init_system(self) -> None:
         if not self.system:
@@ -60,14 +62,15 @@ class GPNController(BaseRepository):
         # Синхронизируем карты по номеру
         # await self.sync_cards()
 
-        # Прогружаем транзакции
-        # await self.load_transactions(need_authorization=False)
+        # Прогружаем транзакции: полная сверка за период transaction_days выполняется периодически,
+        # в промежутках прогружаются только новые транзакции
+        await self.load_transactions()
 
         # Возвращаем объект со списком транзакций, начиная с которых требуется пересчитать балансы
         return self._irrelevant_balances
 
     async def load_balance(self) -> None:
-        contract_data = self.api.contract_info()
+        contract_data = await self.api.contract_info()
         balance = float(contract_data['data']['balanceData']['available_amount'])
         self.logger.info('Наш баланс в системе {}: {} руб.'.format(self.system.full_name, balance))
 
@@ -81,8 +84,11 @@ class GPNController(BaseRepository):
         await self.init_system()
 
         # Получаем список карт от системы
-        remote_cards = self.api.get_gpn_cards()
+        remote_cards_map, cards_diff = await self.api.refresh_gpn_cards()
+        remote_cards = list(remote_cards_map.values())
         self.logger.info(f"Количество карт в API ГПН: {len(remote_cards)}")
+        self.logger.info(f"Изменения в списке карт ГПН с предыдущей загрузки: новых {len(cards_diff.added)}, "
+                         f"удаленных {len(cards_diff.removed)}, измененных {len(cards_diff.changed)}")
 
         # Получаем типы карт
         await self.get_card_types(remote_cards)
@@ -94,9 +100,9 @@ class GPNController(BaseRepository):
         # Создаем в локальной БД новые карты и привязываем их к ГПН - статус карты из ГПН транслируем на локальную БД.
         # Привязываем в локальной БД карты, открепленные от ГПН - статус не устанавливаем.
         # created_or_updated = False
-        local_card_numbers = [local_card.card_number for local_card in local_cards]
+        card_index = CardIndex(local_cards)
         for remote_card in remote_cards:
-            if remote_card['number'] not in local_card_numbers:
+            if remote_card['number'] not in card_index:
                 is_active = True if "locked" not in remote_card["status"].lower() else False
                 await self.process_unbinded_local_card_or_create_new(
                     external_id=remote_card['id'],
@@ -108,11 +114,10 @@ class GPNController(BaseRepository):
 
         # Локальным картам присваиваем external_id, если не присвоено
         dataset = []
-        for local_card in local_cards:
-            for remote_card in remote_cards:
-                if remote_card['number'] == local_card.card_number:
-                    if remote_card['id'] != local_card.external_id:
-                        dataset.append({"id": local_card.id, "external_id": remote_card['id']})
+        for remote_card in remote_cards:
+            local_card = card_index.get(remote_card['number'])
+            if local_card and remote_card['id'] != local_card.external_id:
+                dataset.append({"id": local_card.id, "external_id": remote_card['id']})
 
         if dataset:
             await self.bulk_update(CardOrm, dataset)
@@ -243,31 +248,67 @@ class GPNController(BaseRepository):
 
             self.logger.info(f"{card_number} | в БД создана новая карта и привязана к ГПН")
 
-    async def gpn_bind_company_to_cards(self, card_ids: List[str], personal_account: str, limit_sum: int | float) \
-            -> None:
-        await self.init_system()
-
-        # Получаем из ГПН группу с наименованием, содержащим personal account
-        # Если нет такой, то создаем.
-        group_id = None
-        # Из API получаем список групп карт
-        groups = self.api.get_card_groups()
+    async def get_company_group_id(self, personal_account: str) -> str | None:
+        # Из API получаем список групп карт и ищем группу с наименованием, равным personal account
+        groups = await self.api.get_card_groups()
         for group in groups:
             if group['name'] == personal_account:
-                group_id = group['id']
-                break
+                return group['id']
+
+        return None
 
+    async def gpn_create_company_group(self, personal_account: str) -> bool:
+        """
+        Привязка карт к организации, шаг 1. Создает в ГПН группу карт организации, если ее нет.
+        Возвращает True, если группа создана: она станет доступна в API ГПН с задержкой.
+        """
+        await self.init_system()
+        if await self.get_company_group_id(personal_account):
+            return False
+
+        await self.api.create_card_group(personal_account)
+        return True
+
+    async def gpn_unbind_cards_from_other_groups(self, card_ids: List[str], personal_account: str,
+                                                 limit_sum: int | float) -> Tuple[str | None, bool]:
+        """
+        Привязка карт к организации, шаг 2. Устанавливает лимит на группу карт организации и открепляет карты
+        от других групп. Возвращает ID группы (None, если группа еще не доступна в API ГПН) и признак того,
+        что карты откреплялись от других групп: открепление применяется в ГПН с задержкой.
+        """
+        await self.init_system()
+        group_id = await self.get_company_group_id(personal_account)
         if not group_id:
-            group_id = self.api.create_card_group(personal_account)
-            self.logger.info("Пауза 40 сек")
-            time.sleep(40)
-            self.api.set_card_group_limits([(personal_account, limit_sum)])
+            return None, False
+
+        await self.api.set_card_group_limits([(personal_account, limit_sum)])
+
+        stmt = sa_select(CardOrm).where(CardOrm.id.in_(card_ids)).order_by(CardOrm.card_number)
+        cards = await self.select_all(stmt)
+        card_external_ids = [card.external_id for card in cards]
+        unbound_card_external_ids = await self.api.unbind_cards_from_other_groups(card_external_ids, group_id)
+        return group_id, bool(unbound_card_external_ids)
 
-        # Привязываем карту к группе в API ГПН
+    async def gpn_bind_cards_to_group(self, card_ids: List[str], group_id: str) -> bool:
+        """
+        Привязка карт к организации, шаг 3. Прикрепляет карты к группе в API ГПН и в локальной БД.
+        Возвращает False, если открепление карт от других групп еще не применено в ГПН.
+        """
+        await self.init_system()
         stmt = sa_select(CardOrm).where(CardOrm.id.in_(card_ids)).order_by(CardOrm.card_number)
         cards = await self.select_all(stmt)
         card_external_ids = [card.external_id for card in cards]
-        self.api.bind_cards_to_group(card_external_ids=card_external_ids, group_id=group_id)
+
+        # Открепление должно быть видно в API ГПН, поэтому снимок списка карт не используется
+        remote_cards = await self.api.get_gpn_cards(use_cache=False)
+        if any(
+            card['id'] in card_external_ids and card['group_id'] and card['group_id'] != group_id
+            for card in remote_cards
+        ):
+            return False
+
+        # Привязываем карты к группе в API ГПН
+        await self.api.bind_cards_to_group(card_external_ids, group_id, remote_cards)
 
         # Привязываем карты к группе в локальной БД
         dataset = [
@@ -277,6 +318,7 @@ class GPNController(BaseRepository):
             } for card in cards
         ]
         await self.bulk_update(CardOrm, dataset)
+        return True
 
     async def gpn_unbind_company_from_cards(self, card_ids: List[str]) -> None:
         await self.init_system()
@@ -286,14 +328,14 @@ class GPNController(BaseRepository):
         card_external_ids = [card.external_id for card in cards]
 
         # Отвязываем карту от группы в API ГПН
-        self.api.unbind_cards_from_group(card_external_ids=card_external_ids)
+        await self.api.unbind_cards_from_group(card_external_ids=card_external_ids)
 
         # Устанавливаем статус карты в API ГПН
-        self.api.block_cards(card_external_ids)
+        await self.api.block_cards(card_external_ids)
 
     async def set_card_states(self, balance_ids_to_change_card_states: Dict[str, List[str]]):
         # В функцию переданы ID балансов, картам которых нужно сменить состояние (заблокировать или разблокировать).
-        # Меняем статус в локальной БД, потом устанавливаем новый статус в системе поставщика.
+        # Устанавливаем новый статус в системе поставщика, потом меняем статус в локальной БД.
         await self.init_system()
 
         # Получаем карты из локальной БД
@@ -310,7 +352,17 @@ class GPNController(BaseRepository):
         )
         local_cards_to_block = [card for card in local_cards_to_block if card.is_active]
 
-        # Обновляем состояние карт в локальной БД
+        # Устанавливаем статусы карт в системе поставщика
+        if local_cards_to_activate:
+            ext_card_ids = [card.external_id for card in local_cards_to_activate]
+            await self.api.activate_cards(ext_card_ids)
+
+        if local_cards_to_block:
+            ext_card_ids = [card.external_id for card in local_cards_to_block]
+            await self.api.block_cards(ext_card_ids)
+
+        # Обновляем состояние карт в локальной БД. Выполняется после успешной смены статусов в ГПН:
+        # при ошибке карты будут отобраны повторно при следующей смене состояния.
         if local_cards_to_activate or local_cards_to_block:
             dataset = [
                 {
@@ -328,15 +380,6 @@ class GPNController(BaseRepository):
             ])
             await self.bulk_update(CardOrm, dataset)
 
-        # Устанавливаем статусы карт в системе поставщика
-        if local_cards_to_activate:
-            ext_card_ids = [card.external_id for card in local_cards_to_activate]
-            self.api.activate_cards(ext_card_ids)
-
-        if local_cards_to_block:
-            ext_card_ids = [card.external_id for card in local_cards_to_block]
-            self.api.block_cards(ext_card_ids)
-
     async def set_card_group_limit(self, balance_ids: List[str]) -> None:
         if not balance_ids:
             print("Получен пустой список балансов для обновления лимитов на группы карт ГПН")
@@ -350,104 +393,192 @@ class GPNController(BaseRepository):
             )
             .where(BalanceOrm.id.in_(balance_ids))
         )
-        balance = await self.select_first(stmt)
+        balances = await self.select_all(stmt)
+
+        # Вычисляем доступный лимит по каждому балансу
+        limits_dataset = []
+        for balance in balances:
+            overdraft_sum = balance.company.overdraft_sum if balance.company.overdraft_on else 0
+            boundary_sum = balance.company.min_balance - overdraft_sum
+            limit_sum = abs(boundary_sum - balance.balance) if boundary_sum < balance.balance else 1
+            limits_dataset.append((balance.company.personal_account, limit_sum))
 
-        # Вычисляем доступный лимит
-        overdraft_sum = balance.company.overdraft_sum if balance.company.overdraft_on else 0
-        boundary_sum = balance.company.min_balance - overdraft_sum
-        limit_sum = abs(boundary_sum - balance.balance) if boundary_sum < balance.balance else 1
+        # Устанавливаем лимиты
+        await self.api.set_card_group_limits(limits_dataset=limits_dataset)
 
-        # Устанавливаем лимит
-        gpn_api = GPNApi(self.logger)
-        gpn_api.set_card_group_limits(limits_dataset=[(balance.company.personal_account, limit_sum)])
+    async def close(self) -> None:
+        await self.api.close()
+
+    def need_full_transactions_sync(self) -> bool:
+        # Полная сверка выполняется при первой синхронизации и далее с периодичностью
+        # GPN_TRANSACTIONS_FULL_SYNC_INTERVAL часов
+        if not self.system.transactions_sync_dt or not self.system.transactions_full_sync_dt:
+            return True
+
+        full_sync_age = datetime.now(tz=TZ).replace(tzinfo=None) - self.system.transactions_full_sync_dt
+        return full_sync_age >= timedelta(hours=GPN_TRANSACTIONS_FULL_SYNC_INTERVAL)
 
     async def load_transactions(self) -> None:
         await self.init_system()
 
-        # Получаем список транзакций от поставщика услуг
-        remote_transactions = self.api.get_transactions(transaction_days=self.system.transaction_days)
+        # Полная сверка транзакций за период transaction_days выполняется периодически. В промежутках
+        # прогружаются только новые транзакции, начиная с суток, предшествующих последней синхронизации.
+        full_sync = self.need_full_transactions_sync()
+        date_from = None if full_sync else self.system.transactions_sync_dt.date() - timedelta(days=1)
+        self.logger.info('Режим синхронизации транзакций ГПН: {}'.format(
+            'полная сверка' if full_sync else f'новые транзакции с {date_from.isoformat()}'
+        ))
+
+        # Получаем список транзакций от поставщика услуг. Одновременно с запросами к API получаем из локальной БД
+        # транзакции для сверки (полная сверка) или идентификаторы уже прогруженных транзакций.
+        transaction_repository = TransactionRepository(self.session, None)
+        if full_sync:
+            local_data_coroutine = transaction_repository.get_recent_system_transaction_rows(
+                system_id=self.system.id,
+                transaction_days=self.system.transaction_days
+            )
+        else:
+            local_data_coroutine = transaction_repository.get_system_transaction_external_ids(
+                system_id=self.system.id,
+                from_date=date_from
+            )
+
+        remote_transactions, local_data = await asyncio.gather(
+            self.api.get_transactions(transaction_days=self.system.transaction_days, date_from=date_from),
+            local_data_coroutine
+        )
         self.logger.info(f'Количество транзакций от системы ГПН: {len(remote_transactions)} шт')
         if not len(remote_transactions):
             return None
 
-        # Получаем список транзакций из локальной БД
-        transaction_repository = TransactionRepository(self.session, None)
-        local_transactions = await transaction_repository.get_recent_system_transactions(
-            system_id=self.system.id,
-            transaction_days=self.system.transaction_days
-        )
-        self.logger.info(f'Количество транзакций из локальной БД: {len(local_transactions)} шт')
+        if full_sync:
+            remote_transactions, to_delete_local = await self.reconcile_transactions(remote_transactions, local_data)
 
-        # Сравниваем транзакции локальные с полученными от системы.
-        # Идентичные транзакции исключаем из списков.
-        self.logger.info('Приступаю к процедуре сравнения локальных транзакций с полученными от системы ГПН')
-        to_delete_local = []
-        for local_transaction in local_transactions:
-            remote_transaction = self.get_equal_remote_transaction(local_transaction, remote_transactions)
-            if remote_transaction:
-                remote_transactions.remove(remote_transaction)
-            else:
-                # Транзакция присутствует локально, но у поставщика услуг её нет.
-                # Помечаем на удаление локальную транзакцию.
-                to_delete_local.append(local_transaction)
-                if local_transaction.balance_id:
-                    self._irrelevant_balances.add(
-                        balance_id=str(local_transaction.balance_id),
-                        irrelevancy_date_time=local_transaction.date_time_load
-                    )
+        else:
+            # Исключаем транзакции, уже прогруженные в локальную БД (по идентификатору транзакции в системе ГПН).
+            # Удаленные в ГПН транзакции будут обнаружены при очередной полной сверке.
+            remote_transactions = [
+                remote_transaction for remote_transaction in remote_transactions
+                if str(remote_transaction['id']) not in local_data
+            ]
+            to_delete_local = []
 
-        # Удаляем помеченные транзакции из БД
+        # Помеченные транзакции удаляются из БД одним запросом в одной транзакции БД с записью новых
+        transaction_keys_to_delete = [(transaction.id, transaction.date_time) for transaction in to_delete_local]
         self.logger.info(f'Удалить тразакции из локальной БД: {len(to_delete_local)} шт')
-        if len(to_delete_local):
-            self.logger.info('Удаляю помеченные локальные транзакции из БД')
-            for transaction in to_delete_local:
-                await self.delete_object(TransactionOrm, transaction.id)
 
         # Транзакции от системы, оставшиеся необработанными,
         # записываем в локальную БД.
         self.logger.info(f'Новые тразакции от системы ГПН: {len(remote_transactions)} шт')
+        inserted_transactions = []
         if len(remote_transactions):
             self.logger.info(
                 'Начинаю обработку транзакций от системы ГПН, которые не обнаружены в локальной БД'
             )
-            await self.process_new_remote_transactions(remote_transactions, transaction_repository)
+            inserted_transactions = await self.process_new_remote_transactions(
+                remote_transactions=remote_transactions,
+                transaction_repository=transaction_repository,
+                transaction_keys_to_delete=transaction_keys_to_delete
+            )
+
+        elif transaction_keys_to_delete:
+            # Новых транзакций нет - удаление фиксируется вместе со временем синхронизации
+            self.logger.info('Удаляю помеченные локальные транзакции из БД')
+            await self.bulk_delete(TransactionOrm, transaction_keys_to_delete, commit=False,
+                                   partition_field="date_time")
 
         # Записываем в БД время последней успешной синхронизации
-        await self.update_object(self.system, update_data={"transactions_sync_dt": datetime.now(tz=TZ)})
+        sync_dt = datetime.now(tz=TZ)
+        update_data = {"transactions_sync_dt": sync_dt}
+        if full_sync:
+            update_data["transactions_full_sync_dt"] = sync_dt
 
-        # Обновляем время последней транзакции для карт
-        await transaction_repository.renew_cards_date_last_use()
+        await self.update_object(self.system, update_data=update_data)
 
-    @staticmethod
-    def get_equal_remote_transaction(local_transaction: TransactionOrm, remote_transactions: List[Dict[str, Any]]) \
-            -> Dict[str, Any] | None:
-        for remote_transaction in remote_transactions:
-            if remote_transaction['timestamp'] == local_transaction.date_time:
-                if remote_transaction['qty'] == abs(local_transaction.fuel_volume):
-                    if remote_transaction['sum'] == abs(local_transaction.transaction_sum):
-                        return remote_transaction
+        # Обновляем время последней транзакции для карт, по которым прогружены или удалены транзакции
+        await transaction_repository.renew_cards_date_last_use(
+            inserted_transactions=inserted_transactions,
+            deleted_card_ids=[transaction.card_id for transaction in to_delete_local if transaction.card_id]
+        )
+
+    async def reconcile_transactions(self, remote_transactions: List[Dict[str, Any]], local_transactions: List[Any]) \
+            -> Tuple[List[Dict[str, Any]], List[Any]]:
+        """
+        Полная сверка транзакций за период transaction_days.
+        Возвращает транзакции ГПН, отсутствующие в локальной БД, и локальные транзакции, отсутствующие в ГПН.
+        """
+        self.logger.info(f'Количество транзакций из локальной БД: {len(local_transactions)} шт')
+
+        # Сравниваем транзакции локальные с полученными от системы.
+        # Идентичные транзакции исключаем из списков.
+        self.logger.info('Приступаю к процедуре сравнения локальных транзакций с полученными от системы ГПН')
+        reconciliation = self.transactions_reconciliation.reconcile(local_transactions, remote_transactions)
+        self.logger.info(f'Результат сравнения: {reconciliation.stats()}')
+
+        # Сопоставленным локальным транзакциям, прогруженным без идентификатора транзакции в системе ГПН,
+        # присваиваем его - по нему новые транзакции отбираются в промежутках между полными сверками
+        external_ids_dataset = [
+            {"id": local_transaction.id, "date_time": local_transaction.date_time,
+             "external_id": str(remote_transaction['id'])}
+            for local_transaction, remote_transaction in reconciliation.matched
+            if local_transaction.external_id != str(remote_transaction['id'])
+        ]
+        await self.bulk_update(TransactionOrm, external_ids_dataset)
+
+        # Транзакции, присутствующие локально, но отсутствующие у поставщика услуг, помечаем на удаление
+        for local_transaction in reconciliation.to_delete:
+            if local_transaction.balance_id:
+                self._irrelevant_balances.add(
+                    balance_id=str(local_transaction.balance_id),
+                    irrelevancy_date_time=local_transaction.date_time_load
+                )
+
+        # Транзакции от поставщика услуг, не обнаруженные в локальной БД
+        return reconciliation.to_insert, reconciliation.to_delete
+
+    # Транзакции сопоставляются по времени, объему топлива и сумме
+    transactions_reconciliation = Reconciliation(
+        local_key=lambda local_transaction: (
+            local_transaction.date_time,
+            money_key(local_transaction.fuel_volume),
+            money_key(local_transaction.transaction_sum)
+        ),
+        remote_key=lambda remote_transaction: (
+            remote_transaction['timestamp'],
+            money_key(remote_transaction['qty']),
+            money_key(remote_transaction['sum'])
+        )
+    )
 
     async def process_new_remote_transactions(self, remote_transactions: List[Dict[str, Any]],
-                                              transaction_repository: TransactionRepository) -> None:
+                                              transaction_repository: TransactionRepository,
+                                              transaction_keys_to_delete: List[Tuple[str, datetime]] | None = None) \
+            -> List[Dict[str, Any]]:
         # Получаем текущие тарифы
         self._bst_list = await transaction_repository.get_balance_system_tariff_list(self.system.id)
 
         # Получаем историю тарифов
         self._tariffs_history = await transaction_repository.get_tariffs_history(self.system.id)
+        self._tariff_resolver = TariffResolver(self._tariffs_history, self._bst_list)
 
-        # Получаем список продуктов / услуг
-        self._outer_goods_list = await transaction_repository.get_outer_goods_list(system_id=self.system.id)
+        # Получаем товары/услуги, недостающие записываем в БД
+        outer_goods_list = await transaction_repository.get_outer_goods_list(system_id=self.system.id)
+        self._outer_goods = await transaction_repository.resolve_outer_goods(
+            system_id=self.system.id,
+            goods_data=await self.get_outer_goods_data(remote_transactions, outer_goods_list),
+            key_field="external_id"
+        )
 
         # Получаем связи карт (Карта-Баланс)
         card_numbers = [transaction['card_number'] for transaction in remote_transactions]
         self._balance_card_relations = await transaction_repository.get_balance_card_relations(card_numbers, self.system.id)
 
         # Получаем карты
-        self._local_cards = await get_local_cards(
+        self._card_index = CardIndex(await get_local_cards(
             session=self.session,
             system_id=self.system.id,
             card_numbers=card_numbers
-        )
+        ))
 
         # Подготавливаем список транзакций для сохранения в БД
         transactions_to_save = []
@@ -458,14 +589,20 @@ class GPNController(BaseRepository):
             )
             if transaction_data:
                 transactions_to_save.append(transaction_data)
-                if transaction_data['balance_id']:
-                    self._irrelevant_balances.add(
-                        balance_id=str(transaction_data['balance_id']),
-                        irrelevancy_date_time=transaction_data['date_time_load']
-                    )
 
-        # Сохраняем транзакции в БД
-        await self.bulk_insert_or_update(TransactionOrm, transactions_to_save)
+        self._card_index.report_missing(self.logger)
+
+        # Сохраняем транзакции в БД. Балансы после транзакций вычисляются при записи,
+        # балансы, требующие пересчета истории, помечаются как неактуальные.
+        calc_balances = CalcBalances(self.session, self.logger)
+        await calc_balances.save_transactions(
+            transactions=transactions_to_save,
+            irrelevant_balances=self._irrelevant_balances,
+            transaction_keys_to_delete=transaction_keys_to_delete,
+            use_copy=True
+        )
+
+        return transactions_to_save
 
     async def process_new_remote_transaction(self, card_number: str, remote_transaction: Dict[str, Any]) \
             -> Dict[str, Any] | None:
@@ -500,19 +637,15 @@ class GPNController(BaseRepository):
             return None
 
         # Получаем карту
-        card = await get_local_card(card_number, self._local_cards)
+        card = self._card_index.resolve(card_number)
+        if not card:
+            return None
 
         # Получаем товар/услугу
-        outer_goods = await self.get_outer_goods(remote_transaction)
+        outer_goods = self._outer_goods.get(remote_transaction['product_id'])
 
         # Получаем тариф
-        tariff = get_tariff_on_date_by_balance(
-            balance_id=balance_id,
-            transaction_date=remote_transaction['timestamp'].date(),
-            tariffs_history=self._tariffs_history
-        )
-        if not tariff:
-            tariff = get_current_tariff_by_balance(balance_id=balance_id, bst_list=self._bst_list)
+        tariff = self._tariff_resolver.resolve(balance_id, remote_transaction['timestamp'].date())
 
         # Сумма транзакции
         transaction_sum = remote_transaction['sum']
@@ -529,6 +662,7 @@ class GPNController(BaseRepository):
         total_sum = transaction_sum - discount_percent + fee_sum
 
         transaction_data = dict(
+            external_id=str(remote_transaction['id']),
             date_time=remote_transaction['timestamp'],
             date_time_load=datetime.now(tz=TZ),
             transaction_type=TransactionType.PURCHASE if remote_transaction['sum'] < 0 else TransactionType.REFUND,
@@ -544,32 +678,31 @@ class GPNController(BaseRepository):
             discount_sum=discount_sum,
             fee_sum=fee_sum,
             total_sum=total_sum,
-            company_balance_after=0,
+            company_balance=0,
             comments='',
         )
 
-        # Это нужно, чтобы в БД у транзакций отличалось время и можно было корректно выбрать транзакцию,
-        # которая предшествовала измененной
-        time.sleep(0.001)
-
         return transaction_data
 
-    async def get_outer_goods(self, remote_transaction: Dict[str, Any]) -> OuterGoodsOrm:
-        # Выполняем поиск товара/услуги
-        for goods in self._outer_goods_list:
-            if goods.external_id == remote_transaction['product_id']:
-                return goods
-
-        # Если продукт не найден, то запрашиваем список продуктов у API,
-        # добавляем его к имеющемуся списку и выполняем повторный поиск
-        gpn_products = self.api.get_products()
-
-        fields = dict(
-            name=product_type,
-            system_id=self.system.id,
-            inner_goods_id=None,
-        )
-        goods = await self.insert(OuterGoodsOrm, **fields)
-        self._outer_goods_list.append(goods)
-
-        return goods
+    async def get_outer_goods_data(self, remote_transactions: List[Dict[str, Any]],
+                                   outer_goods_list: List[OuterGoodsOrm]) -> Dict[str, Dict[str, Any]]:
+        # ГПН идентифицирует товар/услугу кодом, наименование берем из справочника товаров ГПН.
+        # Справочник запрашивается только при появлении новых товаров/услуг.
+        product_ids = {remote_transaction['product_id'] for remote_transaction in remote_transactions}
+        known_product_ids = {goods.external_id for goods in outer_goods_list}
+        if product_ids <= known_product_ids:
+            return {product_id: {} for product_id in product_ids}
+
+        gpn_goods = {goods['id']: goods for goods in await self.api.get_goods()}
+        goods_data = {}
+        names = set()
+        for product_id in sorted(product_ids):
+            name = (gpn_goods.get(product_id, {}).get('name') or product_id)[:50]
+            # Наименование уникально в рамках поставщика услуг
+            if name in names:
+                name = f"{name[:50 - len(product_id) - 3]} ({product_id})"
+
+            names.add(name)
+            goods_data[product_id] = dict(name=name)
+
+        return goods_data
@@ -1,9 +1,11 @@
 import asyncio
 import sys
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
-from src.celery_tasks.exceptions import celery_logger
+from src.celery_tasks.exceptions import celery_logger, CeleryError
 from src.celery_tasks.gpn.api import GPNApi
+from src.celery_tasks.gpn.config import GPN_GROUP_CHANGE_POLL_INTERVAL, GPN_GROUP_CHANGE_MAX_POLL_INTERVAL, \
+    GPN_GROUP_CHANGE_MAX_RETRIES
 from src.celery_tasks.main import celery
 from src.config import PROD_URI
 from src.celery_tasks.gpn.controller import GPNController
@@ -17,7 +19,10 @@ async def gpn_sync_fn() -> IrrelevantBalances:
 
     async with sessionmanager.session() as session:
         gpn = GPNController(session, celery_logger)
-        irrelevant_balances = await gpn.sync()
+        try:
+            irrelevant_balances = await gpn.sync()
+        finally:
+            await gpn.close()
 
     # Закрываем соединение с БД
     await sessionmanager.close()
@@ -37,7 +42,10 @@ async def gpn_set_card_states_fn(balance_ids_to_change_card_states: Dict[str, Li
 
     async with sessionmanager.session() as session:
         gpn_controller = GPNController(session, celery_logger)
-        await gpn_controller.set_card_states(balance_ids_to_change_card_states)
+        try:
+            await gpn_controller.set_card_states(balance_ids_to_change_card_states)
+        finally:
+            await gpn_controller.close()
 
     # Закрываем соединение с БД
     await sessionmanager.close()
@@ -60,21 +68,109 @@ def gpn_set_card_states(balance_ids_to_change_card_states: Dict[str, List[str]])
     return "COMPLETE"
 
 
-async def gpn_cards_bind_company_fn(card_ids: List[str], personal_account: str, limit_sum: int | float) -> None:
+def group_change_poll_countdown(retries: int) -> int:
+    return min(GPN_GROUP_CHANGE_POLL_INTERVAL * 2 ** retries, GPN_GROUP_CHANGE_MAX_POLL_INTERVAL)
+
+
+async def gpn_create_company_group_fn(personal_account: str) -> bool:
     sessionmanager = DatabaseSessionManager()
     sessionmanager.init(PROD_URI)
 
     async with sessionmanager.session() as session:
         gpn = GPNController(session, celery_logger)
-        await gpn.gpn_bind_company_to_cards(card_ids, personal_account, limit_sum)
+        try:
+            group_created = await gpn.gpn_create_company_group(personal_account)
+        finally:
+            await gpn.close()
 
     # Закрываем соединение с БД
     await sessionmanager.close()
+    return group_created
+
+
+@celery.task(name="GPN_CARDS_BIND_COMPANY", bind=True, max_retries=GPN_GROUP_CHANGE_MAX_RETRIES)
+def gpn_cards_bind_company(self, card_ids: List[str], personal_account: str, limit_sum: int | float) -> None:
+    # Привязка карт к организации выполняется в несколько шагов. Изменения групп карт применяются в ГПН
+    # с задержкой, поэтому каждый следующий шаг запускается отложенно и не занимает воркер на время ожидания.
+    # При ошибке обращения к API ГПН шаг повторяется.
+    try:
+        group_created = asyncio.run(gpn_create_company_group_fn(personal_account))
+
+    except CeleryError as e:
+        raise self.retry(exc=e, countdown=group_change_poll_countdown(self.request.retries))
+
+    gpn_cards_unbind_other_groups.apply_async(
+        args=(card_ids, personal_account, limit_sum),
+        countdown=GPN_GROUP_CHANGE_POLL_INTERVAL if group_created else 0
+    )
+
+
+async def gpn_cards_unbind_other_groups_fn(card_ids: List[str], personal_account: str, limit_sum: int | float) \
+        -> Tuple[str | None, bool]:
+    sessionmanager = DatabaseSessionManager()
+    sessionmanager.init(PROD_URI)
+
+    async with sessionmanager.session() as session:
+        gpn = GPNController(session, celery_logger)
+        try:
+            group_id, cards_unbound = await gpn.gpn_unbind_cards_from_other_groups(
+                card_ids,
+                personal_account,
+                limit_sum
+            )
+        finally:
+            await gpn.close()
+
+    # Закрываем соединение с БД
+    await sessionmanager.close()
+    return group_id, cards_unbound
+
+
+@celery.task(name="GPN_CARDS_UNBIND_OTHER_GROUPS", bind=True, max_retries=GPN_GROUP_CHANGE_MAX_RETRIES)
+def gpn_cards_unbind_other_groups(self, card_ids: List[str], personal_account: str, limit_sum: int | float) -> None:
+    try:
+        group_id, cards_unbound = asyncio.run(gpn_cards_unbind_other_groups_fn(card_ids, personal_account, limit_sum))
+
+    except CeleryError as e:
+        raise self.retry(exc=e, countdown=group_change_poll_countdown(self.request.retries))
+
+    if not group_id:
+        celery_logger.info(f"{personal_account} | группа карт еще не доступна в API ГПН, повторю попытку позже")
+        raise self.retry(countdown=group_change_poll_countdown(self.request.retries))
+
+    gpn_cards_bind_group.apply_async(
+        args=(card_ids, group_id),
+        countdown=GPN_GROUP_CHANGE_POLL_INTERVAL if cards_unbound else 0
+    )
+
+
+async def gpn_cards_bind_group_fn(card_ids: List[str], group_id: str) -> bool:
+    sessionmanager = DatabaseSessionManager()
+    sessionmanager.init(PROD_URI)
+
+    async with sessionmanager.session() as session:
+        gpn = GPNController(session, celery_logger)
+        try:
+            cards_bound = await gpn.gpn_bind_cards_to_group(card_ids, group_id)
+        finally:
+            await gpn.close()
+
+    # Закрываем соединение с БД
+    await sessionmanager.close()
+    return cards_bound
+
+
+@celery.task(name="GPN_CARDS_BIND_GROUP", bind=True, max_retries=GPN_GROUP_CHANGE_MAX_RETRIES)
+def gpn_cards_bind_group(self, card_ids: List[str], group_id: str) -> None:
+    try:
+        cards_bound = asyncio.run(gpn_cards_bind_group_fn(card_ids, group_id))
 
+    except CeleryError as e:
+        raise self.retry(exc=e, countdown=group_change_poll_countdown(self.request.retries))
 
-@celery.task(name="GPN_CARDS_BIND_COMPANY")
-def gpn_cards_bind_company(card_ids: List[str], personal_account: str, limit_sum: int | float) -> None:
-    asyncio.run(gpn_cards_bind_company_fn(card_ids, personal_account, limit_sum))
+    if not cards_bound:
+        celery_logger.info("Карты еще не откреплены от других групп ГПН, повторю попытку позже")
+        raise self.retry(countdown=group_change_poll_countdown(self.request.retries))
 
 
 async def gpn_cards_unbind_company_fn(card_ids: List[str]) -> None:
@@ -83,7 +179,10 @@ async def gpn_cards_unbind_company_fn(card_ids: List[str]) -> None:
 
     async with sessionmanager.session() as session:
         gpn = GPNController(session, celery_logger)
-        await gpn.gpn_unbind_company_from_cards(card_ids)
+        try:
+            await gpn.gpn_unbind_company_from_cards(card_ids)
+        finally:
+            await gpn.close()
 
     # Закрываем соединение с БД
     await sessionmanager.close()
@@ -100,7 +199,10 @@ async def sync_gpn_cards_fn() -> None:
 
     async with sessionmanager.session() as session:
         gpn = GPNController(session, celery_logger)
-        await gpn.sync_cards()
+        try:
+            await gpn.sync_cards()
+        finally:
+            await gpn.close()
 
     # Закрываем соединение с БД
     await sessionmanager.close()
@@ -116,9 +218,9 @@ async def gpn_test_fn() -> None:
     sessionmanager.init(PROD_URI)
 
     async with sessionmanager.session() as session:
-        gpn_api = GPNApi(celery_logger)
-        # gpn_api.get_transactions(1)
-        gpn_api.get_goods()
+        async with GPNApi(celery_logger) as gpn_api:
+            # await gpn_api.get_transactions(1)
+            print(await gpn_api.get_goods())
 
     # Закрываем соединение с БД
     await sessionmanager.close()
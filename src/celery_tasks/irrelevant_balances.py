@@ -1,12 +1,15 @@
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 
 
 class IrrelevantBalances(dict):
 
     def __init__(self):
+        # Балансы, требующие пересчета, и время, начиная с которого требуется пересчет
         self.data = {}
-        dict.__init__(self, data=self.data)
+        # Балансы, актуализированные при записи транзакций (пересчет не требуется, но изменилось значение баланса)
+        self.updated = []
+        dict.__init__(self, data=self.data, updated=self.updated)
 
     def add(self, balance_id: str, irrelevancy_date_time: datetime) -> None:
         if balance_id in self.data:
@@ -18,3 +21,11 @@ class IrrelevantBalances(dict):
     def extend(self, another_irrelevantbalances_data: Dict[str, datetime]) -> None:
         for balance_id, irrelevancy_date_time in another_irrelevantbalances_data.items():
             self.add(balance_id, irrelevancy_date_time)
+
+    def add_updated(self, balance_id: str) -> None:
+        if balance_id not in self.updated:
+            self.updated.append(balance_id)
+
+    def extend_updated(self, another_irrelevantbalances_updated: List[str]) -> None:
+        for balance_id in another_irrelevantbalances_updated:
+            self.add_updated(balance_id)
@@ -37,6 +37,17 @@ class CardStatus(Enum):
     UNKNOWN = "sent"
 
 
+def get_card_status_by_data(card_data: Dict[str, Any]) -> CardStatus:
+    for card_status in (CardStatus.ACTIVE, CardStatus.BLOCKING_PENDING, CardStatus.BLOCKED,
+                        CardStatus.ACTIVATE_PENDING):
+        if card_data['cardBlockRequest'] == card_status.value:
+            return card_status
+
+    print("Сайт поставщика не позволяет достоверно определить статус карты, "
+          f"так как еще не обработана предыдущая операция по смене статуса карты {card_data['cardNo']}")
+    return CardStatus.UNKNOWN
+
+
 class KHNPParser:
 
     def __init__(self, logger: ColoredLogger):
@@ -93,6 +104,8 @@ class KHNPParser:
         self.ac = ActionChains(self.driver)
 
         self.cards = []
+        self._cards_by_number: Dict[str, Dict[str, Any]] = {}
+        self._cards_by_number_source: List[Dict[str, Any]] | None = None
 
     def login(self) -> None:
         self.logger.info(f'Открываю главную страницу: {self.site}')
@@ -439,20 +452,16 @@ class KHNPParser:
         if not self.cards:
             self.cards = self.get_cards()
 
-        for card_data in self.cards:
-            if card_data['cardNo'] == card_num:
-                if card_data['cardBlockRequest'] == CardStatus.ACTIVE.value:
-                    return CardStatus.ACTIVE
-                elif card_data['cardBlockRequest'] == CardStatus.BLOCKING_PENDING.value:
-                    return CardStatus.BLOCKING_PENDING
-                elif card_data['cardBlockRequest'] == CardStatus.BLOCKED.value:
-                    return CardStatus.BLOCKED
-                elif card_data['cardBlockRequest'] == CardStatus.ACTIVATE_PENDING.value:
-                    return CardStatus.ACTIVATE_PENDING
-                else:
-                    print("Сайт поставщика не позволяет достоверно определить статус карты, "
-                          "так как еще не обработана предыдущая операция по смене статуса карты {card_num}")
-                    return CardStatus.UNKNOWN
+        # Словарь карт по номеру строится один раз для каждого полученного списка карт
+        if self._cards_by_number_source is not self.cards:
+            self._cards_by_number = {}
+            for card_data in self.cards:
+                self._cards_by_number.setdefault(card_data['cardNo'], card_data)
+            self._cards_by_number_source = self.cards
+
+        card_data = self._cards_by_number.get(card_num)
+        if card_data:
+            return get_card_status_by_data(card_data)
 
     """
     def block_or_activate_cards(self, card_numbers_to_block: List[str], card_numbers_to_activate: List[str]) -> None:
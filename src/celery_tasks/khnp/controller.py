@@ -1,15 +1,14 @@
 from datetime import datetime, date, timedelta
-from time import sleep
 from typing import Dict, Any, List, Tuple
 
 from sqlalchemy import select as sa_select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.celery_tasks.balance.calc_balance import CalcBalances
 from src.celery_tasks.irrelevant_balances import IrrelevantBalances
-from src.celery_tasks.khnp.api import KHNPParser, CardStatus
+from src.celery_tasks.khnp.api import KHNPParser, CardStatus, get_card_status_by_data
 from src.celery_tasks.khnp.config import SYSTEM_SHORT_NAME
-from src.celery_tasks.transaction_helper import get_local_cards, get_local_card, get_tariff_on_date_by_balance, \
-    get_current_tariff_by_balance
+from src.celery_tasks.transaction_helper import get_local_cards, CardIndex, TariffResolver
 from src.config import TZ
 from src.database.model.card import CardOrm, BlockingCardReason
 from src.database.model.card_type import CardTypeOrm
@@ -22,6 +21,7 @@ from src.repositories.system import SystemRepository
 from src.repositories.transaction import TransactionRepository
 from src.utils.enums import ContractScheme, TransactionType
 from src.utils.log import ColoredLogger
+from src.utils.reconciliation import Reconciliation, money_key
 
 
 class KHNPController(BaseRepository):
@@ -36,10 +36,11 @@ class KHNPController(BaseRepository):
         # self.outer_goods: List[OuterGoodsOrm] = []
         self._tariffs_history: List[BalanceTariffHistoryOrm] = []
         self._bst_list: List[BalanceSystemTariffOrm] = []
+        self._tariff_resolver: TariffResolver | None = None
         self._balance_card_relations: Dict[str, str] = {}
-        self._local_cards: List[CardOrm] = []
+        self._card_index = CardIndex([])
         self._irrelevant_balances = IrrelevantBalances()
-        self._outer_goods_list: List[OuterGoodsOrm] = []
+        self._outer_goods: Dict[str, OuterGoodsOrm] = {}
 
     async def sync(self) -> IrrelevantBalances:
         await self.init_system()
@@ -88,17 +89,6 @@ class KHNPController(BaseRepository):
         return self.local_cards
     """
 
-    @staticmethod
-    def get_equal_local_card(provider_card: Dict[str, Any], local_cards: List[CardOrm]) -> CardOrm:
-        i = 0
-        length = len(local_cards)
-        while i < length:
-            if local_cards[i].card_number == provider_card['cardNo']:
-                card = local_cards.pop(i)
-                return card
-            else:
-                i += 1
-
     def get_khnp_cards(self) -> List[Dict[str, Any]]:
         if not self.khnp_cards:
             self.khnp_cards = self.parser.get_cards()
@@ -160,24 +150,21 @@ class KHNPController(BaseRepository):
         return transactions
     """
 
-    @staticmethod
-    def get_equal_remote_transaction(local_transaction: TransactionOrm,
-                                     provider_transactions: Dict[str, Any]) -> Dict[str, Any]:
-
-        card_transactions = provider_transactions.get(local_transaction.card.card_number, [])
-        for provider_transaction in card_transactions:
-            if provider_transaction['date_time'] == local_transaction.date_time:
-                if provider_transaction['fuel_volume'] == abs(local_transaction.fuel_volume):
-                    if provider_transaction['money_request'] == abs(local_transaction.transaction_sum):
-                        transaction = provider_transaction
-                        card_transactions.remove(provider_transaction)
-
-                        # Если список транзакций по карте пуст,
-                        # то удаляем из словаря запись о карте.
-                        if not card_transactions:
-                            provider_transactions.pop(local_transaction.card.card_number)
-
-                        return transaction
+    # Транзакции сопоставляются по номеру карты, времени, объему топлива и сумме
+    transactions_reconciliation = Reconciliation(
+        local_key=lambda local_transaction: (
+            local_transaction.card_number,
+            local_transaction.date_time,
+            money_key(local_transaction.fuel_volume),
+            money_key(local_transaction.transaction_sum)
+        ),
+        remote_key=lambda card_transaction: (
+            card_transaction[0],
+            card_transaction[1]['date_time'],
+            money_key(card_transaction[1]['fuel_volume']),
+            money_key(card_transaction[1]['money_request'])
+        )
+    )
 
     """
     async def get_local_card(self, card_number) -> CardOrm:
@@ -195,25 +182,6 @@ class KHNPController(BaseRepository):
 
         return self.outer_goods
     """
-    async def get_single_outer_goods(self, provider_transaction: Dict[str, Any]) -> OuterGoodsOrm:
-        # all_outer_goods = await self.get_all_outer_goods()
-        # Выполняем поиск товара/услуги
-        product_type = provider_transaction['product_type']
-        for goods in self._outer_goods_list:
-            if goods.name == product_type:
-                return goods
-
-        # Если товар/услуга не найден(а), то создаем его(её)
-        fields = dict(
-            name=product_type,
-            system_id=self.system.id,
-            inner_goods_id=None,
-        )
-        goods = await self.insert(OuterGoodsOrm, **fields)
-        self._outer_goods_list.append(goods)
-
-        return goods
-
     """
     async def _get_tariffs_history(self) -> List[BalanceTariffHistoryOrm]:
         bth = aliased(BalanceTariffHistoryOrm, name="bth")
@@ -276,8 +244,9 @@ class KHNPController(BaseRepository):
         debit = True if remote_transaction['type'] == "Дебет" else False
 
         # Получаем карту
-        card = await get_local_card(card_number, self._local_cards)
-        # card = await self.get_local_card(card_number)
+        card = self._card_index.resolve(card_number)
+        if not card:
+            return None
 
         # Получаем баланс
         balance_id = self._balance_card_relations.get(card_number, None)
@@ -285,17 +254,10 @@ class KHNPController(BaseRepository):
             return None
 
         # Получаем товар/услугу
-        single_outer_goods = await self.get_single_outer_goods(remote_transaction)
+        single_outer_goods = self._outer_goods.get(remote_transaction['product_type'])
 
         # Получаем тариф
-        tariff = get_tariff_on_date_by_balance(
-            balance_id=balance_id,
-            transaction_date=remote_transaction['date_time'].date(),
-            tariffs_history=self._tariffs_history
-        )
-        if not tariff:
-            tariff = get_current_tariff_by_balance(balance_id=balance_id, bst_list=self._bst_list)
-            # tariff = self._get_current_tariff_by_balance(balance_id)
+        tariff = self._tariff_resolver.resolve(balance_id, remote_transaction['date_time'].date())
 
         # Объем топлива
         fuel_volume = -remote_transaction['liters_ordered'] if debit else remote_transaction['liters_received']
@@ -330,38 +292,44 @@ class KHNPController(BaseRepository):
             discount_sum=discount_sum,
             fee_sum=fee_sum,
             total_sum=total_sum,
-            company_balance_after=0,
+            company_balance=0,
             comments='',
         )
 
-        # Это нужно, чтобы в БД у транзакций отличалось время и можно было корректно выбрать транзакцию,
-        # которая предшествовала измененной
-        sleep(0.001)
-
         return transaction_data
 
     async def process_new_remote_transactions(self, remote_transactions: Dict[str, Any],
-                                              transaction_repository: TransactionRepository) -> None:
+                                              transaction_repository: TransactionRepository,
+                                              transaction_keys_to_delete: List[Tuple[str, datetime]] | None = None) \
+            -> List[Dict[str, Any]]:
         # Получаем текущие тарифы
         self._bst_list = await transaction_repository.get_balance_system_tariff_list(self.system.id)
 
         # Получаем историю тарифов
         self._tariffs_history = await transaction_repository.get_tariffs_history(self.system.id)
+        self._tariff_resolver = TariffResolver(self._tariffs_history, self._bst_list)
 
-        # Получаем список продуктов / услуг
-        self._outer_goods_list = await transaction_repository.get_outer_goods_list(system_id=self.system.id)
+        # Получаем товары/услуги, недостающие записываем в БД. ХНП идентифицирует товар/услугу наименованием.
+        self._outer_goods = await transaction_repository.resolve_outer_goods(
+            system_id=self.system.id,
+            goods_data={
+                card_transaction['product_type']: {}
+                for card_transactions in remote_transactions.values()
+                for card_transaction in card_transactions
+            }
+        )
 
         # Получаем связи карт (Карта-Баланс)
         card_numbers = [card_number for card_number in remote_transactions.keys()]
-        self._balance_card_relations = transaction_repository.get_balance_card_relations(card_numbers, self.system.id)
+        self._balance_card_relations = await transaction_repository.get_balance_card_relations(card_numbers, self.system.id)
         # await self._set_balance_card_relations(card_numbers)
 
         # Получаем карты
-        self._local_cards = await get_local_cards(
+        self._card_index = CardIndex(await get_local_cards(
             session=self.session,
             system_id=self.system.id,
             card_numbers=card_numbers
-        )
+        ))
 
         # Подготавливаем список транзакций для сохранения в БД
         transactions_to_save = []
@@ -370,14 +338,20 @@ class KHNPController(BaseRepository):
                 transaction_data = await self.process_new_remote_transaction(card_number, card_transaction)
                 if transaction_data:
                     transactions_to_save.append(transaction_data)
-                    if transaction_data['balance_id']:
-                        self._irrelevant_balances.add(
-                            balance_id=str(transaction_data['balance_id']),
-                            irrelevancy_date_time=transaction_data['date_time_load']
-                        )
 
-        # Сохраняем транзакции в БД
-        await self.bulk_insert_or_update(TransactionOrm, transactions_to_save)
+        self._card_index.report_missing(self.logger)
+
+        # Сохраняем транзакции в БД. Балансы после транзакций вычисляются при записи,
+        # балансы, требующие пересчета истории, помечаются как неактуальные.
+        calc_balances = CalcBalances(self.session, self.logger)
+        await calc_balances.save_transactions(
+            transactions=transactions_to_save,
+            irrelevant_balances=self._irrelevant_balances,
+            transaction_keys_to_delete=transaction_keys_to_delete,
+            use_copy=True
+        )
+
+        return transactions_to_save
 
     """
     async def _set_balance_card_relations(self, card_numbers: List[str]) -> None:
@@ -420,7 +394,7 @@ class KHNPController(BaseRepository):
 
         # Получаем список транзакций из локальной БД
         transaction_repository = TransactionRepository(self.session, None)
-        local_transactions = await transaction_repository.get_recent_system_transactions(
+        local_transactions = await transaction_repository.get_recent_system_transaction_rows(
             system_id=self.system.id,
             transaction_days=self.system.transaction_days
         )
@@ -432,27 +406,35 @@ class KHNPController(BaseRepository):
         # Удаляем локальные транзакции из БД, которые не были найдены в списке,
         # полученном от системы.
         self.logger.info('Приступаю к процедуре сравнения локальных транзакций с полученными от системы ХНП')
-        to_delete = []
-        for local_transaction in local_transactions:
-            if local_transaction.card:
-                system_transaction = self.get_equal_remote_transaction(local_transaction, remote_transactions)
-                if not system_transaction:
-                    # Транзакция присутствует локально, но у поставщика услуг её нет.
-                    # Помечаем на удаление локальную транзакцию.
-                    to_delete.append(local_transaction)
-                    if local_transaction.balance_id:
-                        self._irrelevant_balances.add(
-                            balance_id=str(local_transaction.balance_id),
-                            irrelevancy_date_time=local_transaction.date_time_load
-                        )
-
-        # Удаляем помеченные транзакции из БД
+        reconciliation = self.transactions_reconciliation.reconcile(
+            local_items=[
+                local_transaction for local_transaction in local_transactions if local_transaction.card_number
+            ],
+            remote_items=[
+                (card_number, card_transaction)
+                for card_number, card_transactions in remote_transactions.items()
+                for card_transaction in card_transactions
+            ]
+        )
+        self.logger.info(f'Результат сравнения: {reconciliation.stats()}')
+
+        # Транзакции, присутствующие локально, но отсутствующие у поставщика услуг, помечаем на удаление
+        to_delete = reconciliation.to_delete
+        for local_transaction in to_delete:
+            if local_transaction.balance_id:
+                self._irrelevant_balances.add(
+                    balance_id=str(local_transaction.balance_id),
+                    irrelevancy_date_time=local_transaction.date_time_load
+                )
+
+        # Транзакции от поставщика услуг, не обнаруженные в локальной БД
+        remote_transactions = {}
+        for card_number, card_transaction in reconciliation.to_insert:
+            remote_transactions.setdefault(card_number, []).append(card_transaction)
+
+        # Помеченные транзакции удаляются из БД одним запросом в одной транзакции БД с записью новых
+        transaction_keys_to_delete = [(transaction.id, transaction.date_time) for transaction in to_delete]
         self.logger.info(f'Удалить тразакции из локальной БД: {len(to_delete)} шт')
-        if len(to_delete):
-            self.logger.info('Удаляю помеченные локальные транзакции из БД')
-
-            for transaction in to_delete:
-                await self.delete_object(TransactionOrm, transaction.id)
 
         # Транзакции от поставщика услуг, оставшиеся необработанными,
         # записываем в локальную БД.
@@ -461,17 +443,31 @@ class KHNPController(BaseRepository):
         )))
         self.logger.info(f'Новые тразакции от системы ХНП: {counter} шт')
 
+        inserted_transactions = []
         if counter:
             self.logger.info(
                 'Начинаю обработку транзакций от системы ХНП, которые не обнаружены в локальной БД'
             )
-            await self.process_new_remote_transactions(remote_transactions, transaction_repository)
+            inserted_transactions = await self.process_new_remote_transactions(
+                remote_transactions=remote_transactions,
+                transaction_repository=transaction_repository,
+                transaction_keys_to_delete=transaction_keys_to_delete
+            )
+
+        elif transaction_keys_to_delete:
+            # Новых транзакций нет - удаление фиксируется вместе со временем синхронизации
+            self.logger.info('Удаляю помеченные локальные транзакции из БД')
+            await self.bulk_delete(TransactionOrm, transaction_keys_to_delete, commit=False,
+                                   partition_field="date_time")
 
         # Записываем в БД время последней успешной синхронизации
         await self.update_object(self.system, update_data={"transactions_sync_dt": datetime.now(tz=TZ)})
 
-        # Обновляем время последней транзакции для карт
-        await transaction_repository.renew_cards_date_last_use()
+        # Обновляем время последней транзакции для карт, по которым прогружены или удалены транзакции
+        await transaction_repository.renew_cards_date_last_use(
+            inserted_transactions=inserted_transactions,
+            deleted_card_ids=[transaction.card_id for transaction in to_delete if transaction.card_id]
+        )
         # await self.renew_cards_date_last_use()
 
     def change_card_states(self, card_numbers_to_change_state: List[str]) -> None:
@@ -490,11 +486,12 @@ class KHNPController(BaseRepository):
         # Сравниваем карты из системы с локальными.
         # В локальной БД создаем новые, если появились в системе.
         # В локальной БД обновляем статус карт на тот, который установлен в системе.
+        card_index = CardIndex(local_cards)
         new_local_cards = []
         local_cards_to_change_status = []
         for khnp_card in khnp_cards:
-            local_card = self.get_equal_local_card(khnp_card, local_cards)
-            khnp_card_status = self.parser.get_card_status(khnp_card["cardNo"])
+            local_card = card_index.get(khnp_card["cardNo"])
+            khnp_card_status = get_card_status_by_data(khnp_card)
             if khnp_card_status in [CardStatus.ACTIVE, CardStatus.ACTIVATE_PENDING]:
                 khnp_card_status_is_active = True
             else:
@@ -502,7 +499,7 @@ class KHNPController(BaseRepository):
 
             if local_card:
                 # В локальной системе есть соответствующая карта - сверяем статусы
-                if khnp_card_status_is_active != local_card:
+                if khnp_card_status_is_active != local_card.is_active:
                     local_card.is_active = khnp_card_status_is_active
                     local_cards_to_change_status.append({"id": local_card.id, "is_active": local_card.is_active})
 
@@ -595,24 +592,27 @@ class KHNPController(BaseRepository):
     @staticmethod
     def compare_khnp_card_states(remote_cards: List[Dict[str, Any]], local_cards_to_be_active: List[CardOrm],
                                  local_cards_to_be_blocked: List[CardOrm]) -> Tuple[List[str], List[CardOrm]]:
+        # Карты ХНП по номеру карты (при повторе номера учитывается первая карта)
+        remote_cards_by_number: Dict[str, Dict[str, Any]] = {}
+        for remote_card in remote_cards:
+            remote_cards_by_number.setdefault(remote_card["cardNo"], remote_card)
+
         khnp_cards_to_change_state = []
         # Активные карты
         for local_card in local_cards_to_be_active:
-            for remote_card in remote_cards:
-                if remote_card["cardNo"] == local_card.card_number:
-                    # В ХНП карта заблокирована по ПИН
-                    if remote_card["status_name"] == "Заблокирована по ПИН":
-                        local_card.is_active = False
-                        local_card.reason_for_blocking = BlockingCardReason.PIN
-
-                    # В ХНП карта заблокирована или помечена на блокировку
-                    elif remote_card["cardBlockRequest"] in [CardStatus.BLOCKING_PENDING.value,
-                                                             CardStatus.BLOCKED.value]:
-                        if remote_card["status_name"] == "Активная":
-                            khnp_cards_to_change_state.append(local_card.card_number)
-                            local_card.reason_for_blocking = BlockingCardReason.NNK
-
-                    break
+            remote_card = remote_cards_by_number.get(local_card.card_number)
+            if remote_card:
+                # В ХНП карта заблокирована по ПИН
+                if remote_card["status_name"] == "Заблокирована по ПИН":
+                    local_card.is_active = False
+                    local_card.reason_for_blocking = BlockingCardReason.PIN
+
+                # В ХНП карта заблокирована или помечена на блокировку
+                elif remote_card["cardBlockRequest"] in [CardStatus.BLOCKING_PENDING.value,
+                                                         CardStatus.BLOCKED.value]:
+                    if remote_card["status_name"] == "Активная":
+                        khnp_cards_to_change_state.append(local_card.card_number)
+                        local_card.reason_for_blocking = BlockingCardReason.NNK
 
         # Заблокированные карты: ручная блокировка
         for local_card in local_cards_to_be_blocked:
@@ -620,47 +620,45 @@ class KHNPController(BaseRepository):
                 if local_card.reason_for_blocking is None:
                     local_card.reason_for_blocking = BlockingCardReason.NNK
 
-                for remote_card in remote_cards:
-                    if remote_card["cardNo"] == local_card.card_number:
-                        # В ХНП карта заблокирована по ПИН
-                        if remote_card["status_name"] == "Заблокирована по ПИН":
-                            local_card.is_active = False
-                            local_card.reason_for_blocking = BlockingCardReason.PIN
-
-                        # В ХНП карта разблокирована или помечена на разблокировку
-                        elif remote_card["cardBlockRequest"] in [CardStatus.ACTIVE.value,
-                                                                 CardStatus.ACTIVATE_PENDING.value]:
-                            khnp_cards_to_change_state.append(local_card.card_number)
+                remote_card = remote_cards_by_number.get(local_card.card_number)
+                if remote_card:
+                    # В ХНП карта заблокирована по ПИН
+                    if remote_card["status_name"] == "Заблокирована по ПИН":
+                        local_card.is_active = False
+                        local_card.reason_for_blocking = BlockingCardReason.PIN
 
-                        break
+                    # В ХНП карта разблокирована или помечена на разблокировку
+                    elif remote_card["cardBlockRequest"] in [CardStatus.ACTIVE.value,
+                                                             CardStatus.ACTIVATE_PENDING.value]:
+                        khnp_cards_to_change_state.append(local_card.card_number)
 
         # Заблокированные карты: блокировка по ПИН
         for local_card in local_cards_to_be_blocked:
             if local_card.reason_for_blocking == BlockingCardReason.PIN:
-                for remote_card in remote_cards:
-                    if remote_card["cardNo"] == local_card.card_number:
-                        if remote_card["status_name"] == "Активная":
-                            if remote_card["cardBlockRequest"] in [CardStatus.ACTIVE.value,
-                                                                   CardStatus.BLOCKING_PENDING.value]:
-                                local_card.is_active = True
-                                local_card.reason_for_blocking = None
-
-                            if remote_card["cardBlockRequest"] == CardStatus.BLOCKING_PENDING.value:
-                                khnp_cards_to_change_state.append(local_card.card_number)
-
-                            if remote_card["cardBlockRequest"] == CardStatus.BLOCKED.value:
-                                local_card.is_active = False
-                                local_card.reason_for_blocking = BlockingCardReason.NNK
-
-                            if remote_card["cardBlockRequest"] == CardStatus.ACTIVATE_PENDING.value:
-                                local_card.is_active = True
-                                local_card.reason_for_blocking = None
-
-                        elif remote_card["status_name"] == "Заблокирована по ПИН":
-                            if remote_card["cardBlockRequest"] == CardStatus.ACTIVATE_PENDING.value:
-                                khnp_cards_to_change_state.append(local_card.card_number)
-
-                        break
+                remote_card = remote_cards_by_number.get(local_card.card_number)
+                if not remote_card:
+                    continue
+
+                if remote_card["status_name"] == "Активная":
+                    if remote_card["cardBlockRequest"] in [CardStatus.ACTIVE.value,
+                                                           CardStatus.BLOCKING_PENDING.value]:
+                        local_card.is_active = True
+                        local_card.reason_for_blocking = None
+
+                    if remote_card["cardBlockRequest"] == CardStatus.BLOCKING_PENDING.value:
+                        khnp_cards_to_change_state.append(local_card.card_number)
+
+                    if remote_card["cardBlockRequest"] == CardStatus.BLOCKED.value:
+                        local_card.is_active = False
+                        local_card.reason_for_blocking = BlockingCardReason.NNK
+
+                    if remote_card["cardBlockRequest"] == CardStatus.ACTIVATE_PENDING.value:
+                        local_card.is_active = True
+                        local_card.reason_for_blocking = None
+
+                elif remote_card["status_name"] == "Заблокирована по ПИН":
+                    if remote_card["cardBlockRequest"] == CardStatus.ACTIVATE_PENDING.value:
+                        khnp_cards_to_change_state.append(local_card.card_number)
 
         local_cards: List[CardOrm] = local_cards_to_be_active + local_cards_to_be_blocked
         return khnp_cards_to_change_state, local_cards
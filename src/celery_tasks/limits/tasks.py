@@ -28,7 +28,10 @@ async def set_card_group_limit_fn(balance_ids: List[str]) -> None:
 
         if gpn_cards:
             gpn = GPNController(session, celery_logger)
-            await gpn.set_card_group_limit(balance_ids)
+            try:
+                await gpn.set_card_group_limit(balance_ids)
+            finally:
+                await gpn.close()
 
     # Закрываем соединение с БД
     await sessionmanager.close()
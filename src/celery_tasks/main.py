@@ -17,6 +17,7 @@ celery.autodiscover_tasks(
         "src.celery_tasks.overdraft",
         "src.celery_tasks.khnp",
         "src.celery_tasks.gpn",
-        "src.celery_tasks.limits"
+        "src.celery_tasks.limits",
+        "src.celery_tasks.partitions"
     ]
 )
@@ -6,17 +6,17 @@ from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
-from time import sleep
 from typing import List, Tuple, Dict
 
-from sqlalchemy import select as sa_select, null
+from sqlalchemy import select as sa_select, null, true
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, aliased
 
 from src.config import TZ, MAIL_SERVER, MAIL_PORT, MAIL_USER, MAIL_PASSWORD, OVERDRAFTS_MAIL_TO, MAIL_FROM, PRODUCTION
 from src.celery_tasks.irrelevant_balances import IrrelevantBalances
 from src.database.model.models import (Transaction as TransactionOrm, Balance as BalanceOrm, Company as CompanyOrm,
-                                       OverdraftsHistory as OverdraftsHistoryOrm, User as UserOrm)
+                                       OverdraftsHistory as OverdraftsHistoryOrm, User as UserOrm,
+                                       BalanceCheckpoint as BalanceCheckpointOrm)
 from src.celery_tasks.overdraft.reports import OverdraftsReport
 from src.repositories.base import BaseRepository
 from src.utils.enums import TransactionType, ContractScheme, Role
@@ -44,21 +44,21 @@ class Overdraft(BaseRepository):
         opened_overdrafts = await self.get_opened_overdrafts()
         self.logger.info(f'Количетво открытых овердрафтов: {len(opened_overdrafts)}')
 
-        # По открытым оверам анализируем последнюю транзакцию за вчерашний день.
+        # По открытым оверам анализируем баланс на конец последнего дня, предшествующего сегодняшней дате.
         if opened_overdrafts:
             self.logger.info('Обрабатываю открытые овердрафты')
             await self.process_opened_overdrafts(opened_overdrafts)
 
         # По органищациям, у которых вчера не было открытого овера, получаем баланс на конец вчерашнего дня
         # и открываем овер при величине баланса ниже min_balance
-        self.logger.info('По остальным организациям с подключенной услугой "овердрафт" получаю последние транзакции, '
-                         'предшествующие сегодняшней дате . Проверяю есть ли необходимость открыть новый овердрафт')
-        last_transactions = await self.get_last_transactions(opened_overdrafts)
-        self.logger.info(f'Количетво транзакций: {len(last_transactions)}')
+        self.logger.info('По остальным организациям с подключенной услугой "овердрафт" получаю балансы на конец дня, '
+                         'предшествующего сегодняшней дате . Проверяю есть ли необходимость открыть новый овердрафт')
+        last_checkpoints = await self.get_last_checkpoints(opened_overdrafts)
+        self.logger.info(f'Количетво балансов: {len(last_checkpoints)}')
 
-        if last_transactions:
-            self.logger.info('Обрабатываю последние вчерашние транзакции')
-            await self.process_last_transactions(last_transactions)
+        if last_checkpoints:
+            self.logger.info('Обрабатываю балансы на конец вчерашнего дня')
+            await self.process_last_checkpoints(last_checkpoints)
 
         # Записываем в БД комиссионные транзакции
         irrelevant_balances = await self.save_fee_transactions_to_db()
@@ -74,46 +74,47 @@ class Overdraft(BaseRepository):
 
         return irrelevant_balances
 
-    async def get_opened_overdrafts(self) -> List[Tuple[OverdraftsHistoryOrm, TransactionOrm]]:
-        # Формируем список открытых оверов и присоединяем к нему последнюю транзакцию, предшествующую сегодняшней дате
-        balance_table = aliased(BalanceOrm, name="blnc")
-        last_transaction_helper = (
-            sa_select(TransactionOrm.id, TransactionOrm.balance_id)
-            .select_from(TransactionOrm, balance_table)
-            .where(TransactionOrm.balance_id == balance_table.id)
-            .where(balance_table.scheme == ContractScheme.OVERBOUGHT)
-            .where(TransactionOrm.date_time_load < self.today)
-            .distinct(TransactionOrm.balance_id)
-            .order_by(
-                TransactionOrm.balance_id,
-                TransactionOrm.date_time_load.desc()
-            )
-            .subquery(name="last_transaction_helper")
+    def last_checkpoint_helper(self, balance_id_column):
+        # Баланс на конец последнего дня, предшествующего сегодняшней дате.
+        # Подзапрос LATERAL выполняется для каждого баланса выборкой одной записи по индексу.
+        checkpoint_table = aliased(BalanceCheckpointOrm, name="chkp")
+        return (
+            sa_select(checkpoint_table.id)
+            .where(checkpoint_table.balance_id == balance_id_column)
+            .where(checkpoint_table.checkpoint_date < self.today)
+            .order_by(checkpoint_table.checkpoint_date.desc())
+            .limit(1)
+            .lateral(name="last_checkpoint_helper")
         )
 
+    async def get_opened_overdrafts(self) -> List[Tuple[OverdraftsHistoryOrm, BalanceCheckpointOrm]]:
+        # Формируем список открытых оверов и присоединяем к нему баланс на конец дня, предшествующего сегодняшней дате
+        last_checkpoint_helper = self.last_checkpoint_helper(OverdraftsHistoryOrm.balance_id)
         stmt = (
-            sa_select(OverdraftsHistoryOrm, TransactionOrm)
+            sa_select(OverdraftsHistoryOrm, BalanceCheckpointOrm)
             .options(
                 joinedload(OverdraftsHistoryOrm.balance)
                 .joinedload(BalanceOrm.company)
             )
+            .select_from(OverdraftsHistoryOrm)
             .where(OverdraftsHistoryOrm.end_date.is_(null()))
-            .join(last_transaction_helper, last_transaction_helper.c.balance_id == OverdraftsHistoryOrm.balance_id)
-            .join(TransactionOrm, TransactionOrm.id == last_transaction_helper.c.id)
+            .join(last_checkpoint_helper, true())
+            .join(BalanceCheckpointOrm, BalanceCheckpointOrm.id == last_checkpoint_helper.c.id)
         )
         # self.statement(stmt)
         dataset = await self.select_all(stmt, scalars=False)
         return dataset
 
-    async def process_opened_overdrafts(self, opened_overdrafts: List[Tuple[OverdraftsHistoryOrm, TransactionOrm]]) \
+    async def process_opened_overdrafts(self,
+                                        opened_overdrafts: List[Tuple[OverdraftsHistoryOrm, BalanceCheckpointOrm]]) \
             -> None:
-        for overdraft, last_transaction in opened_overdrafts:
-            # Если баланс последней вчерашней транзакции ниже значения min_balance, то берем плату.
+        for overdraft, last_checkpoint in opened_overdrafts:
+            # Если баланс на конец вчерашнего дня ниже значения min_balance, то берем плату.
             # Если выше, то погашаем овер.
-            trigger = True if last_transaction.company_balance < overdraft.balance.company.min_balance else False
+            trigger = True if last_checkpoint.company_balance < overdraft.balance.company.min_balance else False
             if trigger:
                 fee_sum = self.calc_fee_sum(
-                    fee_base = last_transaction.company_balance - overdraft.balance.company.min_balance,
+                    fee_base = last_checkpoint.company_balance - overdraft.balance.company.min_balance,
                     fee_percent=overdraft.balance.company.overdraft_fee_percent
                 )
 
@@ -121,7 +122,7 @@ class Overdraft(BaseRepository):
                 self.add_fee_transaction(balance_id=overdraft.balance_id, fee_sum=fee_sum)
                 self.log_decision(
                     company=overdraft.balance.company,
-                    transaction_balance=last_transaction.company_balance,
+                    transaction_balance=last_checkpoint.company_balance,
                     decision="начислить комиссию"
                 )
 
@@ -133,7 +134,7 @@ class Overdraft(BaseRepository):
                     self.mark_overdraft_to_delete(company=overdraft.balance.company)
                     self.log_decision(
                         company=overdraft.balance.company,
-                        transaction_balance=last_transaction.company_balance,
+                        transaction_balance=last_checkpoint.company_balance,
                         decision='отключить услугу "овердрафт" в связи с нарушением условий договора'
                     )
 
@@ -142,75 +143,72 @@ class Overdraft(BaseRepository):
                 self.mark_overdraft_to_close(overdraft_id=overdraft.id)
                 self.log_decision(
                     company=overdraft.balance.company,
-                    transaction_balance=last_transaction.company_balance,
+                    transaction_balance=last_checkpoint.company_balance,
                     decision="прекратить отсчет времени пользования овердрафтом"
                 )
 
-    async def get_last_transactions(self, opened_overdrafts: List[Tuple[OverdraftsHistoryOrm, TransactionOrm]]) \
-            -> List[TransactionOrm]:
+    async def get_last_checkpoints(self,
+                                   opened_overdrafts: List[Tuple[OverdraftsHistoryOrm, BalanceCheckpointOrm]]) \
+            -> List[BalanceCheckpointOrm]:
 
         balance_table = aliased(BalanceOrm, name="blnc")
+        last_checkpoint_helper = self.last_checkpoint_helper(balance_table.id)
         stmt = (
-            sa_select(TransactionOrm)
+            sa_select(BalanceCheckpointOrm)
             .options(
-                joinedload(TransactionOrm.balance)
+                joinedload(BalanceCheckpointOrm.balance)
                 .joinedload(BalanceOrm.company)
             )
-            .select_from(TransactionOrm, balance_table)
-            .where(TransactionOrm.balance_id == balance_table.id)
+            .select_from(balance_table)
             .where(balance_table.scheme == ContractScheme.OVERBOUGHT)
-            .where(TransactionOrm.date_time_load < self.today)
-            .distinct(TransactionOrm.balance_id)
-            .order_by(
-                TransactionOrm.balance_id,
-                TransactionOrm.date_time_load.desc()
-            )
+            .join(last_checkpoint_helper, true())
+            .join(BalanceCheckpointOrm, BalanceCheckpointOrm.id == last_checkpoint_helper.c.id)
         )
 
-        excluded_balance_ids = [overdraft.balance_id for overdraft, last_transaction in opened_overdrafts]
+        excluded_balance_ids = [overdraft.balance_id for overdraft, last_checkpoint in opened_overdrafts]
         if excluded_balance_ids:
             stmt = stmt.where(balance_table.id.notin_(excluded_balance_ids))
 
         # self.statement(stmt)
 
-        last_transactions = await self.select_all(stmt)
-        return last_transactions
+        last_checkpoints = await self.select_all(stmt)
+        return last_checkpoints
 
-    async def process_last_transactions(self, last_transactions: List[TransactionOrm]) -> None:
-        for last_transaction in last_transactions:
-            # Если баланс последней вчерашней транзакции ниже значения min_balance, то при подключенном овере
+    async def process_last_checkpoints(self, last_checkpoints: List[BalanceCheckpointOrm]) -> None:
+        for last_checkpoint in last_checkpoints:
+            # Если баланс на конец вчерашнего дня ниже значения min_balance, то при подключенном овере
             # берем плату и открываем овер, а при отключенном помечаем клиентов на блокировку карт.
             # Если выше, то ничего не делаем
             # min_balance - всегда меньше, либо равно нулю
-            # fee_base = last_transaction.company_balance - last_transaction.balance.company.min_balance
-            trigger = True if last_transaction.company_balance < last_transaction.balance.company.min_balance \
+            # fee_base = last_checkpoint.company_balance - last_checkpoint.balance.company.min_balance
+            trigger = True if last_checkpoint.company_balance < last_checkpoint.balance.company.min_balance \
                 else False
             if not trigger:
                 self.log_decision(
-                    company=last_transaction.balance.company,
-                    transaction_balance=last_transaction.company_balance,
+                    company=last_checkpoint.balance.company,
+                    transaction_balance=last_checkpoint.company_balance,
                     decision="ничего не делать"
                 )
             else:
-                if last_transaction.balance.company.overdraft_on:
+                if last_checkpoint.balance.company.overdraft_on:
                     fee_sum = self.calc_fee_sum(
-                        fee_base=last_transaction.company_balance,
-                        fee_percent=last_transaction.balance.company.overdraft_fee_percent
+                        fee_base=last_checkpoint.company_balance,
+                        fee_percent=last_checkpoint.balance.company.overdraft_fee_percent
                     )
 
                     # создаем транзакцию (плата за овер)
-                    self.add_fee_transaction(balance_id=last_transaction.balance_id, fee_sum=fee_sum)
+                    self.add_fee_transaction(balance_id=last_checkpoint.balance_id, fee_sum=fee_sum)
 
                     # помечаем овер на открытие
                     self.mark_overdraft_to_open(
-                        balance_id=last_transaction.balance_id,
-                        days=last_transaction.balance.company.overdraft_days,
-                        overdraft_sum=last_transaction.balance.company.overdraft_sum
+                        balance_id=last_checkpoint.balance_id,
+                        days=last_checkpoint.balance.company.overdraft_days,
+                        overdraft_sum=last_checkpoint.balance.company.overdraft_sum
                     )
 
                     self.log_decision(
-                        company=last_transaction.balance.company,
-                        transaction_balance=last_transaction.company_balance,
+                        company=last_checkpoint.balance.company,
+                        transaction_balance=last_checkpoint.company_balance,
                         decision=f"начислить комиссию {fee_sum}, начать отсчет времени пользования овердрафтом"
                     )
 
@@ -225,7 +223,6 @@ class Overdraft(BaseRepository):
             "total_sum": fee_sum,
             "company_balance": 0,   # баланс посчитает следующая по цепочке задача Celery
         }
-        sleep(0.001)
         self.fee_transactions.append(fee_transaction)
 
     async def save_fee_transactions_to_db(self) -> IrrelevantBalances:
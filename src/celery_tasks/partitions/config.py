@@ -0,0 +1,7 @@
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Количество месяцев вперед, на которые заранее создаются секции таблицы транзакций
+TRANSACTION_PARTITIONS_MONTHS_AHEAD = int(os.environ.get('TRANSACTION_PARTITIONS_MONTHS_AHEAD', '3'))
@@ -0,0 +1,14 @@
+import asyncio
+import sys
+
+from src.celery_tasks.exceptions import celery_logger
+from src.celery_tasks.partitions.tasks import create_transaction_partitions
+
+
+def run_create_transaction_partitions():
+    celery_logger.info('Запускаю задачу создания секций таблицы транзакций')
+
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    create_transaction_partitions.delay()
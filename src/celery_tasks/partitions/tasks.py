@@ -0,0 +1,43 @@
+import asyncio
+import sys
+from datetime import datetime
+from typing import List
+
+from src.celery_tasks.exceptions import celery_logger
+from src.celery_tasks.main import celery
+from src.celery_tasks.partitions.config import TRANSACTION_PARTITIONS_MONTHS_AHEAD
+from src.config import PROD_URI, TZ
+from src.database.db import DatabaseSessionManager
+from src.repositories.transaction_partition import TransactionPartitionRepository
+
+
+async def create_transaction_partitions_fn() -> List[str]:
+    sessionmanager = DatabaseSessionManager()
+    sessionmanager.init(PROD_URI)
+
+    async with sessionmanager.session() as session:
+        repository = TransactionPartitionRepository(session)
+        repository.logger = celery_logger
+        created = await repository.create_monthly_partitions(
+            from_date=datetime.now(tz=TZ).date(),
+            months_ahead=TRANSACTION_PARTITIONS_MONTHS_AHEAD
+        )
+
+    # Закрываем соединение с БД
+    await sessionmanager.close()
+
+    return created
+
+
+@celery.task(name="CREATE_TRANSACTION_PARTITIONS")
+def create_transaction_partitions() -> List[str]:
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    created = asyncio.run(create_transaction_partitions_fn())
+    if created:
+        celery_logger.info(f"Созданы секции таблицы транзакций: {', '.join(created)}")
+    else:
+        celery_logger.info("Секции таблицы транзакций уже созданы")
+
+    return created
@@ -6,7 +6,7 @@ from src.celery_tasks.exceptions import celery_logger
 from src.celery_tasks.gpn.tasks import gpn_sync, gpn_set_card_states
 from src.celery_tasks.limits.tasks import set_card_group_limit
 from src.celery_tasks.khnp.tasks import khnp_sync, khnp_set_card_states
-from src.celery_tasks.balance.tasks import calc_balances
+from src.celery_tasks.balance.tasks import calc_balances, confirm_card_states
 from src.celery_tasks.main import celery
 from src.celery_tasks.irrelevant_balances import IrrelevantBalances
 
@@ -17,6 +17,7 @@ def agregate_sync_systems_data(irrelevant_balances_list: List[IrrelevantBalances
     irrelevant_balances = IrrelevantBalances()
     for ib in irrelevant_balances_list:
         irrelevant_balances.extend(ib['data'])
+        irrelevant_balances.extend_updated(ib.get('updated', []))
 
     return irrelevant_balances
 
@@ -37,11 +38,20 @@ load_balance_card_transactions = chord(
 
 @shared_task(name="SYNC_SET_CARD_STATES")
 def set_card_states(balance_ids: Dict[str, List[str]]):
-    balance_ids_list = list(balance_ids["to_block"])
-    balance_ids_list.extend(balance_ids["to_activate"])
+    balance_ids_list = balance_ids.get("to_set_limits")
+    if balance_ids_list is None:
+        balance_ids_list = list(balance_ids["to_block"])
+        balance_ids_list.extend(balance_ids["to_activate"])
+    # Состояние карт подтверждается только после успешной смены состояния во всех системах поставщиков.
+    # При ошибке смена состояния повторяется при следующей синхронизации.
     grouped_tasks = group(
-        khnp_set_card_states.s(balance_ids),
-        gpn_set_card_states.s(balance_ids),
+        chord(
+            header=[
+                khnp_set_card_states.s(balance_ids),
+                gpn_set_card_states.s(balance_ids)
+            ],
+            body=confirm_card_states.si(balance_ids)
+        ),
         set_card_group_limit.s(balance_ids_list)
     )
     return grouped_tasks()
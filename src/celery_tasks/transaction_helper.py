@@ -1,9 +1,10 @@
+from bisect import bisect_right
+from heapq import heappush, heappop
 from datetime import date
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Tuple
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.celery_tasks.exceptions import CeleryError
 from src.database.model import CardOrm
 from src.repositories.card import CardRepository
 from src.database.model.models import Tariff as TariffOrm, BalanceTariffHistory as BalanceTariffHistoryOrm, \
@@ -20,23 +21,120 @@ async def get_local_cards(session: AsyncSession, system_id: str, card_numbers: L
     return local_cards
 
 
-async def get_local_card(card_number, local_cards: List[CardOrm]) -> CardOrm:
-    for card in local_cards:
-        if card.card_number == card_number:
-            return card
+class CardIndex:
+    """
+    Индекс локальных карт по номеру карты и идентификатору карты в системе поставщика.
+    Карты, не найденные при обработке транзакций, накапливаются и выводятся в журнал одним сообщением.
+    """
 
-    raise CeleryError(trace=True, message=f'Карта с номером {card_number} не найдена в БД')
+    def __init__(self, cards: List[CardOrm]):
+        self._by_number: Dict[str, CardOrm] = {card.card_number: card for card in cards}
+        self._by_external_id: Dict[str, CardOrm] = {card.external_id: card for card in cards if card.external_id}
+        # Номера карт, не найденных в локальной БД (словарь сохраняет порядок обнаружения)
+        self._missing: Dict[str, None] = {}
 
+    def __len__(self) -> int:
+        return len(self._by_number)
 
-def get_tariff_on_date_by_balance(balance_id: str, transaction_date: date,
-                                  tariffs_history: List[BalanceTariffHistoryOrm]) -> TariffOrm | None:
-    for th in tariffs_history:
-        if th.balance_id == balance_id and th.start_date <= transaction_date \
-                and (th.end_date is None or th.end_date > transaction_date):
-            return th.tariff
+    def __contains__(self, card_number: str) -> bool:
+        return card_number in self._by_number
 
+    def get(self, card_number: str) -> CardOrm | None:
+        return self._by_number.get(card_number)
 
-def get_current_tariff_by_balance(balance_id: str, bst_list: List[BalanceSystemTariffOrm]) -> TariffOrm:
-    for bst in bst_list:
-        if bst.balance_id == balance_id:
-            return bst.tariff
+    def get_by_external_id(self, external_id: str) -> CardOrm | None:
+        return self._by_external_id.get(external_id)
+
+    def resolve(self, card_number: str) -> CardOrm | None:
+        # Поиск карты, которая должна присутствовать в локальной БД. Отсутствующая карта запоминается.
+        card = self._by_number.get(card_number)
+        if not card:
+            self._missing[card_number] = None
+
+        return card
+
+    @property
+    def missing_card_numbers(self) -> List[str]:
+        return list(self._missing)
+
+    def report_missing(self, logger: Any) -> None:
+        if self._missing:
+            logger.error(
+                f'Карты не найдены в БД ({len(self._missing)} шт), транзакции по ним не записаны: '
+                f'{", ".join(self._missing)}'
+            )
+
+
+class TariffResolver:
+    """
+    Определение тарифа для транзакций. Строится один раз за синхронизацию по истории тарифов
+    и текущим тарифам системы. Периоды истории каждого баланса приводятся к непересекающимся отрезкам
+    (при пересечении действует период, начавшийся позже), поэтому тариф на дату определяется
+    одним двоичным поиском.
+    """
+
+    def __init__(self, tariffs_history: List[BalanceTariffHistoryOrm], bst_list: List[BalanceSystemTariffOrm]):
+        periods_by_balance: Dict[str, List[BalanceTariffHistoryOrm]] = {}
+        for th in sorted(tariffs_history, key=lambda th: th.start_date):
+            periods_by_balance.setdefault(th.balance_id, []).append(th)
+
+        # balance_id -> даты начала отрезков и тарифы, действующие на отрезках (None - тариф не действовал).
+        # Отрезок длится до начала следующего отрезка, последний - бессрочно.
+        self._segment_starts: Dict[str, List[date]] = {}
+        self._segment_tariffs: Dict[str, List[TariffOrm | None]] = {}
+        for balance_id, periods in periods_by_balance.items():
+            starts, tariffs = self.make_segments(periods)
+            self._segment_starts[balance_id] = starts
+            self._segment_tariffs[balance_id] = tariffs
+
+        # balance_id -> текущий тариф
+        self._current_tariffs: Dict[str, TariffOrm] = {}
+        for bst in bst_list:
+            self._current_tariffs.setdefault(bst.balance_id, bst.tariff)
+
+    @staticmethod
+    def make_segments(periods: List[BalanceTariffHistoryOrm]) -> Tuple[List[date], List[TariffOrm | None]]:
+        """
+        Разбивает периоды (упорядоченные по дате начала) на непересекающиеся отрезки по датам начала и окончания.
+        На каждом отрезке действует последний по порядку из периодов, покрывающих отрезок.
+        """
+        boundaries = sorted({th.start_date for th in periods} | {th.end_date for th in periods if th.end_date})
+
+        starts = []
+        tariffs = []
+        active = []  # Куча действующих периодов: (-порядковый номер, дата окончания)
+        next_period = 0
+        for boundary in boundaries:
+            while next_period < len(periods) and periods[next_period].start_date <= boundary:
+                heappush(active, (-next_period, periods[next_period].end_date))
+                next_period += 1
+
+            # Периоды, закончившиеся к началу отрезка, удаляются при достижении вершины кучи
+            while active and active[0][1] is not None and active[0][1] <= boundary:
+                heappop(active)
+
+            tariff = periods[-active[0][0]].tariff if active else None
+            if not tariffs or tariffs[-1] is not tariff:
+                starts.append(boundary)
+                tariffs.append(tariff)
+
+        return starts, tariffs
+
+    def get_tariff_on_date(self, balance_id: str, transaction_date: date) -> TariffOrm | None:
+        starts = self._segment_starts.get(balance_id)
+        if not starts:
+            return None
+
+        i = bisect_right(starts, transaction_date)
+        return self._segment_tariffs[balance_id][i - 1] if i else None
+
+    def get_current_tariff(self, balance_id: str) -> TariffOrm | None:
+        return self._current_tariffs.get(balance_id)
+
+    def resolve(self, balance_id: str, transaction_date: date) -> TariffOrm | None:
+        # Тариф, действовавший на дату транзакции, а при его отсутствии - текущий тариф
+        tariff = self.get_tariff_on_date(balance_id, transaction_date)
+        return tariff if tariff else self.get_current_tariff(balance_id)
+
+    def resolve_many(self, pairs: Iterable[Tuple[str, date]]) -> List[TariffOrm | None]:
+        return [self.resolve(balance_id, transaction_date) for balance_id, transaction_date in pairs]
@@ -26,6 +26,12 @@ AUTH_URL_TOKEN = "http://localhost:28016/ic/sso/api/v2/oauth/authorize"
 ACCESS_TOKEN_TTL_SECONDS = 3600
 REFRESH_TOKEN_TTL_DAYS = 180
 
+# Максимальное количество одновременных запросов выписки к Sber API
+SBER_API_MAX_IN_FLIGHT = int(os.environ.get('SBER_API_MAX_IN_FLIGHT', '4'))
+
+# Количество повторных попыток получить страницу выписки при ошибке
+SBER_API_RETRIES = int(os.environ.get('SBER_API_RETRIES', '3'))
+
 """Параметры продуктового контура"""
 PROD_PARAMS = dict(
     # Ссылка авторизации (вариант с СМС)
@@ -98,15 +98,9 @@ class SberConnector(BaseRepository):
         return transactions
 
     async def _compare_transactions(self, transactions: List[TransactionOrm], statement: SberStatement) -> None:
-        transactions_to_delete = []
-        for transaction in transactions:
-            transaction_exists = statement.exclude_payment_if_exists(
-                operation_id=transaction.external_id,
-                operation_date=transaction.date_time,
-                amount=transaction.total_sum
-            )
-            if not transaction_exists:
-                transactions_to_delete.append(transaction)
+        reconciliation = statement.exclude_existing_payments(transactions)
+        self.logger.info(f'Результат сравнения транзакций с выпиской: {reconciliation.stats()}')
+        transactions_to_delete = reconciliation.to_delete
 
         # Удаляем из БД помеченные транзакции
         money_receipt_ids = [transaction.money_receipt.id for transaction in transactions_to_delete]
@@ -165,14 +159,15 @@ class SberConnector(BaseRepository):
         stmt = (
             sa_select(TransactionOrm)
             .options(
-                load_only(TransactionOrm.id, TransactionOrm.external_id)
+                load_only(TransactionOrm.id, TransactionOrm.external_id, TransactionOrm.date_time)
             )
             .where(TransactionOrm.external_id.in_(operation_ids))
         )
         transactions = await self.select_all(stmt)
 
-        # Формируем вспомогательный словарь
-        transaction_id_by_operation_id = {transaction.external_id: transaction.id for transaction in transactions}
+        # Формируем вспомогательный словарь. Ссылка на транзакцию состоит из ее идентификатора и времени
+        # (ключ секционирования таблицы транзакций).
+        transaction_by_operation_id = {transaction.external_id: transaction for transaction in transactions}
 
         # Формируем набор данных для записи в таблицу автозачислений
         dataset = []
@@ -180,7 +175,7 @@ class SberConnector(BaseRepository):
             for account, payments in accounts.items():
                 for payment in payments:
                     inn = payment.get_payer_inn()
-                    transaction_id = transaction_id_by_operation_id[inn] if inn in transaction_id_by_operation_id else None
+                    local_transaction = transaction_by_operation_id.get(payment.get_operation_id())
                     transaction = dict(
                         bank=enums.Bank.SBER,
                         payment_id=payment.get_operation_id(),
@@ -189,7 +184,8 @@ class SberConnector(BaseRepository):
                         payment_company_inn=inn,
                         payment_purpose=payment.get_purpose(),
                         amount=payment.get_amount(),
-                        transaction_id=transaction_id
+                        transaction_id=local_transaction.id if local_transaction else None,
+                        transaction_date_time=local_transaction.date_time if local_transaction else None
                     )
                     dataset.append(transaction)
 
@@ -1,16 +1,17 @@
 from datetime import datetime, timedelta, date
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Any, List
 
 import redis
 import requests
 from requests import Response
 
 from src.connectors.sber.config import IS_PROD, PROD_PARAMS, TEST_PARAMS, AUTH_URL_TOKEN, SCOPE, REDIRECT_URI, NONCE, \
-    STATE, ACCESS_TOKEN_TTL_SECONDS, REFRESH_TOKEN_TTL_DAYS
+    STATE, ACCESS_TOKEN_TTL_SECONDS, REFRESH_TOKEN_TTL_DAYS, SBER_API_MAX_IN_FLIGHT, SBER_API_RETRIES
 from src.connectors.sber.exceptions import SberApiError, sber_api_logger
 from src.connectors.sber.statement import SberStatement
 from src.utils.common import get_server_certificate
 from src.utils.enums import HttpMethod
+from src.utils.page_fetcher import PageFetcher
 
 import random
 import string
@@ -313,40 +314,77 @@ class SberApi:
         sber_api_logger.info(f"Получение от Sber API выписки по счету с даты {from_date.isoformat()}")
         self._update_credentials_if_required()
         endpoint_url = self._main_api_url + "/v2/statement/transactions"
-        statement = SberStatement(self._account_numbers)
+
+        def fetch_page(page_key: Tuple[str, str, int]) -> Dict[str, Any] | None:
+            account_number, statement_date_iso, page = page_key
+            params = dict(
+                accountNumber=account_number,
+                statementDate=statement_date_iso,
+                page=page
+            )
+            response = self.__request(endpoint_url, HttpMethod.GET, params)
+            if response.status_code == 200:
+                return response.json()
+
+            elif response.status_code == 400 and response.json()['cause'].upper() == "WORKFLOW_FAULT":
+                # Закончились страницы
+                return None
+
+            else:
+                raise SberApiError(
+                    message=(
+                        "Ошибка при запросе выписки.\n"
+                        f"Код ответа сервера: {response.status_code}\n"
+                        "Ответ сервера:\n"
+                        f"{response.text}"
+                    ),
+                    trace=False
+                )
+
+        page_fetcher = PageFetcher(
+            max_in_flight=SBER_API_MAX_IN_FLIGHT,
+            retries=SBER_API_RETRIES,
+            retry_on=(SberApiError, requests.RequestException),
+            logger=sber_api_logger
+        )
+
+        # Страницы выписки по одному счету за один день запрашиваются последовательно (их количество заранее
+        # неизвестно), а выписки по разным счетам и дням - параллельно.
+        def fetch_account_statement(account_key: Tuple[str, date]) -> List[Dict[str, Any]]:
+            account_number, statement_date = account_key
+            api_statements = []
+            for page in range(1, 6):
+                api_statement = page_fetcher.fetch_with_retries_sync(
+                    fetch_page, (account_number, statement_date.isoformat(), page)
+                )
+                if api_statement is None:
+                    break
+
+                api_statements.append(api_statement)
+
+            return api_statements
+
+        account_keys = []
         statement_date = from_date
         while statement_date <= date.today():
             for account_number in self._account_numbers:
-                for page in range(1, 6):
-                    params = dict(
-                        accountNumber=account_number,
-                        statementDate=statement_date.isoformat(),
-                        page=page
-                    )
-                    response = self.__request(endpoint_url, HttpMethod.GET, params)
-                    if response.status_code == 200:
-                        statement.parse_api_statement(
-                            statement_date=statement_date,
-                            account=account_number,
-                            api_statement=response.json()
-                        )
-
-                    elif response.status_code == 400 and response.json()['cause'].upper() == "WORKFLOW_FAULT":
-                        # Закончились страницы
-                        break
-
-                    else:
-                        raise SberApiError(
-                            message=(
-                                "Ошибка при запросе выписки.\n"
-                                f"Код ответа сервера: {response.status_code}\n"
-                                "Ответ сервера:\n"
-                                f"{response.text}"
-                            ),
-                            trace=False
-                        )
+                account_keys.append((account_number, statement_date))
 
             statement_date += timedelta(days=1)
 
+        # Повтор выполняется для отдельных страниц, поэтому пул потоков запрашивает выписки без повтора
+        account_fetcher = PageFetcher(max_in_flight=SBER_API_MAX_IN_FLIGHT, retries=0)
+        account_statements = account_fetcher.fetch_all_sync(fetch_account_statement, account_keys)
+
+        # Разбор выписок выполняется в исходном порядке: по дням, внутри дня - по счетам
+        statement = SberStatement(self._account_numbers)
+        for (account_number, statement_date), api_statements in zip(account_keys, account_statements):
+            for api_statement in api_statements:
+                statement.parse_api_statement(
+                    statement_date=statement_date,
+                    account=account_number,
+                    api_statement=api_statement
+                )
+
         sber_api_logger.info("Выписка получена")
         return statement
@@ -3,6 +3,7 @@ from datetime import date, datetime
 from typing import List, Dict, Any
 
 from src.connectors.sber.payment import SberPayment
+from src.utils.reconciliation import Reconciliation, ReconciliationResult, money_key
 
 
 class SberStatement:
@@ -79,19 +80,41 @@ class SberStatement:
 
         return list(payer_inn_set)
 
-    def exclude_payment_if_exists(self, operation_id: str, operation_date: datetime, amount: float) -> bool:
-        found = False
-        for statement_date, accounts in self._payments.items():
-            for account, payments in accounts.items():
-                for payment in payments:
-                    if operation_id == payment.get_operation_id() \
-                            and operation_date == payment.get_operation_date_time() \
-                            and amount == payment.get_amount():
-                        payments.remove(payment)
-                        found = True
-                        return found
-
-        return found
+    # Платежи сопоставляются с локальными транзакциями по идентификатору операции, времени и сумме
+    payments_reconciliation = Reconciliation(
+        local_key=lambda transaction: (
+            transaction.external_id,
+            transaction.date_time,
+            money_key(transaction.total_sum)
+        ),
+        remote_key=lambda statement_payment: (
+            statement_payment[2].get_operation_id(),
+            statement_payment[2].get_operation_date_time(),
+            money_key(statement_payment[2].get_amount())
+        )
+    )
+
+    def exclude_existing_payments(self, transactions: List[Any]) -> ReconciliationResult:
+        """
+        Исключает из выписки платежи, которым соответствуют локальные транзакции.
+        Возвращает результат сверки: в to_delete - локальные транзакции, отсутствующие в выписке.
+        """
+        reconciliation = self.payments_reconciliation.reconcile(
+            local_items=transactions,
+            remote_items=[
+                (statement_date, account, payment)
+                for statement_date, accounts in self._payments.items()
+                for account, payments in accounts.items()
+                for payment in payments
+            ]
+        )
+
+        # В выписке остаются только платежи, отсутствующие в локальной БД
+        self._payments = {}
+        for statement_date, account, payment in reconciliation.to_insert:
+            self._payments.setdefault(statement_date, {}).setdefault(account, []).append(payment)
+
+        return reconciliation
 
     def get_payments(self):
         return self._payments
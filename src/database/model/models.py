@@ -251,6 +251,16 @@ class Balance(Base):
         comment="Дата прекращения действия временного овердрафта"
     )
 
+    cards_blocked: Mapped[bool] = mapped_column(
+        sa.Boolean,
+        nullable=True,
+        init=False,
+        comment=(
+            "Требуемое состояние карт, вычисленное при последнем пересчете балансов "
+            "(true - карты должны быть заблокированы, false - разблокированы)"
+        )
+    )
+
     # Список поставщиков услуг, привязанных к этому балансу
     systems: Mapped[List["System"]] = relationship(
         back_populates="balances",
@@ -284,6 +294,14 @@ class Balance(Base):
         init=False
     )
 
+    # Балансы на конец дня
+    checkpoints: Mapped[List["BalanceCheckpoint"]] = relationship(
+        back_populates="balance",
+        cascade="all, delete-orphan",
+        lazy="noload",
+        init=False
+    )
+
     repr_cols = ("balance", "scheme")
 
     def __repr__(self) -> str:
@@ -398,6 +416,51 @@ class BalanceTariffHistory(Base):
     )
 
 
+class BalanceCheckpoint(Base):
+    __tablename__ = "balance_checkpoint"
+    __table_args__ = (
+        UniqueConstraint("balance_id", "checkpoint_date", name="unique_balance_checkpoint_date"),
+        {
+            'comment': (
+                "Балансы на конец дня. Запись создается за каждый день, в который по балансу были транзакции, "
+                "и содержит баланс после последней транзакции этого дня (по времени прогрузки в БД). "
+                "Поддерживается задачей пересчета балансов."
+            )
+        }
+    )
+
+    # Баланс
+    balance_id: Mapped[str] = mapped_column(
+        sa.ForeignKey("cargonomica.balance.id"),
+        nullable=False,
+        comment="Баланс"
+    )
+
+    # Баланс
+    balance: Mapped["Balance"] = relationship(
+        back_populates="checkpoints",
+        lazy="noload",
+        init=False
+    )
+
+    checkpoint_date: Mapped[date] = mapped_column(
+        sa.Date,
+        nullable=False,
+        comment="Дата"
+    )
+
+    company_balance: Mapped[float] = mapped_column(
+        sa.Numeric(12, 2, asdecimal=False),
+        nullable=False,
+        comment="Баланс организации на конец дня"
+    )
+
+    repr_cols = ("checkpoint_date", "company_balance")
+
+    def __repr__(self) -> str:
+        return self.repr(self.repr_cols)
+
+
 class Permition(Base):
     __tablename__ = "permition"
     __table_args__ = {
@@ -849,6 +912,13 @@ class System(Base):
         comment="Дата последней успешной синхронизаци транзакций"
     )
 
+    transactions_full_sync_dt: Mapped[datetime] = mapped_column(
+        sa.DateTime,
+        nullable=True,
+        init=False,
+        comment="Дата последней полной сверки транзакций за период transaction_days"
+    )
+
     cards_sync_dt: Mapped[datetime] = mapped_column(
         sa.DateTime,
         nullable=True,
@@ -993,6 +1063,14 @@ class OuterGoods(Base):
         comment="Система"
     )
 
+    external_id: Mapped[str] = mapped_column(
+        sa.String(255),
+        nullable=False,
+        server_default="",
+        init=False,
+        comment="Внешний идентификатор (идентификатор в системе поставщика услуг)"
+    )
+
     # Система
     system: Mapped["System"] = relationship(
         back_populates="outer_goods",
@@ -1027,9 +1105,34 @@ class OuterGoods(Base):
 
 class Transaction(Base):
     __tablename__ = "transaction"
-    __table_args__ = {
-        'comment': 'Транзакции'
-    }
+    __table_args__ = (
+        # Первичный ключ секционированной таблицы включает ключ секционирования. Порядок полей задан явно
+        # и совпадает с миграцией: поиск транзакции по id использует первичный ключ.
+        sa.PrimaryKeyConstraint("id", "date_time", name="transaction_pkey"),
+        # Пересчет балансов, последняя транзакция баланса
+        sa.Index(
+            "ix_transaction_balance_load",
+            "balance_id", "date_time_load", "load_seq",
+            postgresql_include=["total_sum", "company_balance"]
+        ),
+        # Транзакции поставщика услуг за период (синхронизация)
+        sa.Index("ix_transaction_system_date", "system_id", "date_time"),
+        # Время последнего использования карты
+        sa.Index("ix_transaction_card_date", "card_id", "date_time"),
+        # Транзакции определенного типа за день (комиссия за овердрафт)
+        sa.Index(
+            "ix_transaction_type_load",
+            "transaction_type", "date_time_load",
+            postgresql_include=["balance_id"]
+        ),
+        # Список транзакций за период
+        sa.Index("ix_transaction_date_time", "date_time"),
+        {
+            'comment': 'Транзакции',
+            # Таблица секционирована помесячно по времени совершения транзакции
+            'postgresql_partition_by': 'RANGE (date_time)'
+        }
+    )
 
     master_db_id: Mapped[str] = mapped_column(
         sa.String(255),
@@ -1047,8 +1150,10 @@ class Transaction(Base):
         comment="Внешний идентификатор (идентификатор в системе поставщика услуг)"
     )
 
+    # Входит в первичный ключ, так как является ключом секционирования
     date_time: Mapped[datetime] = mapped_column(
         sa.DateTime,
+        primary_key=True,
         nullable=False,
         server_default=sa.text("NOW()"),
         comment="Время совершения транзакции"
@@ -1062,6 +1167,14 @@ class Transaction(Base):
         comment="Время прогрузки в БД"
     )
 
+    load_seq: Mapped[int] = mapped_column(
+        sa.BigInteger,
+        sa.Identity(always=False),
+        nullable=False,
+        init=False,
+        comment="Порядковый номер прогрузки в БД (упорядочивает транзакции с одинаковым временем прогрузки)"
+    )
+
     transaction_type: Mapped[TransactionTypeEnum] = mapped_column(
         comment="Тип транзакции"
     )
@@ -1241,10 +1354,25 @@ class Transaction(Base):
     repr_cols = ("id", "transaction_sum", "date_time")
 
 
+# Секция по умолчанию для транзакций, время которых не попадает ни в одну из помесячных секций
+sa.event.listen(
+    Transaction.__table__,
+    "after_create",
+    sa.DDL("CREATE TABLE IF NOT EXISTS %(schema)s.transaction_default PARTITION OF %(fullname)s DEFAULT")
+)
+
+
 class MoneyReceipt(Base):
     __tablename__ = "money_receipt"
     __table_args__ = (
         UniqueConstraint("payment_id", "payment_date_time", "amount", name="uniq_pmntid_time_amount"),
+        sa.ForeignKeyConstraint(
+            ["transaction_id", "transaction_date_time"],
+            ["cargonomica.transaction.id", "cargonomica.transaction.date_time"],
+            name="money_receipt_transaction_fkey",
+            deferrable=True,
+            initially="IMMEDIATE"
+        ),
         {
             'comment': (
                 "Автозачисления денежных средств на балансы организаций"
@@ -1301,12 +1429,19 @@ class MoneyReceipt(Base):
 
     # Локальная транзакция
     transaction_id: Mapped[str] = mapped_column(
-        sa.ForeignKey("cargonomica.transaction.id"),
+        sa.Uuid(as_uuid=False),
         nullable=True,
         init=False,
         comment="Локальная транзакция"
     )
 
+    transaction_date_time: Mapped[datetime] = mapped_column(
+        sa.DateTime,
+        nullable=True,
+        init=False,
+        comment="Время совершения локальной транзакции (ключ секционирования таблицы транзакций)"
+    )
+
     # Локальная транзакция
     transaction: Mapped["Transaction"] = relationship(
         back_populates="money_receipt",
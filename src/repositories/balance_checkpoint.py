@@ -0,0 +1,118 @@
+from datetime import date, datetime
+from typing import Dict, List, Any
+
+import sqlalchemy as sa
+from sqlalchemy import select as sa_select, delete as sa_delete, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from src.database.model.models import BalanceCheckpoint as BalanceCheckpointOrm, Transaction as TransactionOrm
+from src.repositories.base import BaseRepository
+from src.utils.exceptions import DBException
+
+import traceback
+
+
+class BalanceCheckpointRepository(BaseRepository):
+    """
+    Балансы на конец дня. Позволяют получить баланс на начало произвольной даты одной выборкой по индексу
+    вместо поиска последней транзакции, предшествующей этой дате.
+    """
+
+    async def get_balance_before(self, balance_id: str, date_: date, commit: bool = True) -> float | None:
+        # Баланс на конец последнего дня с транзакциями, предшествующего указанной дате
+        stmt = (
+            sa_select(BalanceCheckpointOrm.company_balance)
+            .where(BalanceCheckpointOrm.balance_id == balance_id)
+            .where(BalanceCheckpointOrm.checkpoint_date < date_)
+            .order_by(BalanceCheckpointOrm.checkpoint_date.desc())
+            .limit(1)
+        )
+        company_balance = await self.select_single_field(stmt, commit=commit)
+        return company_balance
+
+    async def upsert(self, balance_id: str, checkpoint_date: date, company_balance: float, commit: bool = True) \
+            -> None:
+        await self.bulk_upsert(
+            [dict(balance_id=balance_id, checkpoint_date=checkpoint_date, company_balance=company_balance)],
+            commit=commit
+        )
+
+    async def bulk_upsert(self, dataset: List[Dict[str, Any]], commit: bool = True) -> None:
+        if not dataset:
+            return None
+
+        stmt = pg_insert(BalanceCheckpointOrm)
+        stmt = stmt.on_conflict_do_update(
+            constraint="unique_balance_checkpoint_date",
+            set_={"company_balance": stmt.excluded.company_balance}
+        )
+        try:
+            await self.session.execute(stmt, dataset)
+            if commit:
+                await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
+
+    async def rebuild(self, irrelevant_balances_data: Dict[str, datetime], commit: bool = True) -> None:
+        """
+        Перестраивает балансы на конец дня, начиная с даты, с которой баланс стал неактуальным.
+        Вызывается после пересчета балансов в истории транзакций.
+        """
+        if not irrelevant_balances_data:
+            return None
+
+        irrelevant = sa.values(
+            sa.column('balance_id', sa.Uuid(as_uuid=False)),
+            sa.column('from_date', sa.Date),
+            name='irrelevant'
+        ).data([
+            (balance_id, from_date_time.date()) for balance_id, from_date_time in irrelevant_balances_data.items()
+        ])
+
+        # Удаляем устаревшие записи
+        delete_stmt = (
+            sa_delete(BalanceCheckpointOrm)
+            .where(BalanceCheckpointOrm.balance_id == irrelevant.c.balance_id)
+            .where(BalanceCheckpointOrm.checkpoint_date >= irrelevant.c.from_date)
+        )
+
+        # Баланс после последней транзакции каждого дня
+        transaction_date = sa.cast(TransactionOrm.date_time_load, sa.Date)
+        end_of_day_balances = (
+            sa_select(
+                TransactionOrm.balance_id,
+                transaction_date.label('checkpoint_date'),
+                TransactionOrm.company_balance
+            )
+            .join(irrelevant, and_(
+                irrelevant.c.balance_id == TransactionOrm.balance_id,
+                TransactionOrm.date_time_load >= irrelevant.c.from_date
+            ))
+            .distinct(TransactionOrm.balance_id, transaction_date)
+            .order_by(
+                TransactionOrm.balance_id,
+                transaction_date,
+                TransactionOrm.date_time_load.desc(),
+                TransactionOrm.load_seq.desc()
+            )
+        )
+        insert_stmt = pg_insert(BalanceCheckpointOrm).from_select(
+            ["balance_id", "checkpoint_date", "company_balance"],
+            end_of_day_balances
+        )
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            constraint="unique_balance_checkpoint_date",
+            set_={"company_balance": insert_stmt.excluded.company_balance}
+        )
+
+        try:
+            await self.session.execute(delete_stmt)
+            await self.session.execute(insert_stmt)
+            if commit:
+                await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
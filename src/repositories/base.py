@@ -1,9 +1,9 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 import sqlalchemy as sa
 import sqlalchemy.exc
 import sqlparse
-from sqlalchemy.dialects.postgresql import insert as pg_insert, dialect as postgresql_dialect
+from sqlalchemy.dialects.postgresql import insert as pg_insert, dialect as postgresql_dialect, ARRAY
 from sqlalchemy.exc import IntegrityError
 
 from src.database.model import models
@@ -12,6 +12,7 @@ from src.database.db import get_session
 from src.utils.exceptions import DBException, DBDuplicateException, BadRequestException, api_logger
 
 import traceback
+import uuid
 
 
 class BaseRepository:
@@ -32,7 +33,7 @@ class BaseRepository:
         print(sqlparse.format(str(stmt.compile(dialect=postgresql_dialect())), reindent=True))
         print('   ')
 
-    async def select_helper(self, stmt, scalars=True) -> Any:
+    async def select_helper(self, stmt, scalars=True, commit=True) -> Any:
         try:
             if scalars:
                 result = await self.session.scalars(
@@ -43,23 +44,26 @@ class BaseRepository:
             else:
                 result = await self.session.execute(stmt)
 
-            await self.session.commit()
+            if commit:
+                await self.session.commit()
+
             return result
 
         except Exception:
             self.logger.error(traceback.format_exc())
             raise DBException()
 
-    async def select_all(self, stmt, scalars=True) -> Any:
-        dataset = await self.select_helper(stmt, scalars)
+    async def select_all(self, stmt, scalars=True, commit=True) -> Any:
+        # При commit=False транзакция остается открытой (например, чтобы сохранить блокировку SELECT ... FOR UPDATE)
+        dataset = await self.select_helper(stmt, scalars, commit)
         return dataset.all()
 
     async def select_first(self, stmt, scalars=True) -> Any:
         dataset = await self.select_helper(stmt, scalars)
         return dataset.first()
 
-    async def select_single_field(self, stmt) -> Any:
-        dataset = await self.select_helper(stmt, scalars=False)
+    async def select_single_field(self, stmt, commit=True) -> Any:
+        dataset = await self.select_helper(stmt, scalars=False, commit=commit)
         row = dataset.first()
         return row[0] if row else None
 
@@ -83,6 +87,38 @@ class BaseRepository:
                 self.logger.error(traceback.format_exc())
                 raise DBException()
 
+    async def bulk_delete(self, _model_, ids: List[Any], commit: bool = True, chunk_size: int = 10000,
+                          partition_field: str | None = None) -> None:
+        """
+        Удаление записей по списку идентификаторов: один запрос DELETE ... WHERE id = ANY(:ids) на каждые
+        chunk_size записей. При commit=False изменения фиксируются вместе с последующими операциями в сессии.
+        Для секционированной таблицы передается имя ключа секционирования partition_field, а вместо идентификаторов -
+        пары (id, значение ключа секционирования). Пары упорядочиваются по ключу, условие каждого запроса
+        дополняется диапазоном ключа, поэтому запрос обращается только к секциям, содержащим удаляемые записи.
+        """
+        if ids:
+            if partition_field:
+                ids = sorted(ids, key=lambda key: key[1])
+
+            try:
+                for i in range(0, len(ids), chunk_size):
+                    chunk = ids[i:i + chunk_size]
+                    chunk_ids = [key[0] for key in chunk] if partition_field else chunk
+                    ids_param = sa.bindparam("ids", chunk_ids, type_=ARRAY(_model_.id.type))
+                    stmt = sa.delete(_model_).where(_model_.id == sa.any_(ids_param))
+                    if partition_field:
+                        partition_column = getattr(_model_, partition_field)
+                        stmt = stmt.where(partition_column.between(chunk[0][1], chunk[-1][1]))
+
+                    await self.session.execute(stmt)
+
+                if commit:
+                    await self.session.commit()
+
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                raise DBException()
+
     async def delete_all(self, _model_) -> None:
         try:
             stmt = sa.delete(_model_)
@@ -94,15 +130,18 @@ class BaseRepository:
             self.logger.error(traceback.format_exc())
             raise DBException()
 
-    async def insert(self, _model_, **fields) -> Any:
+    async def insert(self, _model_, commit: bool = True, **fields) -> Any:
         try:
             stmt = pg_insert(_model_).values(fields)
             result = await self.session.scalars(
                 stmt.returning(_model_),
                 execution_options={"populate_existing": True}
             )
-            await self.session.commit()
-            return result.first()
+            obj = result.first()
+            if commit:
+                await self.session.commit()
+
+            return obj
 
         except sa.exc.IntegrityError:
             self.logger.error(traceback.format_exc())
@@ -129,7 +168,8 @@ class BaseRepository:
             self.logger.error(traceback.format_exc())
             raise DBException()
 
-    async def bulk_insert_or_update(self, _model_, dataset: list[Dict[str, Any]], index_field: str = None) -> None:
+    async def bulk_insert_or_update(self, _model_, dataset: list[Dict[str, Any]], index_field: str = None,
+                                    commit: bool = True) -> None:
         if dataset:
             try:
                 stmt = pg_insert(_model_)
@@ -141,18 +181,82 @@ class BaseRepository:
                     stmt = stmt.on_conflict_do_nothing()
 
                 await self.session.execute(stmt, dataset)
-                await self.session.commit()
+                if commit:
+                    await self.session.commit()
+
+            except Exception:
+                self.logger.error(traceback.format_exc())
+                raise DBException()
+
+    async def bulk_insert_copy(self, _model_, dataset: list[Dict[str, Any]], commit: bool = True) -> None:
+        """
+        Массовая запись через COPY: строки потоком загружаются во временную таблицу, после чего переносятся
+        в целевую таблицу одним запросом INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+        Все записи набора данных должны содержать одинаковый набор полей.
+        """
+        if dataset:
+            try:
+                connection = await self.session.connection()
+                preparer = connection.dialect.identifier_preparer
+                table = _model_.__table__
+                column_names = list(dataset[0].keys())
+                columns = ", ".join(preparer.quote(column_name) for column_name in column_names)
+
+                # Временная таблица без ограничений целевой таблицы, удаляется при фиксации транзакции.
+                # Поля без часового пояса загружаются как timestamptz: при переносе в целевую таблицу время
+                # приводится к часовому поясу сессии так же, как при обычной вставке.
+                staging_columns = []
+                for column_name in column_names:
+                    column = table.columns[column_name]
+                    quoted_name = preparer.quote(column_name)
+                    if isinstance(column.type, sa.DateTime) and not column.type.timezone:
+                        staging_columns.append(f"{quoted_name}::timestamptz AS {quoted_name}")
+                    else:
+                        staging_columns.append(quoted_name)
+
+                staging_table_name = f"copy_{table.name}_{uuid.uuid4().hex[:8]}"
+                await self.session.execute(sa.text(
+                    f"CREATE TEMP TABLE {staging_table_name} ON COMMIT DROP AS "
+                    f"SELECT {', '.join(staging_columns)} FROM {preparer.format_table(table)} WITH NO DATA"
+                ))
+
+                # Значения приводятся к виду, в котором их записывает SQLAlchemy (например, перечисления)
+                processors = []
+                for column_name in column_names:
+                    column_type = table.columns[column_name].type
+                    processors.append(column_type.dialect_impl(connection.dialect).bind_processor(connection.dialect))
+
+                raw_connection = await connection.get_raw_connection()
+                async with raw_connection.driver_connection.cursor() as cursor:
+                    async with cursor.copy(f"COPY {staging_table_name} ({columns}) FROM STDIN") as copy:
+                        for data in dataset:
+                            await copy.write_row([
+                                processor(data[column_name]) if processor else data[column_name]
+                                for column_name, processor in zip(column_names, processors)
+                            ])
+
+                staging_table = sa.table(staging_table_name, *[sa.column(name) for name in column_names])
+                stmt = (
+                    pg_insert(_model_)
+                    .from_select(column_names, sa.select(*staging_table.columns))
+                    .on_conflict_do_nothing()
+                )
+                await self.session.execute(stmt)
+
+                if commit:
+                    await self.session.commit()
 
             except Exception:
                 self.logger.error(traceback.format_exc())
                 raise DBException()
 
-    async def bulk_update(self, _model_, dataset: list[Dict[str, Any]]) -> None:
+    async def bulk_update(self, _model_, dataset: list[Dict[str, Any]], commit: bool = True) -> None:
         if dataset:
             try:
                 stmt = sa.update(_model_)
                 await self.session.execute(stmt, dataset)
-                await self.session.commit()
+                if commit:
+                    await self.session.commit()
 
             except Exception:
                 self.logger.error(traceback.format_exc())
@@ -294,7 +294,8 @@ class NNKMigration(BaseRepository):
             ) for transaction in transactions
         ]
 
-        await self.bulk_insert_or_update(TransactionOrm, dataset)
+        # История транзакций переносится целиком - записываем через COPY
+        await self.bulk_insert_copy(TransactionOrm, dataset)
 
     @staticmethod
     def get_transaction_type(transaction: Dict[str, Any]) -> TransactionType:
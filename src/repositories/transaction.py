@@ -1,7 +1,9 @@
-from datetime import datetime, timedelta
-from typing import List, Dict
+from datetime import datetime, timedelta, date
+from typing import List, Dict, Any, Set
 
+import sqlalchemy as sa
 from sqlalchemy import select as sa_select, and_, func, update as sa_update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import joinedload, load_only, aliased
 
 from src.config import TZ
@@ -10,10 +12,13 @@ from src.database.model.models import (Transaction as TransactionOrm, System as
                                        OuterGoods as OuterGoodsOrm, Tariff as TariffOrm, Company as CompanyOrm,
                                        BalanceSystemTariff as BalanceSystemTariffOrm, CardSystem as CardSystemOrm,
                                        BalanceTariffHistory as BalanceTariffHistoryOrm)
+from src.repositories.balance_checkpoint import BalanceCheckpointRepository
 from src.repositories.base import BaseRepository
 from src.utils import enums
 from src.utils.enums import TransactionType
-from src.utils.exceptions import ForbiddenException
+from src.utils.exceptions import ForbiddenException, DBException
+
+import traceback
 
 
 class TransactionRepository(BaseRepository):
@@ -127,7 +132,7 @@ class TransactionRepository(BaseRepository):
             )
             .select_from(base_subquery, TransactionOrm)
             .where(TransactionOrm.id == base_subquery.c.id)
-            .order_by(TransactionOrm.date_time_load.desc())
+            .order_by(TransactionOrm.date_time_load.desc(), TransactionOrm.load_seq.desc())
         )
 
         # self.statement(stmt)
@@ -138,7 +143,7 @@ class TransactionRepository(BaseRepository):
         stmt = (
             sa_select(TransactionOrm)
             .where(TransactionOrm.balance_id == balance_id)
-            .order_by(TransactionOrm.date_time_load.desc())
+            .order_by(TransactionOrm.date_time_load.desc(), TransactionOrm.load_seq.desc())
             .limit(1)
         )
         last_transaction = await self.select_first(stmt)
@@ -146,15 +151,27 @@ class TransactionRepository(BaseRepository):
 
     async def create_corrective_transaction(self, balance: BalanceOrm, transaction_type: TransactionType,
                                             delta_sum: float) -> None:
-        # Получаем последнюю транзакцию этой организации
-        last_transaction = await self.get_last_transaction(balance.id)
-        previous_balance_sum = last_transaction.company_balance if last_transaction else balance.balance
+        # Блокируем строку баланса до фиксации изменений (SELECT ... FOR UPDATE), как при записи транзакций
+        # синхронизацией: параллельная запись транзакций по этому балансу дождется фиксации и продолжит
+        # от обновленного баланса. Баланс и баланс на конец дня читаем после получения блокировки.
+        now = datetime.now(tz=TZ)
+        lock_stmt = sa_select(BalanceOrm.balance).where(BalanceOrm.id == balance.id).with_for_update()
+        current_balance_sum = await self.select_single_field(lock_stmt, commit=False)
+
+        # Получаем баланс на конец последнего дня с транзакциями (включая сегодняшний)
+        checkpoint_repository = BalanceCheckpointRepository(self.session, self.user)
+        previous_balance_sum = await checkpoint_repository.get_balance_before(
+            balance_id=balance.id,
+            date_=now.date() + timedelta(days=1),
+            commit=False
+        )
+        if previous_balance_sum is None:
+            previous_balance_sum = current_balance_sum
 
         # Формируем корректирующую транзакцию
         if transaction_type == TransactionType.DECREASE:
             delta_sum = -delta_sum
 
-        now = datetime.now(tz=TZ)
         corrective_transaction = {
             "date_time": now,
             "date_time_load": now,
@@ -164,11 +181,30 @@ class TransactionRepository(BaseRepository):
             "total_sum": delta_sum,
             "company_balance": previous_balance_sum + delta_sum,
         }
-        corrective_transaction = await self.insert(TransactionOrm, **corrective_transaction)
+        corrective_transaction = await self.insert(TransactionOrm, commit=False, **corrective_transaction)
+
+        # Обновляем баланс на конец сегодняшнего дня
+        await checkpoint_repository.upsert(
+            balance_id=balance.id,
+            checkpoint_date=now.date(),
+            company_balance=corrective_transaction.company_balance,
+            commit=False
+        )
 
         # Обновляем сумму на балансе
-        update_data = {'balance': corrective_transaction.company_balance}
-        await self.update_object(balance, update_data)
+        await self.bulk_update(
+            BalanceOrm,
+            [{"id": balance.id, "balance": corrective_transaction.company_balance}],
+            commit=False
+        )
+
+        # Фиксируем транзакцию, баланс на конец дня и сумму на балансе одной транзакцией БД
+        try:
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
 
     async def get_recent_system_transactions(self, system_id: str, transaction_days: int) \
             -> List[TransactionOrm]:
@@ -196,15 +232,99 @@ class TransactionRepository(BaseRepository):
 
         return transactions
 
-    async def renew_cards_date_last_use(self) -> None:
-        date_last_use_subquery = (
+    async def get_recent_system_transaction_rows(self, system_id: str, transaction_days: int) -> List[sa.Row]:
+        """
+        Облегченная выборка транзакций поставщика услуг для сверки: вместо ORM-объектов со связанными записями
+        возвращает строки только с полями, необходимыми для сопоставления и удаления транзакций.
+        """
+        start_date = datetime.now(tz=TZ).date() - timedelta(days=transaction_days)
+        stmt = (
+            sa_select(
+                TransactionOrm.id,
+                TransactionOrm.external_id,
+                TransactionOrm.balance_id,
+                TransactionOrm.card_id,
+                TransactionOrm.date_time_load,
+                TransactionOrm.date_time,
+                TransactionOrm.fuel_volume,
+                TransactionOrm.transaction_sum,
+                CardOrm.card_number
+            )
+            .outerjoin(CardOrm, CardOrm.id == TransactionOrm.card_id)
+            .where(TransactionOrm.date_time >= start_date)
+            .where(TransactionOrm.system_id == system_id)
+        )
+        transactions = await self.select_all(stmt, scalars=False)
+        return transactions
+
+    async def get_system_transaction_external_ids(self, system_id: str, from_date: date) -> Set[str]:
+        # Идентификаторы транзакций в системе поставщика услуг, прогруженных начиная с указанной даты
+        stmt = (
+            sa_select(TransactionOrm.external_id)
+            .where(TransactionOrm.system_id == system_id)
+            .where(TransactionOrm.date_time >= from_date)
+            .where(TransactionOrm.external_id != "")
+        )
+        external_ids = await self.select_all(stmt)
+        return set(external_ids)
+
+    async def renew_cards_date_last_use(self, inserted_transactions: List[Dict[str, Any]] | None = None,
+                                        deleted_card_ids: List[str] | None = None,
+                                        full_rebuild: bool = False) -> None:
+        """
+        Обновляет дату последнего использования только тех карт, по которым прогружены или удалены транзакции.
+        Для новых транзакций дата сдвигается вперед (GREATEST), для карт с удаленными транзакциями вычисляется
+        заново по оставшимся транзакциям. Режим full_rebuild пересчитывает дату по всем картам (восстановление).
+        """
+        try:
+            if full_rebuild:
+                stmt = sa_update(CardOrm).values(date_last_use=self.card_date_last_use_subquery())
+                await self.session.execute(stmt)
+
+            # Карты с удаленными транзакциями
+            if deleted_card_ids:
+                stmt = (
+                    sa_update(CardOrm)
+                    .where(CardOrm.id.in_(list(set(deleted_card_ids))))
+                    .values(date_last_use=self.card_date_last_use_subquery())
+                    .execution_options(synchronize_session=False)
+                )
+                await self.session.execute(stmt)
+
+            # Карты с новыми транзакциями
+            dates_last_use = {}
+            for transaction in inserted_transactions or []:
+                card_id, date_last_use = transaction['card_id'], transaction['date_time'].date()
+                if card_id and (card_id not in dates_last_use or dates_last_use[card_id] < date_last_use):
+                    dates_last_use[card_id] = date_last_use
+
+            if dates_last_use:
+                new_dates = sa.values(
+                    sa.column("card_id", CardOrm.id.type),
+                    sa.column("date_last_use", sa.Date),
+                    name="new_dates"
+                ).data(list(dates_last_use.items()))
+                stmt = (
+                    sa_update(CardOrm)
+                    .where(CardOrm.id == new_dates.c.card_id)
+                    .values(date_last_use=func.greatest(CardOrm.date_last_use, new_dates.c.date_last_use))
+                    .execution_options(synchronize_session=False)
+                )
+                await self.session.execute(stmt)
+
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
+
+    @staticmethod
+    def card_date_last_use_subquery():
+        return (
             sa_select(func.max(TransactionOrm.date_time))
             .where(TransactionOrm.card_id == CardOrm.id)
             .scalar_subquery()
         )
-        stmt = sa_update(CardOrm).values(date_last_use=date_last_use_subquery)
-        await self.session.execute(stmt)
-        await self.session.commit()
 
     async def get_balance_system_tariff_list(self, system_id: str) -> List[BalanceSystemTariffOrm]:
         bst = aliased(BalanceSystemTariffOrm, name="bst")
@@ -252,3 +372,44 @@ class TransactionRepository(BaseRepository):
         stmt = sa_select(OuterGoodsOrm).where(OuterGoodsOrm.system_id == system_id)
         outer_goods = await self.select_all(stmt)
         return outer_goods
+
+    async def resolve_outer_goods(self, system_id: str, goods_data: Dict[str, Dict[str, Any]],
+                                  key_field: str = "name") -> Dict[str, OuterGoodsOrm]:
+        """
+        Сопоставляет товары/услуги пакета транзакций с записями БД.
+        goods_data - словарь: ключ товара/услуги (значение поля key_field) -> поля товара/услуги.
+        Товары/услуги, отсутствующие в БД, записываются одним запросом.
+        Возвращает словарь: ключ товара/услуги -> товар/услуга.
+        """
+        outer_goods = {
+            getattr(goods, key_field): goods for goods in await self.get_outer_goods_list(system_id)
+        }
+        dataset = [
+            fields | {key_field: key, "system_id": system_id}
+            for key, fields in goods_data.items() if key not in outer_goods
+        ]
+        if not dataset:
+            return outer_goods
+
+        # Товар/услуга с таким же наименованием мог быть записан ранее без внешнего идентификатора
+        stmt = pg_insert(OuterGoodsOrm)
+        values_set = {
+            field: getattr(stmt.excluded, field) for field in dataset[0] if field not in ("name", "system_id")
+        }
+        if values_set:
+            stmt = stmt.on_conflict_do_update(index_elements=["name", "system_id"], set_=values_set)
+        else:
+            stmt = stmt.on_conflict_do_nothing()
+
+        try:
+            await self.session.execute(stmt, dataset)
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
+
+        outer_goods = {
+            getattr(goods, key_field): goods for goods in await self.get_outer_goods_list(system_id)
+        }
+        return outer_goods
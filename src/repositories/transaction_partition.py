@@ -0,0 +1,130 @@
+from datetime import date
+from typing import List
+
+import sqlalchemy as sa
+
+from src.repositories.base import BaseRepository
+from src.utils.exceptions import DBException
+
+import traceback
+
+
+class TransactionPartitionRepository(BaseRepository):
+    """
+    Помесячные секции таблицы транзакций (секционирование по времени совершения транзакции).
+    Секция за месяц называется transaction_yYYYYmMM. Транзакции, не попавшие ни в одну из секций,
+    записываются в секцию по умолчанию transaction_default.
+    """
+
+    schema = "cargonomica"
+    table = "transaction"
+
+    @classmethod
+    def partition_name(cls, year: int, month: int) -> str:
+        return f"{cls.table}_y{year:04d}m{month:02d}"
+
+    @staticmethod
+    def month_start(year: int, month: int) -> date:
+        # Нормализуем номер месяца, выходящий за пределы года
+        year += (month - 1) // 12
+        month = (month - 1) % 12 + 1
+        return date(year, month, 1)
+
+    async def get_partitions(self) -> List[str]:
+        stmt = sa.text(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            JOIN pg_namespace ns ON parent.relnamespace = ns.oid
+            WHERE ns.nspname = :schema AND parent.relname = :table
+            ORDER BY child.relname
+            """
+        )
+        result = await self.session.execute(stmt, {"schema": self.schema, "table": self.table})
+        return list(result.scalars().all())
+
+    async def create_partition(self, year: int, month: int) -> None:
+        """
+        Создает секцию за месяц. Если транзакции за этот месяц уже попали в секцию по умолчанию
+        (секция не была создана заранее или поставщик передал транзакцию с будущей датой), то они переносятся
+        в новую секцию в той же транзакции БД: иначе создание секции завершится ошибкой.
+        """
+        from_date = self.month_start(year, month)
+        to_date = self.month_start(year, month + 1)
+        partition_name = self.partition_name(year, month)
+        default_partition = f"{self.schema}.{self.table}_default"
+        period_condition = f"date_time >= '{from_date.isoformat()}' AND date_time < '{to_date.isoformat()}'"
+        try:
+            rows_in_default = await self.session.scalar(sa.text(
+                f"SELECT count(*) FROM {default_partition} WHERE {period_condition}"
+            ))
+            if rows_in_default:
+                self.logger.warning(
+                    f"В секции по умолчанию {default_partition} найдены транзакции за период "
+                    f"{from_date.isoformat()} - {to_date.isoformat()}: {rows_in_default} шт. "
+                    f"Переношу их в секцию {partition_name}"
+                )
+
+                # Ссылки из автозачислений на переносимые транзакции проверяются при фиксации транзакции БД,
+                # когда транзакции уже находятся в новой секции
+                await self.session.execute(sa.text(
+                    f"SET CONSTRAINTS {self.schema}.money_receipt_transaction_fkey DEFERRED"
+                ))
+                await self.session.execute(sa.text(
+                    f"CREATE TEMP TABLE moved_transactions (LIKE {default_partition}) ON COMMIT DROP"
+                ))
+                await self.session.execute(sa.text(
+                    f"WITH moved AS (DELETE FROM {default_partition} WHERE {period_condition} RETURNING *) "
+                    f"INSERT INTO moved_transactions SELECT * FROM moved"
+                ))
+
+            await self.session.execute(sa.text(
+                f"CREATE TABLE IF NOT EXISTS {self.schema}.{partition_name} "
+                f"PARTITION OF {self.schema}.{self.table} "
+                f"FOR VALUES FROM ('{from_date.isoformat()}') TO ('{to_date.isoformat()}')"
+            ))
+
+            if rows_in_default:
+                await self.session.execute(sa.text(
+                    f"INSERT INTO {self.schema}.{self.table} SELECT * FROM moved_transactions"
+                ))
+
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
+
+    async def create_monthly_partitions(self, from_date: date, months_ahead: int) -> List[str]:
+        """
+        Создает секции, начиная с месяца указанной даты и на указанное количество месяцев вперед.
+        Уже существующие секции пропускаются. Возвращает имена созданных секций.
+        """
+        existing_partitions = set(await self.get_partitions())
+        created = []
+        for i in range(months_ahead + 1):
+            month_start = self.month_start(from_date.year, from_date.month + i)
+            partition_name = self.partition_name(month_start.year, month_start.month)
+            if partition_name not in existing_partitions:
+                await self.create_partition(month_start.year, month_start.month)
+                created.append(partition_name)
+
+        return created
+
+    async def detach_partition(self, year: int, month: int) -> None:
+        """
+        Отсоединяет секцию за месяц от таблицы транзакций. Данные остаются в отдельной таблице,
+        которую можно заархивировать или удалить без блокировки основной таблицы на время удаления строк.
+        """
+        stmt = sa.text(
+            f"ALTER TABLE {self.schema}.{self.table} DETACH PARTITION {self.schema}.{self.partition_name(year, month)}"
+        )
+        try:
+            await self.session.execute(stmt)
+            await self.session.commit()
+
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            raise DBException()
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Iterable, List, Tuple, Type, TypeVar
+
+from src.utils.log import ColoredLogger
+
+T = TypeVar("T")
+
+
+class PageFetcher:
+    """
+    Параллельная загрузка страниц (порций данных) из API внешней системы.
+    Количество одновременных запросов ограничено max_in_flight, результаты возвращаются в порядке ключей страниц.
+    Неудачный запрос страницы повторяется до retries раз с нарастающей паузой, остальные страницы
+    при этом не перезапрашиваются.
+    Поддерживаются асинхронные клиенты (fetch_all) и синхронные клиенты (fetch_all_sync - в пуле потоков).
+    """
+
+    def __init__(self, max_in_flight: int, retries: int = 3, retry_delay: float = 1.0,
+                 retry_on: Tuple[Type[Exception], ...] = (Exception,), logger: ColoredLogger | None = None):
+        self.max_in_flight = max(max_in_flight, 1)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.retry_on = retry_on
+        self.logger = logger
+
+    async def fetch_all(self, fetch_page: Callable[[Any], Awaitable[T]], page_keys: Iterable[Any]) -> List[T]:
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def fetch(page_key: Any) -> T:
+            async with semaphore:
+                return await self.fetch_with_retries(fetch_page, page_key)
+
+        return list(await asyncio.gather(*[fetch(page_key) for page_key in page_keys]))
+
+    async def fetch_with_retries(self, fetch_page: Callable[[Any], Awaitable[T]], page_key: Any) -> T:
+        attempt = 0
+        while True:
+            try:
+                return await fetch_page(page_key)
+
+            except self.retry_on as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+
+                self._log_retry(page_key, attempt, e)
+                await asyncio.sleep(self.retry_delay * attempt)
+
+    def fetch_all_sync(self, fetch_page: Callable[[Any], T], page_keys: Iterable[Any]) -> List[T]:
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            return list(executor.map(lambda page_key: self.fetch_with_retries_sync(fetch_page, page_key), page_keys))
+
+    def fetch_with_retries_sync(self, fetch_page: Callable[[Any], T], page_key: Any) -> T:
+        attempt = 0
+        while True:
+            try:
+                return fetch_page(page_key)
+
+            except self.retry_on as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+
+                self._log_retry(page_key, attempt, e)
+                time.sleep(self.retry_delay * attempt)
+
+    def _log_retry(self, page_key: Any, attempt: int, error: Exception) -> None:
+        if self.logger:
+            self.logger.warning(f"Не удалось получить страницу {page_key}: {error!r}. "
+                                f"Повторный запрос {attempt} из {self.retries}")
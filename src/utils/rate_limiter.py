@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов к API внешней системы по алгоритму «корзина токенов».
+    Корзина пополняется со скоростью rate токенов в секунду и вмещает не более capacity токенов:
+    в среднем выполняется не более rate запросов в секунду, подряд без ожидания - не более capacity запросов.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 1) -> None:
+        # Ожидающие получают токены в порядке очереди
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
@@ -0,0 +1,80 @@
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, List, Tuple
+
+
+class ReconciliationResult:
+    """
+    Результат сверки локальных записей с полученными от внешней системы.
+    matched   - пары (локальная запись, внешняя запись), признанные идентичными;
+    to_delete - локальные записи, отсутствующие во внешней системе;
+    to_insert - записи внешней системы, отсутствующие локально (в порядке поступления от внешней системы).
+    """
+
+    def __init__(self, matched: List[Tuple[Any, Any]], to_delete: List[Any], to_insert: List[Any]):
+        self.matched = matched
+        self.to_delete = to_delete
+        self.to_insert = to_insert
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "local": len(self.matched) + len(self.to_delete),
+            "remote": len(self.matched) + len(self.to_insert),
+            "matched": len(self.matched),
+            "to_delete": len(self.to_delete),
+            "to_insert": len(self.to_insert),
+        }
+
+    def __repr__(self) -> str:
+        return "ReconciliationResult({})".format(
+            ", ".join(f"{key}={value}" for key, value in self.stats().items())
+        )
+
+
+class Reconciliation:
+    """
+    Сверка локальных записей с записями внешней системы за линейное время.
+    Записи внешней системы индексируются по ключу сопоставления (например, время, объем топлива и сумма
+    транзакции). Индекс является мультимножеством: одинаковые записи сопоставляются попарно,
+    каждая запись внешней системы может быть сопоставлена только одной локальной записи.
+    """
+
+    def __init__(self, local_key: Callable[[Any], Hashable], remote_key: Callable[[Any], Hashable]):
+        self.local_key = local_key
+        self.remote_key = remote_key
+
+    def reconcile(self, local_items: Iterable[Any], remote_items: Iterable[Any]) -> ReconciliationResult:
+        remote_items = list(remote_items)
+
+        # Мультимножество: ключ сопоставления -> позиция первой несопоставленной записи внешней системы.
+        # Позиции повторяющихся записей хранятся отдельно, чтобы не создавать очередь для каждого ключа.
+        index: Dict[Hashable, int] = {}
+        duplicates: Dict[Hashable, Deque[int]] = {}
+        for position, remote_item in enumerate(remote_items):
+            key = self.remote_key(remote_item)
+            if key in index:
+                duplicates.setdefault(key, deque()).append(position)
+            else:
+                index[key] = position
+
+        matched = []
+        to_delete = []
+        is_matched = [False] * len(remote_items)
+        for local_item in local_items:
+            key = self.local_key(local_item)
+            position = index.pop(key, None)
+            if position is None:
+                to_delete.append(local_item)
+                continue
+
+            is_matched[position] = True
+            matched.append((local_item, remote_items[position]))
+            if duplicates.get(key):
+                index[key] = duplicates[key].popleft()
+
+        to_insert = [remote_item for position, remote_item in enumerate(remote_items) if not is_matched[position]]
+        return ReconciliationResult(matched=matched, to_delete=to_delete, to_insert=to_insert)
+
+
+def money_key(value: float | None) -> float:
+    # Суммы и объемы хранятся в БД с точностью до двух знаков после запятой
+    return round(abs(value or 0), 2)
@@ -0,0 +1,3 @@
+from src.celery_tasks.partitions.run import run_create_transaction_partitions
+
+run_create_transaction_partitions()
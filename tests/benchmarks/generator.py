@@ -0,0 +1,341 @@
+import random
+import uuid
+from collections import defaultdict
+from copy import deepcopy
+from datetime import datetime, timedelta, date
+from typing import Dict, Any, List
+
+from sqlalchemy import select as sa_select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.celery_tasks.gpn.config import SYSTEM_SHORT_NAME as GPN_SYSTEM_SHORT_NAME
+from src.celery_tasks.khnp.api import CardStatus
+from src.celery_tasks.khnp.config import SYSTEM_SHORT_NAME as KHNP_SYSTEM_SHORT_NAME
+from src.database.model.card import CardOrm
+from src.database.model.card_type import CardTypeOrm
+from src.database.model.models import (System as SystemOrm, Tariff as TariffOrm, Company as CompanyOrm,
+                                       Balance as BalanceOrm, BalanceSystemTariff as BalanceSystemTariffOrm,
+                                       BalanceTariffHistory as BalanceTariffHistoryOrm, CardSystem as CardSystemOrm,
+                                       OuterGoods as OuterGoodsOrm, Transaction as TransactionOrm,
+                                       OverdraftsHistory as OverdraftsHistoryOrm)
+from src.repositories.balance_checkpoint import BalanceCheckpointRepository
+from src.utils.enums import ContractScheme, TransactionType
+
+
+def new_id() -> str:
+    return str(uuid.uuid4())
+
+
+class SyntheticDataset:
+    """
+    Синтетические данные для нагрузочного тестирования: организации, балансы, карты систем ХНП и ГПН,
+    история тарифов, открытые овердрафты и транзакции.
+    Часть транзакций записывается в локальную БД (ранее прогруженная история), остальные возвращаются
+    только заглушкой API поставщика (новые транзакции). Часть локальных транзакций у поставщика отсутствует
+    и должна быть удалена при синхронизации.
+    """
+
+    goods_names = ("ДТ", "АИ-92", "АИ-95")
+    # Коды товаров в системе ГПН
+    gpn_product_ids = ("00000000000003", "00000000000004", "00000000000005")
+    transaction_days = 30
+    # Доля транзакций, ранее прогруженных в локальную БД
+    loaded_share = 0.8
+    # Каждая N-я локальная транзакция отсутствует у поставщика
+    deleted_each = 20
+
+    def __init__(self, companies: int, cards_per_company: int, transactions_per_card: int, seed: int = 1):
+        self.companies = companies
+        self.cards_per_company = cards_per_company
+        self.transactions_per_card = transactions_per_card
+        self.random = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+
+        self.system_id = new_id()
+        self.gpn_system_id = new_id()
+        self.tariffs: List[Dict[str, Any]] = []
+        self.company_rows: List[Dict[str, Any]] = []
+        self.balance_rows: List[Dict[str, Any]] = []
+        self.card_rows: List[Dict[str, Any]] = []
+        self.card_system_rows: List[Dict[str, Any]] = []
+        self.goods_rows: List[Dict[str, Any]] = []
+        self.local_transactions: List[Dict[str, Any]] = []
+
+        # Данные заглушки API ХНП
+        self.provider_cards: List[Dict[str, Any]] = []
+        self.provider_transactions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+
+        # Данные заглушки API ГПН
+        self.gpn_goods: List[Dict[str, Any]] = []
+        self.gpn_transactions: List[Dict[str, Any]] = []
+        self.gpn_transaction_counter = 0
+
+    def _transaction_time(self, i: int) -> datetime:
+        # Транзакции карты равномерно распределены по периоду синхронизации. API ГПН возвращает время транзакции
+        # с точностью до секунды.
+        period = timedelta(days=self.transaction_days - 1)
+        return (self.now - period + period * i / max(self.transactions_per_card, 1)).replace(microsecond=0)
+
+    def generate(self) -> None:
+        self.tariffs = [
+            dict(id=new_id(), name=f"Нагрузочный тариф {fee}%", fee_percent=fee) for fee in (0.5, 1.0, 1.5)
+        ]
+        self.goods_rows = [
+            dict(id=new_id(), name=name, system_id=self.system_id, inner_goods_id=None, external_id="")
+            for name in self.goods_names
+        ]
+        self.gpn_goods = [
+            dict(id=product_id, name=name) for product_id, name in zip(self.gpn_product_ids, self.goods_names)
+        ]
+        self.goods_rows.extend([
+            dict(id=new_id(), name=goods["name"], system_id=self.gpn_system_id, inner_goods_id=None,
+                 external_id=goods["id"])
+            for goods in self.gpn_goods
+        ])
+        goods_by_system = {
+            self.system_id: self.goods_rows[:len(self.goods_names)],
+            self.gpn_system_id: self.goods_rows[len(self.goods_names):],
+        }
+
+        card_counter = 0
+        for company_index in range(self.companies):
+            company_id = new_id()
+            self.company_rows.append(dict(
+                id=company_id,
+                name=f"Нагрузочная организация {company_index}",
+                inn=f"{company_index:012d}",
+                personal_account=f"{company_index:07d}",
+                min_balance=0,
+                overdraft_on=company_index % 3 == 0,
+                overdraft_sum=500000 if company_index % 3 == 0 else 0,
+                overdraft_days=7,
+                overdraft_fee_percent=0.074,
+            ))
+
+            balance_id = new_id()
+            tariff = self.tariffs[company_index % len(self.tariffs)]
+            balance = dict(id=balance_id, company_id=company_id, scheme=ContractScheme.OVERBOUGHT, balance=0,
+                           tariff=tariff)
+            self.balance_rows.append(balance)
+
+            # Пополнение баланса. У части организаций его не хватает на все покупки.
+            purchases_estimate = 2 * self.cards_per_company * self.transactions_per_card * 3000
+            deposit = round(purchases_estimate * self.random.uniform(0.5, 1.5), 2)
+            self.local_transactions.append(dict(
+                id=new_id(),
+                external_id="",
+                date_time=self.now - timedelta(days=self.transaction_days),
+                date_time_load=self.now - timedelta(days=self.transaction_days),
+                transaction_type=TransactionType.REFILL,
+                system_id=None,
+                card_id=None,
+                balance_id=balance_id,
+                azs_code="",
+                outer_goods_id=None,
+                fuel_volume=0,
+                price=0,
+                transaction_sum=deposit,
+                fee_sum=0,
+                total_sum=deposit,
+                comments="",
+            ))
+
+            # У каждой организации карты обеих систем
+            for _ in range(self.cards_per_company):
+                card_number = f"{7000000000000000 + card_counter}"
+                gpn_card_number = f"{7005830000000000 + card_counter}"
+                card_counter += 1
+
+                card_id = new_id()
+                self.card_rows.append(dict(id=card_id, card_number=card_number, company_id=company_id,
+                                           external_id=None))
+                self.card_system_rows.append(dict(card_id=card_id, system_id=self.system_id))
+                self.provider_cards.append({
+                    "cardNo": card_number,
+                    "status_name": "Активная",
+                    "cardBlockRequest": CardStatus.ACTIVE.value,
+                })
+
+                gpn_card_id = new_id()
+                self.card_rows.append(dict(id=gpn_card_id, card_number=gpn_card_number, company_id=company_id,
+                                           external_id=str(card_counter)))
+                self.card_system_rows.append(dict(card_id=gpn_card_id, system_id=self.gpn_system_id))
+
+                for i in range(self.transactions_per_card):
+                    self._generate_card_transaction(i, self.system_id, card_id, card_number, balance_id,
+                                                    float(tariff["fee_percent"]), goods_by_system[self.system_id])
+                    self._generate_card_transaction(i, self.gpn_system_id, gpn_card_id, gpn_card_number, balance_id,
+                                                    float(tariff["fee_percent"]),
+                                                    goods_by_system[self.gpn_system_id])
+
+        # Балансы после транзакций в порядке прогрузки
+        self.local_transactions.sort(key=lambda transaction: transaction["date_time_load"])
+        balances = {balance["id"]: balance for balance in self.balance_rows}
+        for transaction in self.local_transactions:
+            balance = balances[transaction["balance_id"]]
+            balance["balance"] = round(balance["balance"] + transaction["total_sum"], 2)
+            transaction["company_balance"] = balance["balance"]
+
+    def _generate_card_transaction(self, i: int, system_id: str, card_id: str, card_number: str, balance_id: str,
+                                   fee_percent: float, goods_rows: List[Dict[str, Any]]) -> None:
+        date_time = self._transaction_time(i)
+        liters = round(self.random.uniform(10, 80), 2)
+        price = round(self.random.uniform(50, 70), 2)
+        money = round(liters * price, 2)
+        goods = goods_rows[i % len(goods_rows)]
+        azs_code = f"АЗС № {i % 50:02d}"
+
+        loaded = i < self.transactions_per_card * self.loaded_share
+        deleted = loaded and i % self.deleted_each == 0
+        external_id = ""
+        if system_id == self.gpn_system_id:
+            # Транзакция в формате API ГПН
+            self.gpn_transaction_counter += 1
+            external_id = str(self.gpn_transaction_counter)
+            remote_transaction = dict(
+                id=self.gpn_transaction_counter,
+                timestamp=date_time.isoformat(sep=" "),
+                card_number=card_number,
+                poi_id=azs_code,
+                type="P",
+                product_id=goods["external_id"],
+                qty=-liters,
+                price=price,
+                sum=-money,
+            )
+            if not deleted:
+                self.gpn_transactions.append(remote_transaction)
+
+        else:
+            remote_transaction = dict(
+                azs=azs_code,
+                product_type=goods["name"],
+                price=price,
+                liters_ordered=liters,
+                liters_received=liters,
+                fuel_volume=liters,
+                money_request=money,
+                money_rest=0.0,
+                type="Дебет",
+                date_time=date_time,
+            )
+            if not deleted:
+                self.provider_transactions[card_number].append(remote_transaction)
+
+        if loaded:
+            fee_sum = -money * fee_percent / 100
+            self.local_transactions.append(dict(
+                id=new_id(),
+                external_id=external_id,
+                date_time=date_time,
+                date_time_load=date_time + timedelta(minutes=30),
+                transaction_type=TransactionType.PURCHASE,
+                system_id=system_id,
+                card_id=card_id,
+                balance_id=balance_id,
+                azs_code=azs_code,
+                outer_goods_id=goods["id"],
+                fuel_volume=-liters,
+                price=price,
+                transaction_sum=-money,
+                fee_sum=fee_sum,
+                total_sum=-money + fee_sum,
+                comments="",
+            ))
+
+    def get_provider_transactions(self) -> Dict[str, List[Dict[str, Any]]]:
+        # Контроллер изменяет полученный словарь, поэтому каждый раз возвращаем копию
+        return deepcopy(dict(self.provider_transactions))
+
+    def get_gpn_transactions(self, page_offset: int, page_limit: int) -> List[Dict[str, Any]]:
+        # Клиент API ГПН изменяет полученные транзакции, поэтому возвращаем копии
+        return deepcopy(self.gpn_transactions[page_offset:page_offset + page_limit])
+
+    async def load(self, session: AsyncSession) -> None:
+        if not self.company_rows:
+            self.generate()
+
+        stmt = sa_select(CardTypeOrm).where(CardTypeOrm.name == 'Пластиковая карта')
+        card_type = (await session.scalars(stmt)).first()
+        if card_type:
+            card_type_id = card_type.id
+        else:
+            card_type_id = new_id()
+            await session.execute(pg_insert(CardTypeOrm), [dict(id=card_type_id, name='Пластиковая карта')])
+
+        today = date.today()
+        history_start = today - timedelta(days=self.transaction_days * 2)
+        tariff_change_date = today - timedelta(days=self.transaction_days // 2)
+
+        await session.execute(pg_insert(SystemOrm), [
+            dict(
+                id=self.system_id,
+                full_name="ХНП (нагрузочное тестирование)",
+                short_name=KHNP_SYSTEM_SHORT_NAME,
+                scheme=ContractScheme.OVERBOUGHT,
+                transaction_days=self.transaction_days,
+            ),
+            dict(
+                id=self.gpn_system_id,
+                full_name="ГПН (нагрузочное тестирование)",
+                short_name=GPN_SYSTEM_SHORT_NAME,
+                scheme=ContractScheme.OVERBOUGHT,
+                transaction_days=self.transaction_days,
+            ),
+        ])
+        await session.execute(pg_insert(TariffOrm), self.tariffs)
+        await session.execute(pg_insert(OuterGoodsOrm), self.goods_rows)
+        await session.execute(pg_insert(CompanyOrm), self.company_rows)
+        await session.execute(
+            pg_insert(BalanceOrm),
+            [
+                dict(id=balance["id"], company_id=balance["company_id"], scheme=balance["scheme"],
+                     balance=balance["balance"])
+                for balance in self.balance_rows
+            ]
+        )
+
+        # Текущие тарифы и история тарифов: до смены тарифа действовал другой тариф
+        bst_dataset, bth_dataset = [], []
+        for index, balance in enumerate(self.balance_rows):
+            previous_tariff = self.tariffs[(index + 1) % len(self.tariffs)]
+            for system_id in (self.system_id, self.gpn_system_id):
+                bst_dataset.append(dict(balance_id=balance["id"], system_id=system_id,
+                                        tariff_id=balance["tariff"]["id"]))
+                bth_dataset.append(dict(balance_id=balance["id"], system_id=system_id,
+                                        tariff_id=previous_tariff["id"], start_date=history_start,
+                                        end_date=tariff_change_date))
+                bth_dataset.append(dict(balance_id=balance["id"], system_id=system_id,
+                                        tariff_id=balance["tariff"]["id"], start_date=tariff_change_date,
+                                        end_date=None))
+
+        await session.execute(pg_insert(BalanceSystemTariffOrm), bst_dataset)
+        await session.execute(pg_insert(BalanceTariffHistoryOrm), bth_dataset)
+
+        await session.execute(
+            pg_insert(CardOrm),
+            [dict(card, card_type_id=card_type_id, is_active=True) for card in self.card_rows]
+        )
+        await session.execute(pg_insert(CardSystemOrm), self.card_system_rows)
+
+        await session.execute(pg_insert(TransactionOrm), self.local_transactions)
+
+        # Открытые овердрафты по организациям с подключенной услугой и отрицательным балансом
+        companies = {company["id"]: company for company in self.company_rows}
+        overdrafts = [
+            dict(balance_id=balance["id"], days=7, sum=balance["balance"], begin_date=today - timedelta(days=3),
+                 end_date=None)
+            for balance in self.balance_rows
+            if companies[balance["company_id"]]["overdraft_on"] and balance["balance"] < 0
+        ]
+        if overdrafts:
+            await session.execute(pg_insert(OverdraftsHistoryOrm), overdrafts)
+
+        await session.commit()
+
+        # Балансы на конец дня по загруженной истории
+        checkpoint_repository = BalanceCheckpointRepository(session)
+        await checkpoint_repository.rebuild({
+            balance["id"]: self.now - timedelta(days=self.transaction_days) for balance in self.balance_rows
+        })
@@ -0,0 +1,184 @@
+import contextlib
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Any, List, AsyncIterator
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.celery_tasks.gpn.api import GPNApi
+from src.celery_tasks.khnp.api import CardStatus
+from src.utils.log import ColoredLogger
+from src.utils.rate_limiter import TokenBucket
+from tests.benchmarks.generator import SyntheticDataset
+
+
+class KHNPParserStub:
+    """
+    Заглушка API ХНП: вместо обращения к сайту поставщика возвращает синтетические данные.
+    """
+
+    def __init__(self, dataset: SyntheticDataset):
+        self.dataset = dataset
+        self.cards = dataset.provider_cards
+        self.changed_card_states: List[str] = []
+
+    def login(self) -> None:
+        pass
+
+    def get_balance(self) -> float:
+        return 10000000.0
+
+    def get_cards(self) -> List[Dict[str, Any]]:
+        return self.cards
+
+    def get_card_status(self, card_num: str) -> CardStatus:
+        for card_data in self.cards:
+            if card_data['cardNo'] == card_num:
+                return CardStatus(card_data['cardBlockRequest'])
+
+        return CardStatus.UNKNOWN
+
+    def get_transactions(self, start_date: date, end_date: date = date.today()) -> Dict[str, Any]:
+        return self.dataset.get_provider_transactions()
+
+    def change_card_states(self, card_numbers: List[str]) -> None:
+        self.changed_card_states.extend(card_numbers)
+
+
+class GPNApiStub(GPNApi):
+    """
+    Заглушка API ГПН: запросы обрабатываются без обращения к серверу поставщика, ответы формируются
+    по синтетическим данным. Остальная логика клиента (постраничная загрузка транзакций, сравнение
+    и пакетная установка лимитов) выполняется без изменений.
+    """
+
+    gpn_product_types = [{"id": "fuel", "name": "Топливо"}, {"id": "goods", "name": "Товары"}]
+
+    def __init__(self, dataset: SyntheticDataset, logger: ColoredLogger):
+        super().__init__(logger)
+        self.dataset = dataset
+        self.api_session_id = "benchmark"
+        self.contract_id = "benchmark"
+        # Замеряется работа конвейера, а не ожидание квоты запросов к API
+        self.rate_limiter = TokenBucket(rate=1000000, capacity=1000000)
+
+        # Группы карт организаций. У половины групп лимиты уже установлены.
+        self.card_groups = [
+            {"id": f"group-{index}", "name": company["personal_account"]}
+            for index, company in enumerate(dataset.company_rows)
+        ]
+        self.card_group_limits: Dict[str, List[Dict[str, Any]]] = {
+            group["id"]: [
+                self.make_card_group_limit_data(f"{group['id']}-{product_type['id']}", group["id"],
+                                                product_type["id"], 1)
+                for product_type in self.gpn_product_types
+            ] if index % 2 else []
+            for index, group in enumerate(self.card_groups)
+        }
+
+        self.requests: Dict[str, int] = {}
+        self.changed_card_states: Dict[str, bool] = {}
+
+    async def auth_user(self, use_cache: bool = True) -> None:
+        self.api_session_id = "benchmark"
+
+    async def request(self, method: str, api_version: str, fn: str, params: Dict[str, Any] | None = None,
+                      data: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        self.requests[fn] = self.requests.get(fn, 0) + 1
+        params = params or {}
+
+        if fn == "transactions":
+            return self.response({
+                "total_count": len(self.dataset.gpn_transactions),
+                "result": self.dataset.get_gpn_transactions(int(params["page_offset"]), int(params["page_limit"]))
+            })
+
+        if fn == "getDictionary":
+            dictionaries = {"ProductType": self.gpn_product_types, "Goods": self.dataset.gpn_goods}
+            return self.response({"result": dictionaries[params["name"]]})
+
+        if fn == "cardGroups":
+            return self.response({"result": self.card_groups})
+
+        if fn == "setCardGroup":
+            group = {"id": f"group-{len(self.card_groups)}", "name": data["name"]}
+            self.card_groups.append(group)
+            self.card_group_limits[group["id"]] = []
+            return self.response({"id": group["id"]})
+
+        if fn == "limit":
+            return self.response({"result": self.card_group_limits.get(params["group_id"], [])})
+
+        if fn == "setLimit":
+            for limit in json.loads(data["limit"]):
+                group_limits = self.card_group_limits[limit["group_id"]]
+                if "id" not in limit:
+                    limit["id"] = f"{limit['group_id']}-{limit['productType']}"
+                    group_limits.append(limit)
+                else:
+                    group_limits[:] = [limit if item["id"] == limit["id"] else item for item in group_limits]
+
+            return self.response({})
+
+        raise NotImplementedError(f"Заглушка API ГПН не поддерживает запрос {fn}")
+
+    @staticmethod
+    def response(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {"status": {"code": 200, "errors": None}, "data": data}
+
+    async def set_cards_state(self, external_card_ids: List[str], block: bool) -> None:
+        for external_card_id in external_card_ids:
+            self.changed_card_states[external_card_id] = block
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    wall_time: float
+    queries: int
+    peak_memory: int
+
+
+class PipelineBenchmark:
+    """
+    Замер этапов конвейера: время выполнения, количество запросов к БД и пиковый объем памяти,
+    выделенной интерпретатором Python за время этапа.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.metrics: List[StageMetrics] = []
+        self._queries = 0
+
+    def _count_query(self, *args, **kwargs) -> None:
+        self._queries += 1
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[None]:
+        self._queries = 0
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self._count_query)
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            yield
+
+        finally:
+            wall_time = time.perf_counter() - started
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            event.remove(self.engine.sync_engine, "before_cursor_execute", self._count_query)
+            self.metrics.append(StageMetrics(name, wall_time, self._queries, peak_memory))
+
+    def report(self) -> str:
+        lines = [f"{'Этап':<28}{'Время, с':>12}{'Запросов':>12}{'Память, МБ':>14}"]
+        for metrics in self.metrics:
+            lines.append(
+                f"{metrics.name:<28}{metrics.wall_time:>12.3f}{metrics.queries:>12}"
+                f"{metrics.peak_memory / 1024 / 1024:>14.2f}"
+            )
+
+        return "\n".join(lines)
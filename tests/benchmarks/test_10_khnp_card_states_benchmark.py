@@ -0,0 +1,56 @@
+import random
+import time
+
+import pytest
+
+from src.celery_tasks.khnp.api import CardStatus
+from src.celery_tasks.khnp.controller import KHNPController
+from src.database.model.card import BlockingCardReason
+from tests.test_9_khnp_card_states import make_local_card
+
+CARDS = 10000
+
+
+@pytest.mark.benchmark
+@pytest.mark.order(10)
+class TestKHNPCardStatesBenchmark:
+
+    """
+    Сверка статусов 10 000 карт ХНП
+    """
+
+    async def test_compare_khnp_card_states(self):
+        rnd = random.Random(1)
+        status_names = ["Активная", "Заблокирована по ПИН", "Заблокирована"]
+        block_requests = [card_status.value for card_status in CardStatus]
+        reasons = [None, BlockingCardReason.NNK, BlockingCardReason.PIN, BlockingCardReason.MANUALLY]
+
+        remote_cards = []
+        local_cards_to_be_active = []
+        local_cards_to_be_blocked = []
+        for i in range(CARDS):
+            card_number = f"{7000000000000000 + i}"
+            remote_cards.append({
+                "cardNo": card_number,
+                "status_name": rnd.choice(status_names),
+                "cardBlockRequest": rnd.choice(block_requests),
+            })
+            if i % 2:
+                local_cards_to_be_active.append(make_local_card(card_number, True, None))
+            else:
+                local_cards_to_be_blocked.append(make_local_card(card_number, False, rnd.choice(reasons)))
+
+        rnd.shuffle(remote_cards)
+
+        started = time.perf_counter()
+        cards_to_change_state, local_cards = KHNPController.compare_khnp_card_states(
+            remote_cards=remote_cards,
+            local_cards_to_be_active=local_cards_to_be_active,
+            local_cards_to_be_blocked=local_cards_to_be_blocked
+        )
+        wall_time = time.perf_counter() - started
+
+        print()
+        print(f"Карт: {CARDS}, сменить статус в ХНП: {len(cards_to_change_state)}, время: {wall_time:.3f} с")
+        assert len(local_cards) == CARDS
+        assert wall_time < 1, "Сверка статусов карт выполняется недопустимо долго"
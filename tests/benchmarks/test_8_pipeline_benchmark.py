@@ -0,0 +1,196 @@
+import os
+from typing import Dict, List
+
+import pytest
+
+from src.celery_tasks.balance.calc_balance import CalcBalances
+from src.celery_tasks.exceptions import celery_logger
+from src.celery_tasks.gpn import controller as gpn_controller
+from src.celery_tasks.gpn.controller import GPNController
+from src.celery_tasks.irrelevant_balances import IrrelevantBalances
+from src.celery_tasks.khnp import controller as khnp_controller
+from src.celery_tasks.khnp.controller import KHNPController
+from src.celery_tasks.overdraft.controller import Overdraft
+from src.database.db import sessionmanager
+from tests.benchmarks.generator import SyntheticDataset
+from tests.benchmarks.harness import KHNPParserStub, GPNApiStub, PipelineBenchmark
+
+# Объем синтетических данных
+BENCHMARK_COMPANIES = int(os.environ.get('BENCHMARK_COMPANIES', '50'))
+BENCHMARK_CARDS_PER_COMPANY = int(os.environ.get('BENCHMARK_CARDS_PER_COMPANY', '10'))
+BENCHMARK_TRANSACTIONS_PER_CARD = int(os.environ.get('BENCHMARK_TRANSACTIONS_PER_CARD', '40'))
+
+STAGES = [
+    "khnp_load_transactions",
+    "gpn_load_transactions",
+    "calc_balances",
+    "calc_overdrafts",
+    "khnp_set_card_states",
+    "gpn_set_card_states",
+    "gpn_set_card_group_limit",
+]
+
+# Каждый этап конвейера - фикстура уровня модуля: этап выполняется один раз, после этапов, от которых зависит,
+# независимо от того, какие тесты запущены и в каком порядке.
+
+
+@pytest.fixture(scope="module")
+def benchmark() -> PipelineBenchmark:
+    return PipelineBenchmark(sessionmanager.get_engine())
+
+
+@pytest.fixture(scope="module")
+async def dataset() -> SyntheticDataset:
+    dataset = SyntheticDataset(
+        companies=BENCHMARK_COMPANIES,
+        cards_per_company=BENCHMARK_CARDS_PER_COMPANY,
+        transactions_per_card=BENCHMARK_TRANSACTIONS_PER_CARD
+    )
+    async with sessionmanager.session() as session:
+        await dataset.load(session)
+
+    return dataset
+
+
+@pytest.fixture(scope="module")
+def khnp_parser_stub(dataset: SyntheticDataset) -> KHNPParserStub:
+    parser = KHNPParserStub(dataset)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(khnp_controller, "KHNPParser", lambda logger: parser)
+        yield parser
+
+
+@pytest.fixture(scope="module")
+async def gpn_api_stub(dataset: SyntheticDataset) -> GPNApiStub:
+    api = GPNApiStub(dataset, celery_logger)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(gpn_controller, "GPNApi", lambda logger: api)
+        yield api
+
+    await api.close()
+
+
+@pytest.fixture(scope="module")
+async def khnp_irrelevant_balances(benchmark: PipelineBenchmark, khnp_parser_stub: KHNPParserStub) \
+        -> IrrelevantBalances:
+    async with sessionmanager.session() as session:
+        khnp = KHNPController(session, celery_logger)
+        await khnp.init_system()
+        async with benchmark.stage("khnp_load_transactions"):
+            await khnp.load_transactions(need_authorization=False)
+
+        return khnp._irrelevant_balances
+
+
+@pytest.fixture(scope="module")
+async def gpn_irrelevant_balances(benchmark: PipelineBenchmark, gpn_api_stub: GPNApiStub,
+                                  khnp_irrelevant_balances: IrrelevantBalances) -> IrrelevantBalances:
+    # Синхронизации систем выполняются параллельно, в тесте - одна за другой
+    async with sessionmanager.session() as session:
+        gpn = GPNController(session, celery_logger)
+        await gpn.init_system()
+        async with benchmark.stage("gpn_load_transactions"):
+            await gpn.load_transactions()
+
+        return gpn._irrelevant_balances
+
+
+@pytest.fixture(scope="module")
+async def balance_ids(benchmark: PipelineBenchmark, khnp_irrelevant_balances: IrrelevantBalances,
+                      gpn_irrelevant_balances: IrrelevantBalances) -> Dict[str, List[str]]:
+    irrelevant_balances = IrrelevantBalances()
+    for ib in (khnp_irrelevant_balances, gpn_irrelevant_balances):
+        irrelevant_balances.extend(ib['data'])
+        irrelevant_balances.extend_updated(ib['updated'])
+
+    async with sessionmanager.session() as session:
+        cb = CalcBalances(session)
+        async with benchmark.stage("calc_balances"):
+            return await cb.calculate(irrelevant_balances, celery_logger, sessionmanager)
+
+
+@pytest.fixture(scope="module")
+async def overdrafts(benchmark: PipelineBenchmark, balance_ids: Dict[str, List[str]]) -> None:
+    async with sessionmanager.session() as session:
+        overdraft = Overdraft(session, celery_logger)
+        async with benchmark.stage("calc_overdrafts"):
+            await overdraft.calculate()
+
+
+@pytest.fixture(scope="module")
+async def khnp_card_states(benchmark: PipelineBenchmark, khnp_parser_stub: KHNPParserStub,
+                           balance_ids: Dict[str, List[str]], overdrafts: None) -> List[str]:
+    async with sessionmanager.session() as session:
+        khnp = KHNPController(session, celery_logger)
+        async with benchmark.stage("khnp_set_card_states"):
+            await khnp.set_card_states(balance_ids)
+
+    return khnp_parser_stub.changed_card_states
+
+
+@pytest.fixture(scope="module")
+async def gpn_card_states(benchmark: PipelineBenchmark, gpn_api_stub: GPNApiStub, balance_ids: Dict[str, List[str]],
+                          overdrafts: None) -> Dict[str, bool]:
+    async with sessionmanager.session() as session:
+        gpn = GPNController(session, celery_logger)
+        async with benchmark.stage("gpn_set_card_states"):
+            await gpn.set_card_states(balance_ids)
+
+    return gpn_api_stub.changed_card_states
+
+
+@pytest.fixture(scope="module")
+async def gpn_card_group_limits(benchmark: PipelineBenchmark, gpn_api_stub: GPNApiStub,
+                                balance_ids: Dict[str, List[str]], gpn_card_states: Dict[str, bool]) \
+        -> Dict[str, int]:
+    async with sessionmanager.session() as session:
+        gpn = GPNController(session, celery_logger)
+        async with benchmark.stage("gpn_set_card_group_limit"):
+            await gpn.set_card_group_limit(balance_ids["to_set_limits"])
+
+    return gpn_api_stub.requests
+
+
+@pytest.mark.benchmark
+@pytest.mark.order(8)
+class TestPipelineBenchmark:
+
+    """
+    Нагрузочное тестирование конвейера синхронизация ХНП и ГПН -> пересчет балансов -> овердрафты ->
+    блокировка карт -> лимиты на группы карт ГПН.
+    Запуск: pytest tests/benchmarks -m benchmark -s
+    """
+
+    async def test_khnp_load_transactions(self, khnp_irrelevant_balances: IrrelevantBalances):
+        assert khnp_irrelevant_balances["data"], "Удаленные транзакции ХНП не привели к пересчету балансов"
+
+    async def test_gpn_load_transactions(self, gpn_irrelevant_balances: IrrelevantBalances, gpn_api_stub: GPNApiStub):
+        assert gpn_irrelevant_balances["data"], "Удаленные транзакции ГПН не привели к пересчету балансов"
+        assert gpn_api_stub.requests["transactions"] > 1, "Транзакции ГПН получены не постранично"
+
+    async def test_calc_balances(self, balance_ids: Dict[str, List[str]]):
+        assert balance_ids["to_set_limits"], "Нет балансов для установки лимитов"
+
+    async def test_calc_overdrafts(self, overdrafts: None):
+        pass
+
+    async def test_khnp_set_card_states(self, khnp_card_states: List[str], balance_ids: Dict[str, List[str]]):
+        if balance_ids["to_block"]:
+            assert khnp_card_states, "Карты ХНП не заблокированы"
+
+    async def test_gpn_set_card_states(self, gpn_card_states: Dict[str, bool], balance_ids: Dict[str, List[str]]):
+        if balance_ids["to_block"]:
+            assert any(gpn_card_states.values()), "Карты ГПН не заблокированы"
+
+    async def test_gpn_set_card_group_limit(self, gpn_card_group_limits: Dict[str, int]):
+        assert gpn_card_group_limits["setLimit"], "Лимиты на группы карт ГПН не установлены"
+
+    async def test_report(self, benchmark: PipelineBenchmark, khnp_card_states: List[str],
+                          gpn_card_group_limits: Dict[str, int]):
+        print()
+        print(
+            f"Организаций: {BENCHMARK_COMPANIES}, карт на организацию: {BENCHMARK_CARDS_PER_COMPANY} ХНП и "
+            f"{BENCHMARK_CARDS_PER_COMPANY} ГПН, транзакций на карту: {BENCHMARK_TRANSACTIONS_PER_CARD}"
+        )
+        print(benchmark.report())
+        assert sorted(metrics.name for metrics in benchmark.metrics) == sorted(STAGES)
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from src.utils.page_fetcher import PageFetcher
+
+
+@pytest.mark.order(11)
+class TestPageFetcher:
+
+    """
+    Параллельная загрузка страниц с ограничением числа одновременных запросов
+    """
+
+    async def test_pages_are_returned_in_order(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def fetch_page(page_key: int) -> int:
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            # Последние страницы отвечают быстрее первых
+            await asyncio.sleep(0.001 * (20 - page_key))
+            in_flight -= 1
+            return page_key * 10
+
+        pages = await PageFetcher(max_in_flight=3).fetch_all(fetch_page, range(20))
+
+        assert pages == [page_key * 10 for page_key in range(20)]
+        assert max_in_flight == 3
+
+    async def test_failed_page_is_retried(self):
+        calls = {}
+
+        async def fetch_page(page_key: int) -> int:
+            calls[page_key] = calls.get(page_key, 0) + 1
+            if page_key == 2 and calls[page_key] < 3:
+                raise ConnectionError()
+
+            return page_key
+
+        pages = await PageFetcher(max_in_flight=2, retries=3, retry_delay=0).fetch_all(fetch_page, range(4))
+
+        assert pages == [0, 1, 2, 3]
+        assert calls == {0: 1, 1: 1, 2: 3, 3: 1}
+
+    async def test_retries_exhausted(self):
+        async def fetch_page(page_key: int) -> int:
+            raise ConnectionError()
+
+        with pytest.raises(ConnectionError):
+            await PageFetcher(max_in_flight=2, retries=2, retry_delay=0).fetch_all(fetch_page, range(2))
+
+    async def test_unexpected_error_is_not_retried(self):
+        calls = 0
+
+        def fetch_page(page_key: int) -> int:
+            nonlocal calls
+            calls += 1
+            raise ValueError()
+
+        page_fetcher = PageFetcher(max_in_flight=2, retries=3, retry_delay=0, retry_on=(ConnectionError,))
+        with pytest.raises(ValueError):
+            page_fetcher.fetch_all_sync(fetch_page, [1])
+
+        assert calls == 1
+
+    async def test_fetch_all_sync(self):
+        pages = PageFetcher(max_in_flight=4).fetch_all_sync(lambda page_key: page_key + 1, range(10))
+        assert pages == list(range(1, 11))
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from src.celery_tasks.gpn.api import GPNApi
+from src.utils.log import ColoredLogger
+from src.utils.rate_limiter import TokenBucket
+
+PRODUCT_TYPES = [{"id": "fuel"}, {"id": "goods"}]
+
+
+def make_remote_limit(limit_id: str, product_type_id: str, value: int) -> dict:
+    return {
+        "id": limit_id,
+        "productType": product_type_id,
+        "sum": {"currency": "810", "value": value},
+    }
+
+
+@pytest.mark.order(12)
+class TestGPNCardGroupLimits:
+
+    """
+    Вычисление изменившихся лимитов на группы карт ГПН и ограничение частоты запросов
+    """
+
+    @pytest.fixture
+    async def api(self):
+        api = GPNApi(ColoredLogger(logfile_name='schedule.log', logger_name='GPN_TEST'))
+        api.contract_id = "contract"
+        yield api
+        await api.close()
+
+    async def test_unchanged_limits_are_skipped(self, api):
+        new_limits = api.make_card_group_limits_diff(
+            limit_values={"111": 1000},
+            group_ids={"111": "group-1"},
+            current_limits={"111": [
+                make_remote_limit("limit-1", "fuel", 1000),
+                make_remote_limit("limit-2", "goods", 1000),
+            ]},
+            product_types=PRODUCT_TYPES
+        )
+
+        assert new_limits == []
+
+    async def test_changed_and_missing_limits(self, api):
+        new_limits = api.make_card_group_limits_diff(
+            limit_values={"111": 2000, "222": 500},
+            group_ids={"111": "group-1", "222": "group-2"},
+            current_limits={
+                "111": [make_remote_limit("limit-1", "fuel", 1000), make_remote_limit("limit-2", "goods", 2000)],
+                "222": [],
+            },
+            product_types=PRODUCT_TYPES
+        )
+
+        assert [
+            (limit["group_id"], limit["productType"], limit.get("id"), limit["sum"]["value"])
+            for limit in new_limits
+        ] == [
+            ("group-1", "fuel", "limit-1", 2000),
+            ("group-2", "fuel", None, 500),
+            ("group-2", "goods", None, 500),
+        ]
+
+    async def test_token_bucket(self):
+        rate_limiter = TokenBucket(rate=20, capacity=5)
+
+        started = time.perf_counter()
+        for _ in range(5):
+            await rate_limiter.acquire()
+        assert time.perf_counter() - started < 0.05
+
+        # Сверх емкости корзины запросы выполняются не чаще rate в секунду
+        started = time.perf_counter()
+        for _ in range(4):
+            await rate_limiter.acquire()
+        assert time.perf_counter() - started >= 0.15
@@ -0,0 +1,45 @@
+import pytest
+
+from src.celery_tasks.gpn.api import GPNCardsDiff
+
+
+def make_remote_card(card_id: str, group_id: str | None = None, status: str = "Active") -> dict:
+    return {"id": card_id, "number": f"70000000000{card_id}", "group_id": group_id, "status": status}
+
+
+@pytest.mark.order(13)
+class TestGPNCardsDiff:
+
+    """
+    Изменения в списке карт ГПН по сравнению с предыдущим снимком
+    """
+
+    async def test_cards_diff(self):
+        previous_cards = {
+            "1": make_remote_card("1"),
+            "2": make_remote_card("2", group_id="group-1"),
+            "3": make_remote_card("3"),
+        }
+        cards = {
+            "1": make_remote_card("1"),
+            "2": make_remote_card("2", group_id="group-2"),
+            "4": make_remote_card("4", status="Locked"),
+        }
+
+        cards_diff = GPNCardsDiff(previous_cards, cards)
+
+        assert cards_diff
+        assert [card["id"] for card in cards_diff.added] == ["4"]
+        assert [card["id"] for card in cards_diff.removed] == ["3"]
+        assert [card["id"] for card in cards_diff.changed] == ["2"]
+
+    async def test_no_changes(self):
+        cards = {"1": make_remote_card("1"), "2": make_remote_card("2", group_id="group-1")}
+        assert not GPNCardsDiff(cards, dict(cards))
+
+    async def test_first_snapshot(self):
+        cards = {"1": make_remote_card("1"), "2": make_remote_card("2")}
+        cards_diff = GPNCardsDiff({}, cards)
+
+        assert len(cards_diff.added) == 2
+        assert not cards_diff.removed and not cards_diff.changed
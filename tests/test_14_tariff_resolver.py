@@ -0,0 +1,54 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from src.celery_tasks.transaction_helper import TariffResolver
+
+
+def make_period(tariff: str, start_date: date, end_date: date | None = None) -> SimpleNamespace:
+    return SimpleNamespace(balance_id="balance", tariff=tariff, start_date=start_date, end_date=end_date)
+
+
+@pytest.mark.order(14)
+class TestTariffResolver:
+
+    """
+    Определение тарифа баланса на дату транзакции по истории тарифов
+    """
+
+    async def test_sequential_periods(self):
+        resolver = TariffResolver([
+            make_period("t2", date(2024, 2, 1), date(2024, 3, 1)),
+            make_period("t1", date(2024, 1, 1), date(2024, 2, 1)),
+        ], [])
+
+        assert resolver.get_tariff_on_date("balance", date(2023, 12, 31)) is None
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 15)) == "t1"
+        assert resolver.get_tariff_on_date("balance", date(2024, 2, 1)) == "t2"
+        # После окончания последнего периода тариф не определен
+        assert resolver.get_tariff_on_date("balance", date(2024, 3, 1)) is None
+        assert resolver.get_tariff_on_date("unknown", date(2024, 1, 15)) is None
+
+    async def test_gap_between_periods(self):
+        resolver = TariffResolver([
+            make_period("t1", date(2024, 1, 1), date(2024, 1, 10)),
+            make_period("t2", date(2024, 1, 20)),
+        ], [])
+
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 15)) is None
+        assert resolver.get_tariff_on_date("balance", date(2030, 1, 1)) == "t2"
+
+    async def test_overlapping_periods(self):
+        # Период, начавшийся позже, перекрывает более ранний, после его окончания снова действует ранний
+        resolver = TariffResolver([
+            make_period("t1", date(2024, 1, 1)),
+            make_period("t2", date(2024, 1, 10), date(2024, 1, 20)),
+            make_period("t3", date(2024, 1, 15), date(2024, 1, 18)),
+        ], [])
+
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 5)) == "t1"
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 12)) == "t2"
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 16)) == "t3"
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 19)) == "t2"
+        assert resolver.get_tariff_on_date("balance", date(2024, 1, 25)) == "t1"
@@ -0,0 +1,220 @@
+import json
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Set
+
+import pytest
+from sqlalchemy import select as sa_select, func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from src.database.db import sessionmanager
+from src.database.model.models import Transaction as TransactionOrm
+from src.repositories.transaction_partition import TransactionPartitionRepository
+from src.utils.enums import TransactionType
+
+
+# Таблица транзакций секционирована: в плане узлы сканирования ссылаются на секции
+# (transaction_default, transaction_yYYYYmMM), а не на родительскую таблицу
+TRANSACTION_RELATION = re.compile(r"^transaction(_default|_y\d{4}m\d{2})?$")
+
+
+def relations_with_seq_scan(plan: Dict[str, Any]) -> List[str]:
+    relations = []
+    if plan.get("Node Type") == "Seq Scan":
+        relations.append(plan.get("Relation Name"))
+
+    for subplan in plan.get("Plans", []):
+        relations.extend(relations_with_seq_scan(subplan))
+
+    return relations
+
+
+def scanned_relations(plan: Dict[str, Any]) -> Set[str]:
+    relations = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for subplan in plan.get("Plans", []):
+        relations.update(scanned_relations(subplan))
+
+    return relations
+
+
+def transaction_seq_scans(plan: Dict[str, Any]) -> List[str]:
+    return [relation for relation in relations_with_seq_scan(plan) if TRANSACTION_RELATION.match(relation)]
+
+
+def transaction_partitions(plan: Dict[str, Any]) -> Set[str]:
+    return {relation for relation in scanned_relations(plan) if TRANSACTION_RELATION.match(relation)}
+
+
+def plan_indexes(plan: Dict[str, Any]) -> Set[str]:
+    indexes = {plan["Index Name"]} if "Index Name" in plan else set()
+    for subplan in plan.get("Plans", []):
+        indexes.update(plan_indexes(subplan))
+
+    return indexes
+
+
+async def used_indexes(plan: Dict[str, Any]) -> Set[str]:
+    # В плане указаны индексы секций (transaction_y2026m09_card_id_date_time_idx и т.п.), имена которых
+    # формирует Postgres. Приводим их к индексам родительской таблицы, объявленным в модели.
+    names = list(plan_indexes(plan))
+    if not names:
+        return set()
+
+    async with sessionmanager.session() as session:
+        result = await session.execute(
+            text(
+                "SELECT coalesce(root.relname, idx.relname) FROM pg_class idx "
+                "JOIN pg_namespace ns ON ns.oid = idx.relnamespace "
+                "LEFT JOIN pg_class root ON root.oid = pg_partition_root(idx.oid) "
+                "WHERE ns.nspname = 'cargonomica' AND idx.relname = ANY(:names)"
+            ),
+            {"names": names}
+        )
+        return set(result.scalars().all())
+
+
+async def explain(stmt) -> Dict[str, Any]:
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    async with sessionmanager.session() as session:
+        # На тестовом объеме данных последовательное сканирование небольших секций дешевле любого индекса.
+        # Запрещаем его, чтобы планировщик выбирал между индексами: какой из них использован, проверяют тесты.
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        result = await session.execute(text("EXPLAIN (FORMAT JSON) " + sql))
+        plan = result.scalar()
+        await session.rollback()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]["Plan"]
+
+
+@pytest.mark.incremental
+@pytest.mark.order(7)
+class TestQueryPlans:
+
+    """
+    Планы выполнения запросов к таблице транзакций: запросы должны использовать предназначенные для них индексы
+    """
+
+    balance_id = str(uuid.uuid4())
+    system_id = str(uuid.uuid4())
+    card_id = str(uuid.uuid4())
+    now = datetime.now()
+
+    async def test_seed_transactions(self):
+        dataset = [
+            {
+                "date_time": self.now - timedelta(minutes=i * 10),
+                "date_time_load": self.now - timedelta(minutes=i * 10),
+                "transaction_type": TransactionType.PURCHASE if i % 10 else TransactionType.OVERDRAFT_FEE,
+                "total_sum": -100,
+                "company_balance": 0,
+                "comments": "",
+            } for i in range(5000)
+        ]
+        async with sessionmanager.session() as session:
+            # Секции за месяцы, в которые попадают тестовые транзакции
+            partition_repository = TransactionPartitionRepository(session)
+            await partition_repository.create_monthly_partitions((self.now - timedelta(days=60)).date(), 3)
+
+            await session.execute(pg_insert(TransactionOrm), dataset)
+            await session.commit()
+            await session.execute(text("ANALYZE cargonomica.transaction"))
+            await session.commit()
+
+            count = await session.scalar(sa_select(func.count(TransactionOrm.id)))
+
+        assert count >= 5000, "Не удалось заполнить таблицу транзакций"
+
+    # Пересчет балансов: транзакции баланса, начиная с указанного времени
+    async def test_balance_transactions_plan(self):
+        stmt = (
+            sa_select(TransactionOrm.id, TransactionOrm.total_sum)
+            .where(TransactionOrm.balance_id == self.balance_id)
+            .where(TransactionOrm.date_time_load >= self.now - timedelta(days=3))
+            .order_by(TransactionOrm.date_time_load, TransactionOrm.load_seq)
+        )
+        plan = await explain(stmt)
+        assert not transaction_seq_scans(plan), plan
+        assert await used_indexes(plan) == {"ix_transaction_balance_load"}, plan
+
+    # Пересчет балансов: баланс после последней транзакции
+    async def test_closing_balance_plan(self):
+        stmt = (
+            sa_select(TransactionOrm.balance_id, TransactionOrm.company_balance)
+            .where(TransactionOrm.balance_id.in_([self.balance_id]))
+            .distinct(TransactionOrm.balance_id)
+            .order_by(
+                TransactionOrm.balance_id,
+                TransactionOrm.date_time_load.desc(),
+                TransactionOrm.load_seq.desc()
+            )
+        )
+        plan = await explain(stmt)
+        assert not transaction_seq_scans(plan), plan
+        assert await used_indexes(plan) == {"ix_transaction_balance_load"}, plan
+
+    # Синхронизация: транзакции поставщика услуг за период
+    async def test_recent_system_transactions_plan(self):
+        stmt = (
+            sa_select(TransactionOrm.id)
+            .where(TransactionOrm.date_time >= (self.now - timedelta(days=7)).date())
+            .where(TransactionOrm.system_id == self.system_id)
+        )
+        plan = await explain(stmt)
+        assert not transaction_seq_scans(plan), plan
+        assert await used_indexes(plan) == {"ix_transaction_system_date"}, plan
+
+    # Время последнего использования карты
+    async def test_card_date_last_use_plan(self):
+        stmt = (
+            sa_select(func.max(TransactionOrm.date_time))
+            .where(TransactionOrm.card_id == self.card_id)
+        )
+        plan = await explain(stmt)
+        assert not transaction_seq_scans(plan), plan
+        assert await used_indexes(plan) == {"ix_transaction_card_date"}, plan
+
+    # Комиссионные транзакции за текущий день
+    async def test_fee_transactions_plan(self):
+        today = self.now.date()
+        stmt = (
+            sa_select(TransactionOrm.balance_id)
+            .where(TransactionOrm.date_time_load >= today)
+            .where(TransactionOrm.date_time_load < today + timedelta(days=1))
+            .where(TransactionOrm.transaction_type == TransactionType.OVERDRAFT_FEE)
+        )
+        plan = await explain(stmt)
+        assert not transaction_seq_scans(plan), plan
+        assert await used_indexes(plan) == {"ix_transaction_type_load"}, plan
+
+    # Список транзакций за период
+    async def test_transactions_by_period_plan(self):
+        stmt = (
+            sa_select(TransactionOrm.id)
+            .where(TransactionOrm.date_time >= self.now - timedelta(days=30))
+            .where(TransactionOrm.date_time < self.now)
+        )
+        plan = await explain(stmt)
+        assert not transaction_seq_scans(plan), plan
+        assert await used_indexes(plan) == {"ix_transaction_date_time"}, plan
+
+    # Отсечение секций: запрос за ограниченный период обращается не более чем к двум помесячным секциям
+    async def test_partition_pruning(self):
+        for days in (1, 7, 30):
+            stmt = (
+                sa_select(TransactionOrm.id)
+                .where(TransactionOrm.date_time >= self.now - timedelta(days=days))
+                .where(TransactionOrm.date_time < self.now)
+            )
+            plan = await explain(stmt)
+            partitions = transaction_partitions(plan)
+            assert partitions, plan
+            assert len(partitions) <= 2, partitions
+
+        # Без ограничения по времени просматриваются все секции
+        plan = await explain(sa_select(TransactionOrm.id))
+        assert len(transaction_partitions(plan)) > 2, transaction_partitions(plan)
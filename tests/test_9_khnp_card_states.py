@@ -0,0 +1,102 @@
+import pytest
+
+from src.celery_tasks.khnp.api import CardStatus
+from src.celery_tasks.khnp.controller import KHNPController
+from src.database.model.card import CardOrm, BlockingCardReason
+
+ACTIVE = "Активная"
+PIN = "Заблокирована по ПИН"
+BLOCKED = "Заблокирована"
+
+# Карта должна быть активна / заблокирована, причина блокировки локальной карты, статус карты в ХНП,
+# запрос на смену статуса карты в ХНП -> ожидаемые статус карты, причина блокировки, смена статуса в ХНП
+CARD_STATE_CASES = [
+    # Карты, которые должны быть активны
+    ("to_activate", None, ACTIVE, CardStatus.ACTIVE, True, None, False),
+    ("to_activate", None, ACTIVE, CardStatus.BLOCKING_PENDING, True, BlockingCardReason.NNK, True),
+    ("to_activate", None, ACTIVE, CardStatus.BLOCKED, True, BlockingCardReason.NNK, True),
+    ("to_activate", None, ACTIVE, CardStatus.ACTIVATE_PENDING, True, None, False),
+    ("to_activate", None, PIN, CardStatus.BLOCKED, False, BlockingCardReason.PIN, False),
+    ("to_activate", None, BLOCKED, CardStatus.BLOCKED, True, None, False),
+
+    # Карты, которые должны быть заблокированы (блокировка ННК)
+    ("to_block", None, ACTIVE, CardStatus.ACTIVE, False, BlockingCardReason.NNK, True),
+    ("to_block", BlockingCardReason.NNK, ACTIVE, CardStatus.ACTIVE, False, BlockingCardReason.NNK, True),
+    ("to_block", BlockingCardReason.NNK, BLOCKED, CardStatus.ACTIVATE_PENDING, False, BlockingCardReason.NNK, True),
+    ("to_block", BlockingCardReason.NNK, ACTIVE, CardStatus.BLOCKED, False, BlockingCardReason.NNK, False),
+    ("to_block", BlockingCardReason.NNK, ACTIVE, CardStatus.BLOCKING_PENDING, False, BlockingCardReason.NNK,
+     False),
+    ("to_block", BlockingCardReason.NNK, PIN, CardStatus.BLOCKED, False, BlockingCardReason.PIN, False),
+    ("to_block", BlockingCardReason.NNK, PIN, CardStatus.ACTIVATE_PENDING, False, BlockingCardReason.PIN, True),
+
+    # Карты, заблокированные по ПИН
+    ("to_block", BlockingCardReason.PIN, ACTIVE, CardStatus.ACTIVE, True, None, False),
+    ("to_block", BlockingCardReason.PIN, ACTIVE, CardStatus.BLOCKING_PENDING, True, None, True),
+    ("to_block", BlockingCardReason.PIN, ACTIVE, CardStatus.BLOCKED, False, BlockingCardReason.NNK, False),
+    ("to_block", BlockingCardReason.PIN, ACTIVE, CardStatus.ACTIVATE_PENDING, True, None, False),
+    ("to_block", BlockingCardReason.PIN, PIN, CardStatus.ACTIVATE_PENDING, False, BlockingCardReason.PIN, True),
+    ("to_block", BlockingCardReason.PIN, PIN, CardStatus.BLOCKED, False, BlockingCardReason.PIN, False),
+
+    # Карты, заблокированные вручную, не изменяются
+    ("to_block", BlockingCardReason.MANUALLY, ACTIVE, CardStatus.ACTIVE, False, BlockingCardReason.MANUALLY, False),
+    ("to_block", BlockingCardReason.COMPANY, ACTIVE, CardStatus.ACTIVE, False, BlockingCardReason.COMPANY, False),
+]
+
+
+def make_local_card(card_number: str, is_active: bool, reason_for_blocking: BlockingCardReason | None) -> CardOrm:
+    card = CardOrm(
+        external_id=None,
+        card_number=card_number,
+        card_type_id=None,
+        is_active=is_active,
+        company_id=None,
+        belongs_to_car_id=None,
+        belongs_to_driver_id=None,
+        group_id=None
+    )
+    card.reason_for_blocking = reason_for_blocking
+    return card
+
+
+@pytest.mark.incremental
+@pytest.mark.order(9)
+class TestKHNPCardStates:
+
+    """
+    Сверка статусов карт ХНП с требуемыми статусами локальных карт
+    """
+
+    @pytest.mark.parametrize(
+        "group, reason, status_name, block_request, expected_is_active, expected_reason, expected_change",
+        CARD_STATE_CASES
+    )
+    async def test_card_state_transition(self, group, reason, status_name, block_request, expected_is_active,
+                                         expected_reason, expected_change):
+        card_number = "7000000000000001"
+        local_card = make_local_card(card_number, is_active=group == "to_activate", reason_for_blocking=reason)
+        remote_cards = [
+            {"cardNo": "7000000000000002", "status_name": ACTIVE, "cardBlockRequest": CardStatus.ACTIVE.value},
+            {"cardNo": card_number, "status_name": status_name, "cardBlockRequest": block_request.value},
+        ]
+
+        cards_to_change_state, local_cards = KHNPController.compare_khnp_card_states(
+            remote_cards=remote_cards,
+            local_cards_to_be_active=[local_card] if group == "to_activate" else [],
+            local_cards_to_be_blocked=[local_card] if group == "to_block" else []
+        )
+
+        assert local_cards == [local_card]
+        assert local_card.is_active == expected_is_active
+        assert local_card.reason_for_blocking == expected_reason
+        assert (card_number in cards_to_change_state) == expected_change
+
+    async def test_card_missing_in_khnp(self):
+        local_card = make_local_card("7000000000000001", is_active=False, reason_for_blocking=BlockingCardReason.PIN)
+        cards_to_change_state, _ = KHNPController.compare_khnp_card_states(
+            remote_cards=[],
+            local_cards_to_be_active=[],
+            local_cards_to_be_blocked=[local_card]
+        )
+
+        assert not cards_to_change_state
+        assert not local_card.is_active and local_card.reason_for_blocking == BlockingCardReason.PIN